@@ -0,0 +1,36 @@
+#Auto approach conditions
+#
+#The stop conditions are kept in one place so that the continuous auto approach, the step approach
+#and offline tools all evaluate exactly the same thing. The functions only use comparison and "|",
+#so they work on plain floats as well as on NumPy arrays (e.g. whole traces or threshold sweeps).
+
+
+def approachConditionMet(amp, zpi, defl, initialAmp, ampRatio, zpiLimit, defLimit):
+    return (amp < initialAmp*ampRatio) | (zpi < zpiLimit) | (defl > defLimit)
+
+
+def approachMargin(amp, zpi, defl, initialAmp, initialZpi, initialDef, ampRatio, zpiLimit, defLimit):
+    #Remaining distance to the closest stop condition, normalized to the distance at the start
+    #of the approach: 1 = nothing has changed yet, 0 = threshold reached
+    margins = []
+
+    ampTh = initialAmp*ampRatio
+    if initialAmp > ampTh:
+        margins.append((amp - ampTh)/(initialAmp - ampTh))
+
+    if initialZpi > zpiLimit:
+        margins.append((zpi - zpiLimit)/(initialZpi - zpiLimit))
+
+    if defLimit > initialDef:
+        margins.append((defLimit - defl)/(defLimit - initialDef))
+
+    if len(margins) == 0:
+        return 1.0
+
+    return min(max(min(margins), 0.0), 1.0)
+
+
+def stepApproachSize(margin, maxStep, minStep):
+    #Step size shrinks linearly with the margin, but never below minStep
+    step = int(round(maxStep*margin))
+    return max(minStep, min(step, maxStep))
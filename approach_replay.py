@@ -0,0 +1,246 @@
+#!/home/afm/python/daq_venv/bin/python
+
+#Approach replay
+#
+#Feeds a meter recording (meter_recorder, .mrec) through the trigger filter and the stop
+#conditions of the auto approach and reports when each combination of ampRatio, zpiLimit and
+#defLimit would have stopped the motor, so the thresholds can be tuned without approaching real
+#tips.
+#
+#The filtering is the one of MainWindow.updateADTimer (signal_filter.ApproachSignalFilter, sample
+#by sample, the amplitude baseline frozen from the start of the approach on), the reference
+#amplitude the one of AutoApproachButtonFunction. The sweep itself is vectorized: the conditions
+#are monotonic in their threshold, so the first trigger of every threshold follows from the
+#running minimum (amplitude, z-piezo) or maximum (deflection) of the filtered trace with one
+#searchsorted, and the combinations are the elementwise minimum of the three (broadcast to
+#amp x zpi x def). approach.approachConditionMet is evaluated at the reported samples as a check.
+#
+#With the time of the real contact (--contact) every combination is classified as
+#       early   triggered more than --window s before the contact (false trigger on noise/drift)
+#       safe    triggered between --window and --margin s before the contact
+#       late    triggered less than --margin s before the contact, after it or never
+#and the safe combination that triggers last (closest to the surface) is recommended.
+#
+#Usage:
+#       approach_replay.py RECORDING [--start S] [--contact S] [--margin S] [--window S]
+#                          [--amp-ratios 0.3:0.95:0.05] [--zpi-limits LIST] [--def-limits LIST]
+#                          [--filter 0-3] [--filter-window N] [--baseline-window N]
+#                          [--ad-update-ms MS] [--average-n N]
+#                          [--settings settings.json] [--top N] [--csv FILE]
+#
+#Times are in s from the first sample of the recording. Lists are "a,b,c" or "start:stop:step"
+#(stop included). Thresholds and filter settings not given are taken from the settings file.
+
+import argparse
+import csv
+
+import numpy as np
+
+import approach
+import meter_recorder
+import settings_store
+import signal_filter
+
+CONDITIONS = ["amp", "zpi", "def"]
+
+
+def parseValues(text):
+    if ":" in text:
+        start, stop, step = [float(v) for v in text.split(":")]
+        return np.round(np.arange(start, stop + step/2, step), 6)
+    return np.array([float(v) for v in text.split(",")])
+
+
+def filterRecording(amp,defl,zpi,times,start,filterType,window,baselineWindow,maxAgeS=None,averageN=20):
+    #returns the filtered amplitude, deflection and z-piezo and the reference amplitude at start;
+    #without enough baseline samples in maxAgeS the GUI averages averageN new readings, here the
+    #last averageN samples before the start stand in for them
+    triggerFilter = signal_filter.ApproachSignalFilter(filterType, window, baselineWindow)
+    n = len(amp)
+    ampF = np.zeros(n)
+    defF = np.zeros(n)
+    zpiF = np.zeros(n)
+    initialAmp = None
+    for i in range(0,n+1):
+        if i == min(start,n):
+            initialAmp = triggerFilter.baseline(default=None, maxAgeS=maxAgeS, minSamples=averageN)
+            if initialAmp == None:
+                initialAmp = float(np.mean(amp[max(i-averageN,0):max(i,1)]))
+        if i < n:
+            ampF[i], defF[i], zpiF[i] = triggerFilter.update(amp[i], defl[i], zpi[i], trackBaseline=i < start, t=times[i])
+    return ampF, defF, zpiF, initialAmp
+
+
+def firstBelow(x,thresholds):
+    #index of the first sample of x below each threshold, len(x) if there is none
+    runMin = np.minimum.accumulate(x)
+    return np.searchsorted(-runMin, -np.asarray(thresholds), side='right')
+
+
+def firstAbove(x,thresholds):
+    runMax = np.maximum.accumulate(x)
+    return np.searchsorted(runMax, np.asarray(thresholds), side='right')
+
+
+def sweepThresholds(ampF,defF,zpiF,initialAmp,ampRatios,zpiLimits,defLimits):
+    #first trigger index (relative to the first sample given, len = never) and the condition that
+    #fired (index into CONDITIONS, -1 = never) of every combination, shape amp x zpi x def
+    n = len(ampF)
+    if n == 0:
+        shape = (len(ampRatios), len(zpiLimits), len(defLimits))
+        return np.zeros(shape, dtype=int), np.full(shape, -1)
+
+    ampIdx = firstBelow(ampF, initialAmp*np.asarray(ampRatios))
+    zpiIdx = firstBelow(zpiF, zpiLimits)
+    defIdx = firstAbove(defF, defLimits)
+
+    stacked = np.broadcast_arrays(ampIdx[:,None,None], zpiIdx[None,:,None], defIdx[None,None,:])
+    stacked = np.stack(stacked)
+    index = stacked.min(axis=0)
+    condition = np.where(index < n, stacked.argmin(axis=0), -1)
+    return index, condition
+
+
+def checkTriggers(ampF,defF,zpiF,initialAmp,ampRatios,zpiLimits,defLimits,index):
+    #evaluates approach.approachConditionMet at the first trigger and the sample before it;
+    #returns the number of combinations that disagree with the sweep
+    n = len(ampF)
+    a, z, d = np.meshgrid(np.asarray(ampRatios), np.asarray(zpiLimits), np.asarray(defLimits), indexing='ij')
+    at = np.minimum(index, n - 1)
+    before = np.maximum(index - 1, 0)
+
+    metAt = approach.approachConditionMet(ampF[at], zpiF[at], defF[at], initialAmp, a, z, d)
+    #the running extremes decide, a condition met once stays met for the sweep
+    ampMin = np.minimum.accumulate(ampF)
+    zpiMin = np.minimum.accumulate(zpiF)
+    defMax = np.maximum.accumulate(defF)
+    metBefore = approach.approachConditionMet(ampMin[before], zpiMin[before], defMax[before], initialAmp, a, z, d)
+
+    wrong = (index < n) & ~metAt
+    wrong |= (index > 0) & (index < n) & metBefore
+    wrong |= (index >= n) & approach.approachConditionMet(ampMin[-1], zpiMin[-1], defMax[-1], initialAmp, a, z, d)
+    return int(np.count_nonzero(wrong))
+
+
+def replay(path,start=0.0,contact=None,margin=0.5,window=30.0,ampRatios=(0.5,),zpiLimits=(1.0,),defLimits=(1.0,),
+           filterType=signal_filter.FILTER_MEAN,filterWindow=5,baselineWindow=250,ADUpdateTimeMS=2,averageN=20):
+    meta, wallTimes, volts = meter_recorder.readRecording(path)
+    names = meta["names"]
+    if len(wallTimes) == 0:
+        raise ValueError("'" + path + "' holds no samples")
+    times = wallTimes - wallTimes[0]
+
+    amp = volts[names.index("amp")]
+    defl = volts[names.index("def")]
+    zpi = volts[names.index("zpi")]
+
+    first = int(np.searchsorted(times, start))
+    ampF, defF, zpiF, initialAmp = filterRecording(amp, defl, zpi, times, first, filterType, filterWindow, baselineWindow,
+                                                   1e-3*baselineWindow*ADUpdateTimeMS, averageN)
+    ampF = ampF[first:]
+    defF = defF[first:]
+    zpiF = zpiF[first:]
+
+    ampRatios = np.asarray(ampRatios, dtype=float)
+    zpiLimits = np.asarray(zpiLimits, dtype=float)
+    defLimits = np.asarray(defLimits, dtype=float)
+    index, condition = sweepThresholds(ampF, defF, zpiF, initialAmp, ampRatios, zpiLimits, defLimits)
+
+    n = len(ampF)
+    triggerTimes = np.full(index.shape, np.nan)
+    fired = index < n
+    triggerTimes[fired] = times[first + index[fired]]
+
+    report = {"path": path, "samples": len(times), "duration": float(times[-1]), "start": float(times[min(first, len(times)-1)]),
+              "initialAmp": float(initialAmp), "ampRatios": ampRatios, "zpiLimits": zpiLimits, "defLimits": defLimits,
+              "triggerTimes": triggerTimes, "condition": condition, "mismatches": 0, "contact": contact}
+    if n > 0:
+        report["mismatches"] = checkTriggers(ampF, defF, zpiF, initialAmp, ampRatios, zpiLimits, defLimits, index)
+
+    if contact != None:
+        lead = contact - triggerTimes
+        status = np.full(index.shape, "late", dtype=object)
+        status[lead > window] = "early"
+        status[(lead >= margin) & (lead <= window)] = "safe"
+        report["status"] = status
+        report["best"] = None
+        safe = np.flatnonzero(status == "safe")
+        if len(safe) > 0:
+            best = np.unravel_index(safe[np.argmax(triggerTimes.flat[safe])], index.shape)
+            report["best"] = (float(ampRatios[best[0]]), float(zpiLimits[best[1]]), float(defLimits[best[2]]),
+                              float(triggerTimes[best]), CONDITIONS[condition[best]])
+    return report
+
+
+def rows(report):
+    #one row per combination: ampRatio, zpiLimit, defLimit, trigger time, condition, status
+    result = []
+    for (i,j,k), t in np.ndenumerate(report["triggerTimes"]):
+        c = report["condition"][i,j,k]
+        status = report["status"][i,j,k] if "status" in report else ""
+        result.append((float(report["ampRatios"][i]), float(report["zpiLimits"][j]), float(report["defLimits"][k]),
+                       float(t), CONDITIONS[c] if c >= 0 else "never", status))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a meter recording through the auto approach trigger")
+    parser.add_argument("recording", help="meter recording (.mrec)")
+    parser.add_argument("--start", type=float, default=0.0, help="start of the approach in s")
+    parser.add_argument("--contact", type=float, default=None, help="time of the real contact in s")
+    parser.add_argument("--margin", type=float, default=0.5, help="required lead before the contact in s")
+    parser.add_argument("--window", type=float, default=30.0, help="earlier triggers count as false triggers, in s")
+    parser.add_argument("--amp-ratios", default=None, help="ampRatio values")
+    parser.add_argument("--zpi-limits", default=None, help="zpiLimit values in V")
+    parser.add_argument("--def-limits", default=None, help="defLimit values in V")
+    parser.add_argument("--filter", type=int, default=None, choices=range(0,4), help="trigger filter type")
+    parser.add_argument("--filter-window", type=int, default=None, help="trigger filter window")
+    parser.add_argument("--baseline-window", type=int, default=None, help="amplitude baseline window")
+    parser.add_argument("--ad-update-ms", type=int, default=None, help="full meter interval (ADUpdateTimeMS)")
+    parser.add_argument("--average-n", type=int, default=None, help="readings averaged without a baseline (stepAverageN)")
+    parser.add_argument("--settings", default="settings.json", help="settings file for the defaults")
+    parser.add_argument("--top", type=int, default=20, help="combinations listed")
+    parser.add_argument("--csv", default=None, help="write all combinations to this file")
+    args = parser.parse_args()
+
+    store = settings_store.SettingsStore(args.settings)
+    store.load()
+    values = lambda text, key, default: parseValues(text) if text != None else np.array([float(store.get(key, default))])
+    option = lambda value, key, default: value if value != None else int(store.get(key, default))
+
+    report = replay(args.recording, args.start, args.contact, args.margin, args.window,
+                    values(args.amp_ratios, "ampRatio", 0.5), values(args.zpi_limits, "zpiLimit", 1.0),
+                    values(args.def_limits, "defLimit", 1.0),
+                    option(args.filter, "triggerFilterType", signal_filter.FILTER_MEAN),
+                    option(args.filter_window, "triggerFilterWindow", 5), option(args.baseline_window, "baselineWindow", 250),
+                    option(args.ad_update_ms, "ADUpdateTimeMS", 2), option(args.average_n, "stepAverageN", 20))
+
+    print("%s: %d samples, %.1f s, approach from %.2f s, reference amplitude %.4f V" %
+          (report["path"], report["samples"], report["duration"], report["start"], report["initialAmp"]))
+    if report["mismatches"] > 0:
+        print("Warning: %d combinations disagree with approach.approachConditionMet" % report["mismatches"])
+
+    table = rows(report)
+    if args.csv != None:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["ampRatio", "zpiLimit", "defLimit", "triggerS", "condition", "status"])
+            writer.writerows(table)
+
+    if "status" in report:
+        counts = {s: sum(1 for r in table if r[5] == s) for s in ["early", "safe", "late"]}
+        print("%d combinations: %d early, %d safe, %d late" % (len(table), counts["early"], counts["safe"], counts["late"]))
+        #safe ones closest to the surface first
+        order = {"safe": 0, "late": 1, "early": 2}
+        table.sort(key=lambda r: (order[r[5]], -r[3] if r[3] == r[3] else np.inf))
+    else:
+        table.sort(key=lambda r: r[3] if r[3] == r[3] else np.inf)
+
+    print("%10s %10s %10s %12s %10s %8s" % ("ampRatio", "zpiLimit", "defLimit", "trigger s", "condition", "status"))
+    for r in table[:args.top]:
+        print("%10.3f %10.3f %10.3f %12.3f %10s %8s" % r)
+
+    if report.get("best") != None:
+        print("Recommended: ampRatio %.3f, zpiLimit %.3f V, defLimit %.3f V (triggers at %.3f s on %s)" % report["best"])
+    elif "best" in report:
+        print("No combination triggers in the safe window")
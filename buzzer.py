@@ -17,13 +17,108 @@
 
 
 
+#Buzzer service (one long-lived thread, see BuzzerService)
+#buzzerService = BuzzerService()
+#buzzerService.play(1)
+
+
+#Hardware PWM buzzer (buzzer="hardware"): the Pi 5 has four hardware PWM channels on chip 0,
+#channels 2 and 3 (GPIO18/19) drive the motor, so the buzzer goes to channel 0 (GPIO12, pin 32)
+#or channel 1 (GPIO13, pin 33):
+#buz = ApproachBuzzer(buzzer="hardware",pwm_channel=0)
+
+
+
 import RPi.GPIO as GPIO
 
-from time import sleep
+import queue
+import threading
+from time import sleep, monotonic
+
+#semitones relative to A
+NOTE_OFFSETS = {'C':-9, 'Db':-8, 'D':-7, 'Eb':-6, 'E':-5, 'F':-4, 'Gb':-3, 'G':-2, 'Ab':-1, 'A':0, 'Bb':1, 'B':2}
+
+#standard sounds: notes, gap, bpm
+STANDARD_SOUNDS = {
+    1: ("A414 A414 B424",0.05,120),
+    2: ("D514 D514 D514 D534 Bb424 C524 D524 C514 D524",0.05,180),
+    3: ("A424",0.05,120),
+    4: ("G414 G414 G414 Eb434",0.05,120),
+}
+
+
+def noteToFreq(note,octave):
+    f0 = 440
+    n = NOTE_OFFSETS.get(note,0)
+    return f0*2**(n/12-4+octave)
+
+
+def compileMelody(notes,gap,bpm,octave_shift=0):
+    #the notes should be put in a string like "A414 Bb424 p14" (note, octave, length numerator and denominator),
+    #returns a list of (frequency, time) pairs, frequency 0 is a pause
+    melody = []
+
+    dt = 60.0/bpm
+
+    for item in notes.split(' '):
+        note_len = float(item[len(item)-2])/float(item[len(item)-1])
+        if item[0] == 'p':
+            freq = 0
+        else:
+            note = item[0:len(item)-3]
+            octave = int(item[len(item)-3]) + octave_shift
+            freq = noteToFreq(note,octave)
+
+        melody.append((freq,note_len*dt))
+        melody.append((0,gap))
+
+    return melody
+
+
+def waitUntil(deadline,cancelEvent=None):
+    #returns True if cancelEvent was set before the deadline. No busy wait: a late wake-up (about
+    #1 ms at most) only delays this note, the next deadline is absolute and catches up.
+    remaining = deadline - monotonic()
+    if remaining > 0:
+        if cancelEvent != None:
+            return cancelEvent.wait(remaining)
+        sleep(remaining)
+    return False
+
+
+def timingReport(errors,scheduled,actual,cancelled=False):
+    #errors: start time error of every note in s
+    absErrors = [abs(e) for e in errors]
+    return {"notes": len(errors), "scheduled": scheduled, "actual": actual,
+            "drift": actual - scheduled, "maxError": max(absErrors, default=0.0),
+            "meanError": sum(absErrors)/max(len(absErrors),1), "cancelled": cancelled}
+
+
+def formatReport(name,report):
+    return ("%s: %d notes, %.3f s scheduled, drift %+.1f ms, note start error max %.1f ms mean %.1f ms%s" %
+            (name, report["notes"], report["scheduled"], 1e3*report["drift"], 1e3*report["maxError"],
+             1e3*report["meanError"], " (cancelled)" if report["cancelled"] else ""))
+
+
+def compileStandardSounds():
+    return {nr: compileMelody(*STANDARD_SOUNDS[nr]) for nr in STANDARD_SOUNDS}
 
 class ApproachBuzzer():
-    def __init__(self,pin=11,buzzer="passive"):
+    def __init__(self,pin=11,buzzer="passive",pwm_channel=0,chip=0):
         self.pin = pin
+        self.fList = []
+        self.tList = []
+        self.lastReport = None
+
+        if buzzer == "hardware":
+            #the hardware PWM runs without any CPU load, the pin is given by the channel
+            from rpi_hardware_pwm import HardwarePWM
+
+            self.buzzerType = 2
+            self.dc = 50
+            self.pwm = HardwarePWM(pwm_channel=pwm_channel, hz=100, chip=chip)
+            self.pwm.stop()
+            return
 
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BOARD)
@@ -53,49 +148,56 @@ class ApproachBuzzer():
 
 
     def noteToFreq(self,note,octave):
-        f0 = 440
-
-        if note == 'C':
-            n=-9
-        elif note == 'Db':
-            n=-8
-        elif note == 'D':
-            n=-7
-        elif note == 'Eb':
-            n=-6
-        elif note == 'E':
-            n=-5
-        elif note == 'F':
-            n=-4
-        elif note == 'Gb':
-            n=-3
-        elif note == 'G':
-            n=-2
-        elif note == 'Ab':
-            n=-1
-        elif note == 'A':
-            n = 0
-        elif note == 'Bb':
-            n = 1
-        elif note == 'B':
-            n = 2
-        else:
-            n = 0
-
-        freq = f0*2**(n/12-4+octave)
-        return freq
+        return noteToFreq(note,octave)
 
     def playSound(self,freq,time):
+        self.toneOn(freq)
+        waitUntil(monotonic() + time)
+        self.toneOff()
+
+    def toneOn(self,freq):
         if self.buzzerType == 0:
             self.pwm.ChangeFrequency(freq)
             self.pwm.ChangeDutyCycle(self.dc)
-            sleep(time)
-            self.pwm.start(0)
+        elif self.buzzerType == 2:
+            self.pwm.change_frequency(freq)
+            self.pwm.start(self.dc)
         else:
             GPIO.output(self.pin, GPIO.HIGH)
-            sleep(time)
+
+    def toneOff(self):
+        if self.buzzerType == 0:
+            self.pwm.start(0)
+        elif self.buzzerType == 2:
+            self.pwm.stop()
+        else:
             GPIO.output(self.pin, GPIO.LOW)
 
+    def playTimed(self,melody,cancelEvent=None):
+        #Every note starts at an absolute deadline (start time + sum of the previous durations), so
+        #late wake-ups do not add up. Returns a timing report (see timingReport).
+        errors = []
+        cancelled = False
+
+        t0 = monotonic()
+        deadline = t0
+        for freq, time in melody:
+            errors.append(monotonic() - deadline)
+            if freq != 0:
+                self.toneOn(freq)
+            else:
+                self.toneOff()
+
+            deadline += time
+            if waitUntil(deadline,cancelEvent):
+                cancelled = True
+                break
+
+        self.toneOff()
+
+        self.lastReport = timingReport(errors,deadline - t0,monotonic() - t0,cancelled)
+        return self.lastReport
+
 
     def setMelody(self,freq_list,time_list):
         self.fList = freq_list
@@ -105,50 +207,18 @@ class ApproachBuzzer():
         #the notes should be put in a string like "A2 Bb D4"
         #the time is the length of each note
         #the pause is the silent period between two notes
-        self.fList = []
-        self.tList = []
-
-        dt = 60.0/bpm
-
-        sep_notes = notes.split(' ')
-
-        for item in sep_notes:
-            if item[0] == 'p':
-                freq = 0
-                note_len = float(item[len(item)-2])/float(item[len(item)-1])
-                time = note_len*dt
-
-            else:
-                note = item[0:len(item)-3]
-                octave = int(item[len(item)-3]) + octave_shift
-                freq = self.noteToFreq(note,octave)
-                note_len = float(item[len(item)-2])/float(item[len(item)-1])
-                time = note_len*dt
-
-
-            self.fList.append(freq)
-            self.tList.append(time)
-            self.fList.append(0)
-            self.tList.append(gap)
+        melody = compileMelody(notes,gap,bpm,octave_shift)
+        self.fList = [freq for freq, time in melody]
+        self.tList = [time for freq, time in melody]
 
     def playMelody(self):
-        for i in range(0,len(self.fList)):
-            if self.fList[i] != 0:
-                self.playSound(self.fList[i], self.tList[i])
-            else:
-                sleep(self.tList[i])
+        return self.playTimed(list(zip(self.fList,self.tList)))
 
     def playStandardSound(self,nr):
 
-        if self.buzzerType == 0:
-            if nr == 1:
-                self.setMelody2("A414 A414 B424",0.05,120)
-            if nr == 2:
-                self.setMelody2("D514 D514 D514 D534 Bb424 C524 D524 C514 D524",0.05,180)
-            if nr == 3:
-                self.setMelody2("A424",0.05,120)
-            if nr == 4:
-                self.setMelody2("G414 G414 G414 Eb434",0.05,120)
+        if self.buzzerType != 1:
+            if nr in STANDARD_SOUNDS:
+                self.setMelody2(*STANDARD_SOUNDS[nr])
 
             self.playMelody()
 
@@ -156,9 +226,61 @@ class ApproachBuzzer():
             self.playSound(0,2)
 
     def sweep(self,df,dt,startN,N):
-        for i in range(startN,N):
-            f = i*df
-            self.playSound(f,dt)
+        return self.playTimed([(i*df,dt) for i in range(startN,N)])
+
+
+class BuzzerService(threading.Thread):
+    #Owns the buzzer for the lifetime of the program. GPIO is set up once when the thread starts,
+    #the standard sounds are compiled up front; play() and cancel() only put a request into the
+    #queue and return immediately.
+    def __init__(self,pin=11,buzzer="passive",pwm_channel=0):
+        super(BuzzerService, self).__init__(daemon=True)
+        self.pin = pin
+        self.buzzerType = buzzer
+        self.pwmChannel = pwm_channel
+        self.buz = None
+        self.lastReport = None
+
+        self.requests = queue.Queue()
+        self.cancelEvent = threading.Event()
+        self.melodies = compileStandardSounds()
+
+        self.start()
+
+    def play(self,nr):
+        self.cancelEvent.set()
+        self.requests.put(nr)
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def close(self):
+        self.cancelEvent.set()
+        self.requests.put(None)
+
+    def run(self):
+        self.buz = ApproachBuzzer(self.pin,self.buzzerType,self.pwmChannel)
+
+        while True:
+            nr = self.requests.get()
+            if nr == None:
+                break
+
+            #only the newest request is played
+            while not self.requests.empty():
+                nr = self.requests.get()
+                if nr == None:
+                    return
+            self.cancelEvent.clear()
+
+            if self.buz.buzzerType != 1:
+                melody = self.melodies.get(nr,[])
+            else:
+                melody = [(1,2)]
+            self.lastReport = self.buz.playTimed(melody,self.cancelEvent)
+            print(formatReport("Buzzer sound " + str(nr), self.lastReport))
+
+        self.buz.toneOff()
 
 
 #buz = ApproachBuzzer(buzzer="passive")
@@ -0,0 +1,215 @@
+#Contact mechanics models
+#
+#Hertz, DMT and JKR for a spherical tip of radius R on a flat sample, fitted to force vs.
+#indentation with a batched Levenberg-Marquardt solver: all curves of a stack are iterated together
+#(one (curves x points x parameters) Jacobian, one batched solve per iteration), each curve keeps
+#its own damping factor.
+#
+#Units: indentation and R in nm, force in nN, so the reduced modulus E* = E/(1 - nu^2) comes out
+#in GPa and the work of adhesion w in nN/nm (= J/m^2).
+#
+#       Hertz:  F = 4/3 E* sqrt(R) d^1.5                            d = delta - delta0 >= 0
+#       DMT:    F = 4/3 E* sqrt(R) d^1.5 - Fadh                     parameters E*, delta0, Fadh
+#       JKR:    F = 4 E* a^3/(3R) - sqrt(8 pi w E* a^3)
+#               d = a^2/R - sqrt(2 pi w a/E*)                       parameters E*, delta0, w
+#
+#The JKR contact radius a is solved from d by Newton iterations, its parameter derivatives follow
+#from implicit differentiation. Outside of contact (d < 0) Hertz and DMT give 0 and -Fadh.
+
+import math
+import numpy as np
+
+import force_analysis
+
+MODELS = ["Hertz", "DMT", "JKR"]
+PARAMETERS = {"Hertz": ["E", "delta0"], "DMT": ["E", "delta0", "Fadh"], "JKR": ["E", "delta0", "w"]}
+
+
+def freeBaseline(distM,deflV):
+    #deflection of the free (non-contact) part, the median of the points farther from the sample
+    #than the contact point of force_analysis.contactPoints; one value per curve
+    distM = np.atleast_2d(distM)
+    deflV = np.atleast_2d(deflV)
+    x0 = np.atleast_1d(force_analysis.contactPoints(distM, deflV)[0])[:,None]
+    free = distM > x0
+    with np.errstate(all='ignore'):
+        baseline = np.nanmedian(np.where(free, deflV, np.nan), axis=1)
+    return np.where(np.isfinite(baseline), baseline, 0.0)
+
+
+def indentation(distM,deflV,invOLS,springConst,baseline=None):
+    #approach curve(s) after the zero estimate (distance 0 at the contact point, decreasing into
+    #the sample): indentation in nm and force in nN. The free deflection (baseline, V; from
+    #freeBaseline() if not given) is zero force.
+    distM = np.asarray(distM, dtype=float)
+    deflV = np.asarray(deflV, dtype=float)
+    if baseline is None:
+        baseline = freeBaseline(distM, deflV)
+    baseline = np.asarray(baseline, dtype=float)
+    if (deflV.ndim == 1) and (baseline.ndim == 1):
+        baseline = baseline[0]
+    elif baseline.ndim == 1:
+        baseline = baseline[:,None]
+    defl = (deflV - baseline)*invOLS
+    return -distM - defl, springConst*defl
+
+
+def fitMask(model,delta,force,margin=0.25):
+    #points used for the fit: the contact region and a margin of margin*(maximum indentation)
+    #outside for delta0. DMT and JKR are fitted to the retract curve (contact first), only up to
+    #the pull-off (minimum force).
+    delta = np.atleast_2d(delta)
+    force = np.atleast_2d(force)
+    mask = delta >= -margin*np.nanmax(delta, axis=1, keepdims=True)
+    if model != "Hertz":
+        pullOff = np.nanargmin(force, axis=1)
+        mask &= np.arange(delta.shape[1]) <= pullOff[:,None]
+    return mask
+
+
+def sphereForce(p,delta,R):
+    #Hertz part and its derivatives for E* and delta0
+    d = np.maximum(delta - p[:,1:2], 0.0)
+    c = 4/3*math.sqrt(R)
+    f = c*p[:,0:1]*d**1.5
+    dE = c*d**1.5
+    dDelta0 = -1.5*c*p[:,0:1]*np.sqrt(d)
+    return f, dE, dDelta0
+
+
+def hertz(p,delta,R):
+    f, dE, dDelta0 = sphereForce(p,delta,R)
+    return f, np.stack((dE, dDelta0), axis=-1)
+
+
+def dmt(p,delta,R):
+    f, dE, dDelta0 = sphereForce(p,delta,R)
+    return f - p[:,2:3], np.stack((dE, dDelta0, -np.ones_like(f)), axis=-1)
+
+
+def jkrContactRadius(d,E,w,R,iterations=30):
+    #contact radius a for the indentation d, Newton on g(a) = a^2/R - sqrt(2 pi w a/E) - d, started
+    #on the Hertz branch (a = sqrt(R d)) or at the equilibrium radius; always the stable branch
+    k = np.sqrt(2*math.pi*w/E)
+    a0 = (9*math.pi*w*R*R/(2*E))**(1/3)          #zero load contact radius
+    aMin = (math.pi*w*R*R/(8*E))**(1/3)          #pull-off (fixed grips) radius, dd/da = 0
+    a = np.maximum(np.sqrt(R*np.maximum(d,0.0)) + a0, aMin)
+    for i in range(0,iterations):
+        g = a*a/R - k*np.sqrt(a) - d
+        dg = 2*a/R - 0.5*k/np.sqrt(a)
+        a = np.maximum(a - g/np.maximum(dg, 1e-12), aMin)
+    return a
+
+
+def jkr(p,delta,R):
+    E = np.maximum(p[:,0:1], 1e-9)
+    w = np.maximum(p[:,2:3], 1e-12)
+    d = delta - p[:,1:2]
+
+    a = jkrContactRadius(d,E,w,R)
+    sa = np.sqrt(a)
+    s = np.sqrt(8*math.pi*w*E)
+    f = 4*E*a**3/(3*R) - s*a*sa
+
+    #partial derivatives of F(a,E,w) and of d(a,E,w) = a^2/R - sqrt(2 pi w a/E)
+    fa = 4*E*a*a/R - 1.5*s*sa
+    fE = 4*a**3/(3*R) - 0.5*s/E*a*sa
+    fw = -0.5*s/w*a*sa
+    q = np.sqrt(2*math.pi*w*a/E)
+    da = 2*a/R - 0.5*q/a
+    dE = 0.5*q/E
+    dw = -0.5*q/w
+
+    #d(data) - delta0 = d(a,E,w): da/dp = (dd/dp(data) - dd/dp(model))/(dd/da); below the pull-off
+    #indentation there is no solution, a stays at aMin
+    free = da > 1e-9
+    da = np.where(free, da, 1.0)
+    aE = np.where(free, -dE/da, 0.0)
+    aDelta0 = np.where(free, -1/da, 0.0)
+    aw = np.where(free, -dw/da, 0.0)
+    J = np.stack((fE + fa*aE, fa*aDelta0, fw + fa*aw), axis=-1)
+    return f, J
+
+
+FUNCTIONS = {"Hertz": hertz, "DMT": dmt, "JKR": jkr}
+
+
+def initialGuess(model,delta,force,mask,R):
+    #E* from a least squares fit of F ~ delta^1.5 through the origin, adhesion from the minimum force
+    d = np.where(mask & (delta > 0), delta, 0.0)**1.5
+    fPos = np.where(mask, force, 0.0)
+    fAdh = np.maximum(-np.where(mask, force, np.inf).min(axis=1), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        E = 0.75/math.sqrt(R)*(d*(fPos + fAdh[:,None])).sum(axis=1)/(d*d).sum(axis=1)
+    E = np.where(np.isfinite(E) & (E > 0), E, 1.0)
+
+    p = [E, np.zeros_like(E)]
+    if model == "DMT":
+        p.append(fAdh)
+    elif model == "JKR":
+        p.append(np.maximum(2*fAdh/(3*math.pi*R), 1e-6))
+    return np.stack(p, axis=1)
+
+
+def fitContactModel(model,delta,force,R,mask=None,p0=None,iterations=50,tol=1e-8):
+    #delta, force: (curves x points), one row per curve (1-D for a single curve); mask selects the
+    #points of each curve that are fitted (e.g. different segment lengths)
+    #returns a dict with the parameters (curves x parameters), their names, the rms residual,
+    #the number of iterations and a flag for converged curves
+    delta = np.atleast_2d(np.asarray(delta, dtype=float))
+    force = np.atleast_2d(np.asarray(force, dtype=float))
+    if mask is None:
+        mask = np.isfinite(delta) & np.isfinite(force)
+    mask = np.atleast_2d(mask)
+    delta = np.where(mask, delta, 0.0)
+    force = np.where(mask, force, 0.0)
+    func = FUNCTIONS[model]
+
+    p = initialGuess(model,delta,force,mask,R) if p0 is None else np.atleast_2d(np.array(p0, dtype=float))
+    nCurves, nPar = p.shape
+    lam = np.full(nCurves, 1e-3)
+    converged = np.zeros(nCurves, dtype=bool)
+
+    def residuals(p):
+        f, J = func(p,delta,R)
+        r = np.where(mask, f - force, 0.0)
+        return r, J*mask[..., None]
+
+    r, J = residuals(p)
+    cost = (r*r).sum(axis=1)
+
+    for it in range(0,iterations):
+        A = np.einsum('cmi,cmj->cij', J, J)
+        g = np.einsum('cmi,cm->ci', J, r)
+        diag = np.einsum('cii->ci', A)
+        damped = A + (lam[:,None]*np.maximum(diag, 1e-12))[:,:,None]*np.eye(nPar)
+        try:
+            step = np.linalg.solve(damped, -g[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            #a singular curve (e.g. no point in contact) would stop the whole batch
+            step = np.einsum('cij,cj->ci', np.linalg.pinv(damped), -g)
+        step[converged] = 0.0
+
+        pNew = p + step
+        rNew, JNew = residuals(pNew)
+        costNew = (rNew*rNew).sum(axis=1)
+
+        better = np.isfinite(costNew) & (costNew < cost) & ~converged
+        small = np.abs(step).max(axis=1) <= tol*(np.abs(p).max(axis=1) + tol)
+        converged |= small | (better & (cost - costNew <= tol*cost))
+
+        p = np.where(better[:,None], pNew, p)
+        r = np.where(better[:,None], rNew, r)
+        J = np.where(better[:,None,None], JNew, J)
+        cost = np.where(better, costNew, cost)
+        lam = np.where(better, lam/10, np.minimum(lam*10, 1e10))
+
+        if converged.all():
+            break
+
+    #without points in contact (zero Jacobian) nothing was fitted, the start values stay
+    converged &= (mask.sum(axis=1) >= nPar) & (J != 0).any(axis=(1,2))
+
+    n = np.maximum(mask.sum(axis=1), 1)
+    return {"model": model, "names": PARAMETERS[model], "params": p, "rms": np.sqrt(cost/n),
+            "iterations": it + 1, "converged": converged}
@@ -0,0 +1,270 @@
+#Headless control core
+#
+#Motor moves, meter readout, auto approach and force curves without any Qt widgets. Used by
+#control_server.py; it runs on the real hardware as well as on sim_hardware.
+#
+#Settings use the same names as the attributes of MainWindow. Motor moves and the auto approach
+#run on a worker thread, all hardware access is serialized by one lock.
+
+import threading
+import time
+
+import approach
+import force_curve
+import motor_profile
+import signal_filter
+
+
+class ControlCore():
+    #settings a client may change (the ones of MainWindow.settingsKeys the core uses)
+    SETTINGS_KEYS = ["ADUpdateTimeMS", "slowMoveFreq", "fastMoveFreq", "autoApproachFreq", "acceleration", "powerCycle",
+                     "outputMode", "directionChn", "sumChn", "defChn", "ampChn", "zpiChn", "disChn",
+                     "defLimit", "zpiLimit", "ampRatio", "triggerFilterType", "triggerFilterWindow", "baselineWindow",
+                     "forceDataPoints", "extensionVoltage", "retractionVoltage", "piezoConst", "gain"]
+
+    def __init__(self,ADHat,DAHat,pwm_ccw,pwm_cw,rawOption):
+        self.ADHat = ADHat
+        self.DAHat = DAHat
+        self.pwm_ccw = pwm_ccw
+        self.pwm_cw = pwm_cw
+        self.rawOption = rawOption
+
+        self.lock = threading.RLock()
+        self.stopEvent = threading.Event()
+        self.worker = None
+
+        self.ADUpdateTimeMS = 2
+        self.slowMoveFreq = 3000
+        self.fastMoveFreq = 15000
+        self.autoApproachFreq = 5000
+        self.acceleration = 1000
+        self.AccelTimeMS = 10
+        self.powerCycle = 50
+        self.outputMode = 0
+        self.directionChn = 0
+
+        self.sumChn = 0
+        self.defChn = 1
+        self.ampChn = 2
+        self.zpiChn = 3
+        self.disChn = 4
+
+        self.defLimit = 1.0
+        self.zpiLimit = 1.0
+        self.ampRatio = 0.5
+        self.triggerFilterType = signal_filter.FILTER_MEAN
+        self.triggerFilterWindow = 5
+        self.baselineWindow = 250
+
+        self.forceOffset = 2.5
+        self.forceDataPoints = 500
+        self.extensionVoltage = -1.0
+        self.retractionVoltage = 2.5
+        self.piezoConst = 18.5
+        self.gain = 5
+
+        self.motorPos = 0
+        self.motorDirection = 1
+        self.motorRunning = False
+        self.pulseFreq = 0
+        self.lastStopReason = ""
+
+        self.segStartPos = 0
+        self.segStartTime = 0
+        self.motionProfile = None
+
+    def setSettings(self,values):
+        #only known settings are taken over, cast to the type of the current value; nothing is
+        #changed if one of them is unknown or can't be converted
+        converted = {}
+        for key in values:
+            if key not in self.SETTINGS_KEYS:
+                raise ValueError("ERROR: Unknown setting \"" + str(key) + "\"!")
+            try:
+                converted[key] = type(getattr(self,key))(values[key])
+            except (TypeError, ValueError):
+                raise ValueError("ERROR: Invalid value for setting \"" + key + "\"!")
+
+        with self.lock:
+            for key in converted:
+                setattr(self,key,converted[key])
+
+    #
+    #Meter
+    def readMeter(self):
+        with self.lock:
+            sumV = self.ADHat.hat.a_in_read(self.sumChn,self.ADHat.options)
+            defV = self.ADHat.hat.a_in_read(self.defChn,self.ADHat.options)
+            ampV = self.ADHat.hat.a_in_read(self.ampChn,self.ADHat.options)
+            zpiV = self.ADHat.hat.a_in_read(self.zpiChn,self.ADHat.options)
+
+        return {"t": time.time(), "sum": sumV, "def": defV, "amp": ampV, "zpi": zpiV}
+
+    #
+    #Motor
+    def status(self):
+        return {"position": self.CurrentMotorPos(), "running": self.motorRunning, "freq": self.pulseFreq,
+                "direction": self.motorDirection, "lastStop": self.lastStopReason}
+
+    def CurrentMotorPos(self):
+        if self.motionProfile == None:
+            return self.motorPos
+        pulses = self.motionProfile.pulsesAt(time.monotonic() - self.segStartTime)
+        return self.segStartPos + self.motorDirection*int(pulses/1e1)
+
+    def SetPulseOutput(self,freq):
+        with self.lock:
+            if (self.outputMode == 0) and (self.motorDirection == 1):
+                self.pwm_cw.change_frequency(freq)
+                self.pwm_cw.start(self.powerCycle)
+            else:
+                if self.outputMode != 0:
+                    self.DAHat.hat.dio_output_write_bit(self.directionChn,int(self.motorDirection == 1))
+                self.pwm_ccw.change_frequency(freq)
+                self.pwm_ccw.start(self.powerCycle)
+
+    def StopPulses(self):
+        with self.lock:
+            self.pwm_cw.stop()
+            self.pwm_ccw.stop()
+
+    def StartWorker(self,target,args):
+        #check and set under the lock, the server handles every client on its own thread
+        with self.lock:
+            if self.motorRunning:
+                raise RuntimeError("ERROR: Motor is already running!")
+
+            self.stopEvent.clear()
+            self.motorRunning = True
+            self.worker = threading.Thread(target=target,args=args,daemon=True)
+            self.worker.start()
+
+    def EndMove(self,reason,finalPos=None):
+        with self.lock:
+            self.StopPulses()
+            if finalPos == None:
+                finalPos = self.CurrentMotorPos()
+            self.motorPos = finalPos
+            self.motionProfile = None
+            self.pulseFreq = 0
+            self.lastStopReason = reason
+            self.motorRunning = False
+
+    def move(self,steps,freq=None,wait=False):
+        #relative move in position units, positive = retract
+        if freq == None:
+            freq = self.slowMoveFreq
+        if (steps == 0) or (freq < 1):
+            return self.status()
+
+        self.StartWorker(self.MoveWorker,(steps,freq))
+        if wait:
+            self.waitIdle()
+        return self.status()
+
+    def MoveWorker(self,steps,freq):
+        if steps > 0:
+            self.motorDirection = 1
+        else:
+            self.motorDirection = -1
+
+        #same acceleration ramp as the GUI for fast moves
+        accel = 0
+        if freq > 10000:
+            accel = self.acceleration
+
+        self.pulseFreq = freq
+        self.segStartPos = self.motorPos
+        self.segStartTime = time.monotonic()
+        self.motionProfile = motor_profile.MotionProfile(freq,accel,1e-3*self.AccelTimeMS)
+        tEnd = self.segStartTime + self.motionProfile.timeToPulses(1e1*abs(steps))
+
+        stopped = False
+        if accel > 0:
+            k = 1
+            f = 0
+            while f < freq:
+                tick = self.segStartTime + k*1e-3*self.AccelTimeMS
+                if self.stopEvent.wait(max(0,min(tick,tEnd) - time.monotonic())):
+                    stopped = True
+                    break
+                if time.monotonic() >= tEnd:
+                    break
+                f = min(k*accel,freq)
+                self.SetPulseOutput(f)
+                k += 1
+        else:
+            self.SetPulseOutput(freq)
+
+        if not stopped:
+            stopped = self.stopEvent.wait(max(0,tEnd - time.monotonic()))
+
+        if stopped:
+            self.EndMove("stopped")
+        else:
+            self.EndMove("target",self.segStartPos + self.motorDirection*abs(steps))
+
+    def autoApproach(self,freq=None,maxSteps=0,wait=False):
+        if freq == None:
+            freq = self.autoApproachFreq
+        self.StartWorker(self.AutoApproachWorker,(freq,maxSteps))
+        if wait:
+            self.waitIdle()
+        return self.status()
+
+    def AutoApproachWorker(self,freq,maxSteps):
+        triggerFilter = signal_filter.ApproachSignalFilter(self.triggerFilterType,self.triggerFilterWindow,self.baselineWindow)
+        for i in range(0,self.baselineWindow):
+            m = self.readMeter()
+            triggerFilter.update(m["amp"],m["def"],m["zpi"])
+        initialAmp = triggerFilter.baseline()
+
+        self.motorDirection = -1
+        self.pulseFreq = freq
+        self.segStartPos = self.motorPos
+        self.segStartTime = time.monotonic()
+        self.motionProfile = motor_profile.MotionProfile(freq)
+        self.SetPulseOutput(freq)
+
+        reason = "stopped"
+        while not self.stopEvent.wait(1e-3*self.ADUpdateTimeMS):
+            m = self.readMeter()
+            ampF, defF, zpiF = triggerFilter.update(m["amp"],m["def"],m["zpi"],trackBaseline=False)
+            if approach.approachConditionMet(ampF,zpiF,defF,initialAmp,self.ampRatio,self.zpiLimit,self.defLimit):
+                reason = "approached"
+                break
+            if (maxSteps > 0) and (abs(self.CurrentMotorPos() - self.segStartPos) >= maxSteps):
+                reason = "limit"
+                break
+
+        self.EndMove(reason)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.waitIdle()
+        self.StopPulses()
+        return self.status()
+
+    def waitIdle(self,timeout=None):
+        worker = self.worker
+        if worker != None:
+            worker.join(timeout)
+        return not self.motorRunning
+
+    #
+    #Force curve
+    def forceCurve(self):
+        with self.lock:
+            if self.motorRunning:
+                raise RuntimeError("ERROR: Motor is running!")
+            data = force_curve.acquireForceCurve(self.ADHat.hat,self.DAHat.hat,self.defChn,self.disChn,
+                                                 self.forceOffset,self.retractionVoltage,self.extensionVoltage,
+                                                 self.forceDataPoints,self.rawOption)
+
+        deflV = force_curve.rawToVolts(data.defl,self.ADHat.maxV,self.ADHat.maxADC*data.codeScale)
+        distV = force_curve.rawToVolts(data.dist,self.ADHat.maxV,self.ADHat.maxADC*data.codeScale)
+        distM = (distV - self.forceOffset)*self.piezoConst*self.gain
+
+        return {"timeStep": data.timeStep, "apprT": data.apprT, "retrT": data.retrT,
+                "distApp": distM[data.approachSlice()], "deflApp": deflV[data.approachSlice()],
+                "distRet": distM[data.retractSlice()], "deflRet": deflV[data.retractSlice()]}
@@ -0,0 +1,227 @@
+#!/home/afm/python/daq_venv/bin/python
+
+#Headless control server
+#
+#Exposes the control core (motor moves, meter readout, auto approach, force curves) over a local
+#Unix socket (default) or a localhost TCP port. The protocol is line based JSON, one request per
+#line:
+#
+#       {"id": 1, "method": "move", "params": {"steps": -5000, "freq": 3000, "wait": true}}
+#
+#and one answer per request:
+#
+#       {"id": 1, "result": {...}}      or      {"id": 1, "error": "..."}
+#
+#Methods:
+#       status, settings (params: ControlCore.SETTINGS_KEYS), move (steps, freq, wait),
+#       stop, wait (timeout), read_meter, auto_approach (freq, max_steps, wait),
+#       force_curve (encoding: "json" or "base64" for little-endian float32 arrays),
+#       subscribe_meter (interval_ms, count) - streams {"id": .., "event": "meter", ...} lines
+#       until count samples are sent (0 = until the client disconnects), then sends the result.
+#
+#Usage:
+#       control_server.py [--sim] [--socket /tmp/hsafm-motor.sock | --port 5555]
+
+import argparse
+import base64
+import json
+import os
+import socketserver
+import sys
+import time
+
+import numpy as np
+
+import control_core
+
+DEFAULT_SOCKET = "/tmp/hsafm-motor.sock"
+
+
+def encodeArray(data,encoding):
+    data = np.asarray(data,dtype='<f4')
+    if encoding == "base64":
+        return base64.b64encode(data.tobytes()).decode('ascii')
+    return data.tolist()
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def send(self,message):
+        self.wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            reqId = None
+            try:
+                request = json.loads(line)
+                reqId = request.get("id")
+                method = request.get("method","")
+                params = request.get("params",{})
+                result = self.server.dispatch(self,reqId,method,params)
+                self.send({"id": reqId, "result": result})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                try:
+                    self.send({"id": reqId, "error": str(e)})
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+
+class ControlServerMixin():
+    def setupCore(self,core):
+        self.core = core
+        self.methods = {
+            "status": self.Status,
+            "settings": self.Settings,
+            "move": self.Move,
+            "stop": self.Stop,
+            "wait": self.Wait,
+            "read_meter": self.ReadMeter,
+            "auto_approach": self.AutoApproach,
+            "force_curve": self.ForceCurve,
+            "subscribe_meter": self.SubscribeMeter,
+        }
+
+    def dispatch(self,handler,reqId,method,params):
+        if method not in self.methods:
+            raise ValueError("ERROR: Unknown method \"" + str(method) + "\"!")
+        return self.methods[method](handler,reqId,params)
+
+    def Status(self,handler,reqId,params):
+        return self.core.status()
+
+    def Settings(self,handler,reqId,params):
+        self.core.setSettings(params)
+        return self.core.status()
+
+    def Move(self,handler,reqId,params):
+        return self.core.move(int(params["steps"]),params.get("freq"),params.get("wait",False))
+
+    def Stop(self,handler,reqId,params):
+        return self.core.stop()
+
+    def Wait(self,handler,reqId,params):
+        self.core.waitIdle(params.get("timeout"))
+        return self.core.status()
+
+    def ReadMeter(self,handler,reqId,params):
+        return self.core.readMeter()
+
+    def AutoApproach(self,handler,reqId,params):
+        return self.core.autoApproach(params.get("freq"),int(params.get("max_steps",0)),params.get("wait",False))
+
+    def ForceCurve(self,handler,reqId,params):
+        encoding = params.get("encoding","json")
+        curve = self.core.forceCurve()
+        for key in ("distApp","deflApp","distRet","deflRet"):
+            curve[key] = encodeArray(curve[key],encoding)
+        curve["encoding"] = encoding
+        return curve
+
+    def SubscribeMeter(self,handler,reqId,params):
+        interval = 1e-3*float(params.get("interval_ms",50))
+        count = int(params.get("count",0))
+
+        sent = 0
+        nextTime = time.monotonic()
+        while (count == 0) or (sent < count):
+            sample = self.core.readMeter()
+            sample["id"] = reqId
+            sample["event"] = "meter"
+            handler.send(sample)
+            sent += 1
+
+            nextTime += interval
+            delay = nextTime - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                nextTime = time.monotonic()
+
+        return {"samples": sent}
+
+
+class UnixControlServer(ControlServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPControlServer(ControlServerMixin, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def createCore(sim=False):
+    if sim:
+        import sim_hardware
+
+        ADHat = sim_hardware.SimHatDevice("mcc118")
+        DAHat = sim_hardware.SimHatDevice("mcc152")
+        pwm_ccw = sim_hardware.SimHardwarePWM(pwm_channel=2, hz=3000)
+        pwm_cw = sim_hardware.SimHardwarePWM(pwm_channel=3, hz=3000)
+        rawOption = sim_hardware.NOSCALEDATA
+    else:
+        from daqhats import OptionFlags, DIOConfigItem
+        from rpi_hardware_pwm import HardwarePWM
+        from hardware import hat_device
+
+        ADHat = hat_device("mcc118")
+        ADHat.select_hat(0)
+        DAHat = hat_device("mcc152")
+        DAHat.select_hat(0)
+        DAHat.hat.dio_reset()
+        DAHat.hat.dio_config_write_bit(7,DIOConfigItem.DIRECTION,0)
+        DAHat.hat.dio_output_write_port(0)
+
+        #see MainWindow for the value of "chip"
+        pwm_ccw = HardwarePWM(pwm_channel=2, hz=3000, chip=0)
+        pwm_cw = HardwarePWM(pwm_channel=3, hz=3000, chip=0)
+        rawOption = OptionFlags.NOSCALEDATA
+
+    pwm_ccw.stop()
+    pwm_cw.stop()
+
+    core = control_core.ControlCore(ADHat, DAHat, pwm_ccw, pwm_cw, rawOption)
+    DAHat.hat.a_out_write(0,core.forceOffset)
+    DAHat.hat.a_out_write(1,0.0)
+
+    return core
+
+
+def createServer(core,socketPath=DEFAULT_SOCKET,port=None):
+    if port != None:
+        server = TCPControlServer(("127.0.0.1",port), ControlRequestHandler)
+    else:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = UnixControlServer(socketPath, ControlRequestHandler)
+
+    server.setupCore(core)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless HS-AFM motor control server")
+    parser.add_argument("--sim", action="store_true", help="use the simulated hardware")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix socket")
+    parser.add_argument("--port", type=int, default=None, help="listen on localhost TCP port instead")
+    args = parser.parse_args()
+
+    core = createCore(args.sim)
+    server = createServer(core, args.socket, args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        core.stop()
+        server.server_close()
+        if args.port == None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+    sys.exit(0)
@@ -0,0 +1,115 @@
+#Force curve files (.dfc)
+#
+#Little endian header of 82 bytes followed by the raw ADC codes (int16) of the deflection and then
+#of the distance channel, sample_cnt values each:
+#
+#       num_chn (I), sample_cnt (I), time_interval (i, ns), maxADC (h),
+#       rangeA, rangeB, rangeC, rangeD (H, V peak to peak),
+#       PiezoZ, DriverG, QCtrlG (f), sqrAmpl, InvOLS, apprT, retrT, holdT (d, s),
+#       ForceX, ForceY (i)
+#
+#readDfcBatch() loads many curves of equal length into 2-D arrays (one curve per row) for the
+#vectorized analysis in force_analysis.
+
+import struct
+import numpy as np
+
+import force_curve
+
+HEADER_FORMAT = "<IIihHHHHfffdddddii"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_FIELDS = ["num_chn", "sample_cnt", "time_interval", "maxADC", "rangeA", "rangeB", "rangeC", "rangeD",
+                 "PiezoZ", "DriverG", "QCtrlG", "sqrAmpl", "InvOLS", "apprT", "retrT", "holdT", "ForceX", "ForceY"]
+
+
+def writeDfc(path,header,defl,dist):
+    #header: dict with the HEADER_FIELDS (sample_cnt is taken from the data)
+    values = dict(header)
+    values["sample_cnt"] = len(defl)
+    with open(path,'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, *[values[key] for key in HEADER_FIELDS]))
+        np.asarray(defl, dtype='<i2').tofile(f)
+        np.asarray(dist, dtype='<i2').tofile(f)
+
+
+def readDfc(path):
+    #returns the header dict and the raw deflection and distance codes (int16)
+    with open(path,'rb') as f:
+        raw = f.read(HEADER_SIZE)
+        if len(raw) < HEADER_SIZE:
+            raise ValueError("'" + path + "' is not a force curve file (header too short)")
+        header = dict(zip(HEADER_FIELDS, struct.unpack(HEADER_FORMAT, raw)))
+
+        n = header["sample_cnt"]
+        defl = np.fromfile(f, dtype='<i2', count=n)
+        dist = np.fromfile(f, dtype='<i2', count=n)
+    if len(dist) < n:
+        raise ValueError("'" + path + "' is truncated")
+    return header, defl, dist
+
+
+def retractPoints(header):
+    #number of points of each cosine ramp; from the timing as in MainWindow.LoadForceCurve, the
+    #acquisition default if the header holds no timing
+    dt = 1e-9*header["time_interval"]
+    if dt <= 0:
+        return force_curve.RETRACT_POINTS
+    return max(int((header["sample_cnt"] - int((header["apprT"] + header["retrT"] + header["holdT"])/dt))/2), 0)
+
+
+def segmentSplit(header):
+    #(ramp points, hold points) that separate approach and retract of a curve
+    dt = 1e-9*header["time_interval"]
+    hold = int(round(header["holdT"]/dt)) if dt > 0 else 0
+    return retractPoints(header), hold
+
+
+def toVolts(raw,maxADC,vRange):
+    return vRange*raw/maxADC - vRange/2
+
+
+def readDfcBatch(paths):
+    #Loads the curves, splits them into approach and retract and scales them like
+    #MainWindow.LoadForceCurve (deflection in V, distance in nm).
+    #returns distApp, deflApp, distRet, deflRet (curves x points), the headers and the paths that
+    #were skipped (unreadable, or of a different length or approach/retract split than the first
+    #curve)
+    curves = []
+    headers = []
+    skipped = []
+    for path in paths:
+        try:
+            header, defl, dist = readDfc(path)
+        except (OSError, ValueError) as e:
+            print("Could not read '" + path + "': " + str(e))
+            skipped.append(path)
+            continue
+        if curves and (len(defl) != len(curves[0][0])):
+            skipped.append(path)
+            continue
+        #the split comes from the measured timing, a difference of one point is jitter
+        if headers and any(abs(a - b) > 1 for a, b in zip(segmentSplit(header), segmentSplit(headers[0]))):
+            print("Skipped '" + path + "': ramp/hold points differ from the first curve")
+            skipped.append(path)
+            continue
+        curves.append((defl, dist))
+        headers.append(header)
+
+    if not curves:
+        empty = np.zeros((0,0))
+        return empty, empty, empty, empty, headers, skipped
+
+    defl = np.stack([c[0] for c in curves]).astype(float)
+    dist = np.stack([c[1] for c in curves]).astype(float)
+    col = lambda key: np.array([h[key] for h in headers], dtype=float)[:,None]
+
+    defl = toVolts(defl, col("maxADC"), col("rangeA"))
+    dist = col("DriverG")*col("QCtrlG")*col("PiezoZ")*toVolts(dist, col("maxADC"), col("rangeB"))
+
+    #approach and retract are separated by the hold (dwell) segment, if any
+    n = defl.shape[1]
+    r, hold = segmentSplit(headers[0])
+    N = (n - 2*r - hold)//2
+    app = slice(r, r + N)
+    ret = slice(r + N + hold, r + 2*N + hold)
+    return dist[:,app], defl[:,app], dist[:,ret], defl[:,ret], headers, skipped
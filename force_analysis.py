@@ -0,0 +1,283 @@
+#Force curve analysis helpers
+#
+#PhaseShiftCache: the phase correction shifts the deflection against the distance by phi points.
+#The approach and retract segments are concatenated once per curve, every phase offset is then
+#served as views into these two arrays (no copies), results derived for an offset (fits, InvOLS)
+#are memoized.
+#
+#estimatePhaseShift finds the shift from the data (FFT cross-correlation), contactPoints the zero
+#distance of one or many curves (change-point search), batchInvOLS calibrates the InvOLS from many
+#curves at once, see below.
+
+import numpy as np
+
+
+class PhaseShiftCache():
+    #also works on 2-D arrays (one curve per row), the shift is then applied to all curves
+    def __init__(self,distApp,deflApp,distRet,deflRet):
+        self.N1 = distApp.shape[-1]
+        self.N2 = distRet.shape[-1]
+        self.fullDist = np.concatenate((distApp,distRet), axis=-1)
+        self.fullDefl = np.concatenate((deflApp,deflRet), axis=-1)
+        self.results = {}
+
+    def views(self,phi):
+        #approach distance, approach deflection, retract distance, retract deflection for a shift of
+        #phi points (same slicing as the original MainWindow.DoPhaseShift)
+        fullDist = self.fullDist
+        fullDefl = self.fullDefl
+
+        if phi >= 0:
+            newN = int((self.N1 + self.N2 - 2*phi)/2)
+            return (fullDist[..., 0:newN-phi], fullDefl[..., phi:newN],
+                    fullDist[..., newN-phi:2*newN-2*phi], fullDefl[..., newN:2*newN-phi])
+        else:
+            newN = int((self.N1 + self.N2 + 2*phi)/2)
+            return (fullDist[..., -phi:newN], fullDefl[..., 0:newN+phi],
+                    fullDist[..., newN:2*newN+phi], fullDefl[..., newN+phi:2*newN+2*phi])
+
+    def memo(self,phi,name,compute):
+        #result of compute() for this offset, computed only once
+        key = (phi, name)
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+    def estimatedShift(self,maxShift=1000):
+        #phase shift estimated from the data of this curve, rounded to whole points
+        key = ("estimate", maxShift)
+        if key not in self.results:
+            self.results[key] = int(round(float(estimatePhaseShift(self.fullDist, self.fullDefl, maxShift))))
+        return self.results[key]
+
+
+#
+#Phase lag estimation
+#
+#All functions take one curve (1-D) or a batch of curves of equal length (one per row) and work on
+#the whole batch with one FFT.
+
+def crossCorrelation(x,y):
+    #cc[..., k] = sum_n x[n+k]*y[n] for k = -(M-1)..(M-1), returned with k = 0 at index M-1
+    M = x.shape[-1]
+    L = 1 << int(2*M - 1).bit_length()
+    cc = np.fft.irfft(np.fft.rfft(x,L)*np.conj(np.fft.rfft(y,L)), L)
+    return np.concatenate((cc[..., L-M+1:], cc[..., :M]), axis=-1)
+
+
+def peakPosition(cc,center,maxOffset):
+    #position of the maximum within center +- maxOffset, with parabolic sub-sample interpolation
+    lo = max(center - maxOffset, 0)
+    hi = min(center + maxOffset + 1, cc.shape[-1])
+    part = cc[..., lo:hi]
+    i = part.argmax(axis=-1)
+
+    inner = (i > 0) & (i < part.shape[-1] - 1)
+    j = np.clip(i, 1, part.shape[-1] - 2)
+    a = np.take_along_axis(part, (j-1)[..., None], -1)[..., 0]
+    b = np.take_along_axis(part, j[..., None], -1)[..., 0]
+    c = np.take_along_axis(part, (j+1)[..., None], -1)[..., 0]
+    denom = a - 2*b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(inner & (denom != 0), 0.5*(a - c)/denom, 0.0)
+
+    return lo + i + delta - center
+
+
+def estimateLag(reference,signal,maxLag):
+    #lag in samples of signal behind reference (signal[n] ~ reference[n - lag]), e.g. the distance
+    #channel against the piezo drive
+    reference = np.asarray(reference, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    reference = reference - reference.mean(axis=-1, keepdims=True)
+    signal = signal - signal.mean(axis=-1, keepdims=True)
+
+    cc = crossCorrelation(signal, reference)
+    return peakPosition(cc, reference.shape[-1] - 1, maxLag)
+
+
+def symmetryOffset(x,maxOffset):
+    #The approach/retract sweep is mirror symmetric in time. Correlating a signal with its time
+    #reversal peaks at twice the offset of its symmetry center from the middle of the array.
+    #The baseline is taken from both ends (not the mean), so that the signal goes to zero at the
+    #array ends and the window edges do not pull the center towards the middle.
+    x = np.asarray(x, dtype=float)
+    n = max(x.shape[-1]//20, 1)
+    x = x - 0.5*(np.median(x[..., :n], axis=-1, keepdims=True) + np.median(x[..., -n:], axis=-1, keepdims=True))
+    cc = crossCorrelation(x, x[..., ::-1])
+    return 0.5*peakPosition(cc, x.shape[-1] - 1, 2*maxOffset)
+
+
+def repulsivePart(fullDefl,threshold=0.1):
+    #Only the repulsive contact is the same on approach and retract, the adhesion (retract below
+    #the free baseline) and the snap-off are not. Returns the deflection above the baseline (ends
+    #of the array) minus threshold*(turning point excursion), clipped at 0. The contact direction
+    #is the sign of the excursion at the turning point (middle of the array).
+    x = np.asarray(fullDefl, dtype=float)
+    N = x.shape[-1]
+    n = max(N//20, 1)
+    baseline = 0.5*(np.median(x[..., :n], axis=-1, keepdims=True) + np.median(x[..., -n:], axis=-1, keepdims=True))
+    turn = np.median(x[..., N//2 - n//2:N//2 + n//2 + 1], axis=-1, keepdims=True) - baseline
+    return np.maximum(np.sign(turn)*(x - baseline) - threshold*np.abs(turn), 0.0)
+
+
+def estimatePhaseShift(fullDist,fullDefl,maxShift=1000):
+    #Phase shift (in points, as used by PhaseShiftCache.views) of the deflection against the
+    #distance of the concatenated approach + retract curve(s): the difference of their symmetry
+    #centers, for the deflection those of the repulsive contact. Returns a float, or an array for a
+    #batch of curves.
+    maxShift = min(maxShift, fullDist.shape[-1]//4)
+    return symmetryOffset(repulsivePart(fullDefl), maxShift) - symmetryOffset(fullDist, maxShift)
+
+
+#
+#Contact point
+#
+#Two-segment piecewise linear fit (contact line + baseline) of the deflection against the distance.
+#With prefix sums of x, y, x^2, xy, y^2 the residual of a straight line fit over any index range is
+#O(1), so the residual of every split point is evaluated in one vectorized pass over the curve
+#(O(N) per curve, no Python loop over points or curves).
+
+def lineResiduals(n,sx,sy,sxx,sxy,syy):
+    #residual sum of squares and slope of the least squares line from the sums of a segment
+    varX = sxx - sx*sx/n
+    cov = sxy - sx*sy/n
+    varY = syy - sy*sy/n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(varX > 0, cov/varX, 0.0)
+    return np.maximum(varY - slope*cov, 0.0), slope
+
+
+def contactPoints(x,y,minSegment=None,chunk=256):
+    #x, y: distance and deflection of one curve (1-D) or of many curves of equal length (2-D, one
+    #per row)
+    #returns x0 (distance where the contact line meets the baseline), the split index and a
+    #confidence between 0 and 1: the fraction of the residual of a single straight line that is
+    #removed by the split (close to 1 for a clear contact, close to 0 for noise or a flat curve)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    single = (x.ndim == 1)
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    N = x.shape[1]
+
+    #the temporary arrays are (curves x points), large batches are done in blocks of curves
+    if x.shape[0] > chunk:
+        parts = [contactPoints(x[i:i+chunk], y[i:i+chunk], minSegment, chunk) for i in range(0, x.shape[0], chunk)]
+        return tuple(np.concatenate(p) for p in zip(*parts))
+
+    if minSegment == None:
+        minSegment = max(N//20, 3)
+
+    #centered to keep the sums small
+    mx = x.mean(axis=1, keepdims=True)
+    my = y.mean(axis=1, keepdims=True)
+    xc = x - mx
+    yc = y - my
+
+    def prefix(a):
+        out = np.zeros((a.shape[0], N + 1))
+        np.cumsum(a, axis=1, out=out[:,1:])
+        return out
+
+    S = [prefix(xc), prefix(yc), prefix(xc*xc), prefix(xc*yc), prefix(yc*yc)]
+
+    #left segment [0,k), right segment [k,N)
+    k = np.arange(minSegment, N - minSegment + 1)
+    left, leftSlope = lineResiduals(k, *[s[:,k] for s in S])
+    right, rightSlope = lineResiduals(N - k, *[s[:,N:N+1] - s[:,k] for s in S])
+    total = left + right
+
+    best = total.argmin(axis=1)
+    rows = np.arange(x.shape[0])
+    kBest = k[best]
+    full, _ = lineResiduals(N, *[s[:,N] for s in S])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        confidence = np.where(full > 0, 1 - total[rows,best]/full, 0.0).clip(0,1)
+
+    #intersection of the two lines; the split point itself if they are (nearly) parallel or
+    #do not meet within the curve
+    a1 = leftSlope[rows,best]
+    a2 = rightSlope[rows,best]
+    b1 = (S[1][rows,kBest] - a1*S[0][rows,kBest])/kBest
+    b2 = ((S[1][rows,N] - S[1][rows,kBest]) - a2*(S[0][rows,N] - S[0][rows,kBest]))/(N - kBest)
+    xSplit = 0.5*(xc[rows,kBest-1] + xc[rows,kBest])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x0 = (b2 - b1)/(a1 - a2)
+    inside = np.isfinite(x0) & (x0 >= xc.min(axis=1)) & (x0 <= xc.max(axis=1))
+    x0 = np.where(inside, x0, xSplit) + mx[:,0]
+
+    if single:
+        return float(x0[0]), int(kBest[0]), float(confidence[0])
+    return x0, kBest, confidence
+
+
+#
+#InvOLS from many curves
+#
+
+def segmentSlopes(x,y,start,stop):
+    #slope of the least squares line of each row over its own index range [start,stop), from
+    #prefix sums (no loop over the curves); NaN for ranges of less than 2 points
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    rows = np.arange(x.shape[0])
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+
+    def rangeSum(a):
+        s = np.zeros((a.shape[0], a.shape[1] + 1))
+        np.cumsum(a, axis=1, out=s[:,1:])
+        return s[rows,stop] - s[rows,start]
+
+    n = (stop - start).astype(float)
+    _, slope = lineResiduals(np.maximum(n,1), rangeSum(x), rangeSum(y), rangeSum(x*x), rangeSum(x*y), rangeSum(y*y))
+    return np.where(n >= 2, slope, np.nan)
+
+
+def contactRegions(deflRet,contact,plateauThreshold=-0.03,contactFraction=0.95):
+    #index range [start,stop) of the contact line of each retract curve: from the end of the initial
+    #plateau (first step below plateauThreshold, 0 if there is none, as FindPlateauEnd) to
+    #contactFraction of the contact point
+    N = deflRet.shape[1]
+    drops = np.diff(deflRet, axis=1)[:, :max(N-3,0)] < plateauThreshold
+    start = np.where(drops.any(axis=1), drops.argmax(axis=1), 0)
+    stop = np.minimum((contactFraction*np.asarray(contact)).astype(int), N)
+    return start, np.maximum(stop, start)
+
+
+def batchInvOLS(distRet,deflRet,plateauThreshold=-0.03,contactFraction=0.95,minConfidence=0.5,outlierMAD=3.5):
+    #InvOLS (nm/V) of each retract curve (rows of distRet/deflRet) and robust statistics.
+    #As in MainWindow.AutoInvOLSFunc the fit runs from the end of the initial plateau (first step
+    #below plateauThreshold) to contactFraction of the contact point, which comes from
+    #contactPoints. Curves with a low contact confidence are not used, the remaining ones are
+    #outliers if they are more than outlierMAD scaled median absolute deviations from the median.
+    distRet = np.atleast_2d(distRet)
+    deflRet = np.atleast_2d(deflRet)
+
+    _, contact, confidence = contactPoints(distRet, deflRet)
+    start, stop = contactRegions(deflRet, contact, plateauThreshold, contactFraction)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        invOLS = -1/segmentSlopes(distRet, deflRet, start, stop)
+
+    usable = np.isfinite(invOLS) & (confidence >= minConfidence)
+    report = {"n": len(invOLS), "values": invOLS, "confidence": confidence, "used": usable.copy(),
+              "outliers": [], "invOLS": None, "mean": None, "std": None, "median": None, "mad": None}
+    if not usable.any():
+        return report
+
+    median = float(np.median(invOLS[usable]))
+    mad = 1.4826*float(np.median(np.abs(invOLS[usable] - median)))
+    if mad > 0:
+        outliers = usable & (np.abs(invOLS - median) > outlierMAD*mad)
+    else:
+        outliers = usable & (invOLS != median)
+    usable &= ~outliers
+
+    values = invOLS[usable]
+    report.update({"used": usable, "outliers": np.nonzero(outliers)[0].tolist(),
+                   "invOLS": float(np.median(values)), "mean": float(values.mean()),
+                   "std": float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+                   "median": median, "mad": mad})
+    return report
@@ -0,0 +1,80 @@
+#!/home/afm/python/daq_venv/bin/python
+
+#Force curve oversampling benchmark
+#
+#Acquires force curves with different oversampling factors and reports, for each factor, the time
+#per curve, the throughput (points/s) and the deflection noise in the free (non-contact) part of the
+#approach, i.e. the SNR gained against the throughput lost. The noise is the rms residual of a
+#straight line fit, so the slope of the baseline does not count.
+#
+#Usage:
+#       force_benchmark.py [--hardware] [--factors 1,2,4,8,16] [--curves N] [--points N]
+#                          [--reduction mean|median] [--rate S/s]
+#
+#Without --hardware it runs on sim_hardware (scan time simulated, noise added to every sample).
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+import force_curve
+
+
+def baselineNoise(defl,fraction=0.4):
+    #rms residual of a line through the first part of the approach
+    n = max(int(fraction*len(defl)), 3)
+    y = defl[:n]
+    x = np.arange(n)
+    C = np.polyfit(x, y, 1)
+    return float(np.sqrt(np.mean((y - np.polyval(C, x))**2)))
+
+
+def run(ad,da,adDevice,args,factor):
+    times = []
+    noise = []
+    for i in range(0,args.curves):
+        t0 = time.perf_counter()
+        data = force_curve.acquireForceCurve(ad, da, args.defChn, args.disChn, 2.5, 2.5, -1.0, args.points, args.rawOption,
+                                             oversample=factor, reduction=args.reduction, scanRate=args.rate)
+        times.append(time.perf_counter() - t0)
+        deflV = force_curve.rawToVolts(data.defl.astype(float), adDevice.maxV, adDevice.maxADC*data.codeScale)
+        noise.append(baselineNoise(deflV[data.approachSlice()]))
+    return float(np.mean(times)), float(np.sqrt(np.mean(np.square(noise)))), len(data.defl)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Force curve oversampling benchmark")
+    parser.add_argument("--hardware", action="store_true", help="use the DAQ HATs instead of the simulation")
+    parser.add_argument("--factors", default="1,2,4,8,16", help="oversampling factors")
+    parser.add_argument("--curves", type=int, default=3, help="curves per factor")
+    parser.add_argument("--points", type=int, default=500, help="forceDataPoints")
+    parser.add_argument("--reduction", default="mean", choices=force_curve.REDUCTIONS)
+    parser.add_argument("--rate", type=float, default=force_curve.SCAN_RATE, help="scan rate per channel in S/s")
+    args = parser.parse_args()
+    args.defChn = 1
+    args.disChn = 4
+
+    if args.hardware:
+        from daqhats import OptionFlags
+        from hardware import hat_device
+        adDevice = hat_device("mcc118")
+        adDevice.select_hat(0)
+        daDevice = hat_device("mcc152")
+        daDevice.select_hat(0)
+        args.rawOption = OptionFlags.NOSCALEDATA
+    else:
+        import sim_hardware
+        adDevice = sim_hardware.SimHatDevice("mcc118")
+        daDevice = sim_hardware.SimHatDevice("mcc152")
+        args.rawOption = sim_hardware.NOSCALEDATA
+
+    print("%8s %12s %14s %12s %10s %14s" % ("factor", "s/curve", "points/s", "noise mV", "SNR dB", "throughput %"))
+    reference = None
+    for factor in [int(f) for f in args.factors.split(",")]:
+        t, noise, points = run(adDevice.hat, daDevice.hat, adDevice, args, factor)
+        if reference == None:
+            reference = (t, noise)
+        gain = 20*math.log10(reference[1]/noise) if noise > 0 else float("inf")
+        print("%8d %12.3f %14.0f %12.3f %10.1f %14.1f" % (factor, t, points/t, 1e3*noise, gain, 100*reference[0]/t))
@@ -0,0 +1,179 @@
+#Force curve acquisition
+#
+#Drives the z-piezo (analog output 0 of the MCC 152) through
+#
+#       cosine ramp out -> approach -> hold (optional) -> retract -> cosine ramp back
+#
+#and reads deflection and distance (MCC 118, raw ADC codes) at every point. Shared by the GUI
+#and the headless control core; scaling to volts and nm is left to the caller. The drive voltages
+#come precomputed from waveforms.forceCurveWaveform (linear or sinusoidal sweep).
+#
+#Oversampling (oversample > 1): every point is a finite scan of oversample samples per channel
+#(a_in_scan_*), the blocks of all points are reduced together after the curve (mean or median).
+#The reduced codes are stored multiplied by OVERSAMPLE_CODE_SCALE (data.codeScale) to keep the
+#extra resolution in the int16 arrays; convert with maxADC*data.codeScale.
+#
+#minMaxEnvelope / ForceCurveDecimator reduce long curves to what the plot can show.
+
+import time
+import numpy as np
+
+import waveforms
+
+RETRACT_POINTS = 100
+OVERSAMPLE_CODE_SCALE = 4       #4096*4 still fits the int16 maxADC field of the .dfc header
+SCAN_RATE = 50000               #samples/s per channel (MCC 118: 100 kS/s for all channels)
+REDUCTIONS = ["mean", "median"]
+
+
+class ForceCurveRaw():
+    def __init__(self,N,retractPnts,holdPnts=0):
+        self.N = N
+        self.retractPnts = retractPnts
+        self.holdPnts = holdPnts
+        self.defl = np.zeros(2*N + 2*retractPnts + holdPnts, dtype='int16')
+        self.dist = np.zeros(2*N + 2*retractPnts + holdPnts, dtype='int16')
+        self.apprT = 0
+        self.retrT = 0
+        self.holdT = 0
+        self.timeStep = 0
+        self.oversample = 1
+        self.codeScale = 1
+
+    def approachSlice(self):
+        return slice(self.retractPnts, self.retractPnts + self.N)
+
+    def holdSlice(self):
+        return slice(self.retractPnts + self.N, self.retractPnts + self.N + self.holdPnts)
+
+    def retractSlice(self):
+        return slice(self.retractPnts + self.N + self.holdPnts, self.retractPnts + 2*self.N + self.holdPnts)
+
+
+def acquireForceCurve(ad,da,defChn,disChn,forceOffset,retractionVoltage,extensionVoltage,forceDataPoints,rawOption,retractPnts=RETRACT_POINTS,holdPnts=0,sweep="linear",
+                      oversample=1,reduction="mean",scanRate=SCAN_RATE):
+    #ad: mcc118 object, da: mcc152 object, rawOption: OptionFlags.NOSCALEDATA
+    wave = waveforms.forceCurveWaveform(forceOffset,retractionVoltage,extensionVoltage,forceDataPoints,retractPnts,holdPnts,sweep)
+
+    data = ForceCurveRaw(int(forceDataPoints/2),retractPnts,holdPnts)
+    if oversample > 1:
+        return acquireOversampled(ad,da,defChn,disChn,wave,data,rawOption,oversample,reduction,scanRate)
+
+    write = da.a_out_write
+    read = ad.a_in_read
+    defl = []
+    dist = []
+
+    times = {}
+    start_time = time.time()
+    for name, volts in wave.lists:
+        t0 = time.time()
+        for voltage in volts:
+            write(0,voltage)
+            defl.append(read(defChn,options=rawOption))
+            dist.append(read(disChn,options=rawOption))
+        times[name] = time.time() - t0
+    stop_time = time.time()
+
+    data.defl[:] = defl
+    data.dist[:] = dist
+    data.timeStep = (stop_time - start_time)/len(defl)
+    data.apprT = times["approach"]
+    data.retrT = times["retract"]
+    data.holdT = times["hold"]
+
+    return data
+
+
+def scanBlock(ad,mask,samples,scanRate,rawOption,timeout):
+    #one finite scan of samples per channel; the scan is always stopped and cleaned up, otherwise
+    #the MCC 118 stays in scan mode and every later a_in_read or scan fails
+    nChannels = bin(mask).count("1")
+    try:
+        ad.a_in_scan_start(mask,samples,scanRate,rawOption)
+        result = ad.a_in_scan_read_numpy(samples,timeout)
+    finally:
+        ad.a_in_scan_stop()
+        ad.a_in_scan_cleanup()
+
+    if result.hardware_overrun or result.buffer_overrun:
+        raise RuntimeError("ERROR: Scan overrun (hardware %d, buffer %d)!" % (result.hardware_overrun, result.buffer_overrun))
+    if result.timeout or (len(result.data) != samples*nChannels):
+        raise RuntimeError("ERROR: Incomplete scan, %d of %d samples!" % (len(result.data), samples*nChannels))
+    return result.data
+
+
+def acquireOversampled(ad,da,defChn,disChn,wave,data,rawOption,oversample,reduction,scanRate):
+    write = da.a_out_write
+    mask = (1 << defChn) | (1 << disChn)
+    timeout = 5*oversample/scanRate + 1.0
+    blocks = []
+
+    times = {}
+    start_time = time.time()
+    for name, volts in wave.lists:
+        t0 = time.time()
+        for voltage in volts:
+            write(0,voltage)
+            blocks.append(scanBlock(ad,mask,oversample,scanRate,rawOption,timeout))
+        times[name] = time.time() - t0
+    stop_time = time.time()
+
+    #(points, samples, channels), the scan data is interleaved in ascending channel order
+    raw = np.stack(blocks).reshape(len(blocks), oversample, -1)
+    if reduction == "median":
+        reduced = np.median(raw, axis=1)
+    else:
+        reduced = raw.mean(axis=1)
+    defCol = 0 if (defChn < disChn) else 1
+
+    data.oversample = oversample
+    data.codeScale = OVERSAMPLE_CODE_SCALE
+    data.defl[:] = np.round(reduced[:,defCol]*OVERSAMPLE_CODE_SCALE)
+    data.dist[:] = np.round(reduced[:,1-defCol]*OVERSAMPLE_CODE_SCALE)
+    data.timeStep = (stop_time - start_time)/len(blocks)
+    data.apprT = times["approach"]
+    data.retrT = times["retract"]
+    data.holdT = times["hold"]
+
+    return data
+
+
+def rawToVolts(raw,maxV,maxADC):
+    return 2*maxV*(raw/maxADC) - maxV
+
+
+def minMaxEnvelope(x,y,nBins):
+    #Reduces a curve to the samples with the smallest and the largest y of nBins consecutive
+    #blocks, kept in their original order, so the plotted line looks the same at nBins pixels.
+    n = len(y)
+    if n <= 2*nBins:
+        return x, y
+
+    k = -(-n//nBins)    #samples per block
+    m = (n//k)*k
+    blocks = y[:m].reshape(-1,k)
+    offsets = k*np.arange(blocks.shape[0])
+    idx = np.sort(np.stack((blocks.argmin(axis=1) + offsets, blocks.argmax(axis=1) + offsets), axis=1), axis=1).ravel()
+
+    if m < n:
+        tail = y[m:]
+        idx = np.concatenate((idx, np.sort([m + tail.argmin(), m + tail.argmax()])))
+
+    return x[idx], y[idx]
+
+
+class ForceCurveDecimator():
+    #Envelopes of the approach and retract segments of the current force curve for one phase shift
+    #and plot width. invalidate() has to be called when the curve data changes.
+    def __init__(self):
+        self.cache = {}
+
+    def invalidate(self):
+        self.cache = {}
+
+    def get(self,shift,nBins,distApp,deflApp,distRet,deflRet):
+        key = (shift, nBins)
+        if key not in self.cache:
+            self.cache[key] = minMaxEnvelope(distApp,deflApp,nBins) + minMaxEnvelope(distRet,deflRet,nBins)
+        return self.cache[key]
@@ -0,0 +1,130 @@
+#Force volume
+#
+#A grid of force curves in one file. All curves of a grid have the same length, so every record
+#has the same size and is found by its record number:
+#
+#       "DFCGRID1"                      magic (8 bytes)
+#       meta length (I) + JSON          nx, ny, samples, ...
+#       index (nx*ny int32)             record number of each pixel (row major, y*nx + x), -1 = empty
+#       records                         .dfc header (ForceX/ForceY = pixel) + deflection + distance
+#                                       (int16), in the order of acquisition
+#
+#A record is written before its index entry, so an interrupted acquisition leaves only complete
+#curves in the index. A pixel that is measured again gets a new record, the index points to the
+#newest one.
+#
+#ForceVolumeMaps keeps the per-pixel maps (adhesion, contact height, contact slope), updated with
+#every new curve, so the maps can be shown while the grid is acquired.
+
+import json
+import os
+import struct
+import numpy as np
+
+import dfc_file
+import force_analysis
+
+MAGIC = b"DFCGRID1"
+
+
+class ForceVolumeStore():
+    def __init__(self,path):
+        #opens an existing grid file, see create()
+        self.path = path
+        self.f = open(path, 'r+b')
+        if self.f.read(len(MAGIC)) != MAGIC:
+            self.f.close()
+            raise ValueError("'" + path + "' is not a force volume file")
+
+        metaLen = struct.unpack('<I', self.f.read(4))[0]
+        self.meta = json.loads(self.f.read(metaLen).decode())
+        self.nx = self.meta["nx"]
+        self.ny = self.meta["ny"]
+        self.samples = self.meta["samples"]
+
+        self.indexOffset = len(MAGIC) + 4 + metaLen
+        self.index = np.fromfile(self.f, dtype='<i4', count=self.nx*self.ny).reshape(self.ny, self.nx)
+        self.dataOffset = self.indexOffset + 4*self.nx*self.ny
+        self.recordSize = dfc_file.HEADER_SIZE + 4*self.samples
+        self.records = (os.path.getsize(path) - self.dataOffset)//self.recordSize
+
+    @classmethod
+    def create(cls,path,nx,ny,samples,**meta):
+        meta = dict(meta, version=1, nx=nx, ny=ny, samples=samples)
+        raw = json.dumps(meta).encode()
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(raw)))
+            f.write(raw)
+            np.full(nx*ny, -1, dtype='<i4').tofile(f)
+        return cls(path)
+
+    def append(self,x,y,header,defl,dist):
+        #header: dfc header dict, ForceX/ForceY are set to the pixel
+        if len(defl) != self.samples:
+            raise ValueError("curve has " + str(len(defl)) + " points, the grid " + str(self.samples))
+
+        values = dict(header, ForceX=x, ForceY=y, sample_cnt=self.samples)
+        record = self.records
+        self.f.seek(self.dataOffset + record*self.recordSize)
+        self.f.write(struct.pack(dfc_file.HEADER_FORMAT, *[values[key] for key in dfc_file.HEADER_FIELDS]))
+        self.f.write(np.asarray(defl, dtype='<i2').tobytes())
+        self.f.write(np.asarray(dist, dtype='<i2').tobytes())
+        self.f.flush()
+
+        self.f.seek(self.indexOffset + 4*(y*self.nx + x))
+        self.f.write(struct.pack('<i', record))
+        self.f.flush()
+
+        self.index[y,x] = record
+        self.records += 1
+
+    def filled(self):
+        return self.index >= 0
+
+    def read(self,x,y):
+        #header dict, deflection and distance (int16) of a pixel, None if it is empty
+        record = self.index[y,x]
+        if record < 0:
+            return None
+        self.f.seek(self.dataOffset + record*self.recordSize)
+        header = dict(zip(dfc_file.HEADER_FIELDS, struct.unpack(dfc_file.HEADER_FORMAT, self.f.read(dfc_file.HEADER_SIZE))))
+        data = np.frombuffer(self.f.read(4*self.samples), dtype='<i2')
+        return header, data[:self.samples], data[self.samples:]
+
+    def exportDfc(self,x,y,path):
+        curve = self.read(x,y)
+        if curve != None:
+            dfc_file.writeDfc(path, *curve)
+
+    def close(self):
+        self.f.close()
+
+
+class ForceVolumeMaps():
+    NAMES = ["adhesion", "height", "slope"]
+    UNITS = {"adhesion": "nN", "height": "nm", "slope": "V/nm"}
+
+    def __init__(self,nx,ny):
+        self.maps = {name: np.full((ny,nx), np.nan) for name in self.NAMES}
+        self.confidence = np.full((ny,nx), np.nan)
+
+    def update(self,x,y,x0,distRet,deflRet,invOLS,springConst,minConfidence=0.5):
+        #one new curve: retract curve after the zero estimate (x0: contact point before zeroing).
+        #Height and slope are NaN for a curve without a clear contact (confidence < minConfidence).
+        distRet = np.atleast_2d(distRet)
+        deflRet = np.atleast_2d(deflRet)
+        n = deflRet.shape[1]
+
+        _, contact, confidence = force_analysis.contactPoints(distRet, deflRet)
+        start, stop = force_analysis.contactRegions(deflRet, contact)
+        baseline = np.median(deflRet[0, int(0.9*n):])
+
+        contact = confidence[0] >= minConfidence
+        self.maps["height"][y,x] = x0 if contact else np.nan
+        self.maps["adhesion"][y,x] = (baseline - deflRet[0].min())*invOLS*springConst
+        self.maps["slope"][y,x] = force_analysis.segmentSlopes(distRet, deflRet, start, stop)[0] if contact else np.nan
+        self.confidence[y,x] = confidence[0]
+
+    def save(self,path):
+        np.savez(path, confidence=self.confidence, **self.maps)
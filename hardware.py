@@ -0,0 +1,102 @@
+#Hardware access for the MCC DAQ HATs and the case fan
+#
+#Kept free of Qt so that the GUI (motor_control.py) and the headless control server
+#(control_server.py) can share it.
+
+from daqhats import mcc118, mcc152, OptionFlags, HatIDs, HatError, hat_list
+
+import RPi.GPIO as GPIO
+
+
+class hat_device():
+    def __init__(self,hType):
+        self.options = OptionFlags.DEFAULT
+        self.type = hType
+        if self.type == "mcc118":
+            self.id = HatIDs.MCC_118
+            self.maxV = 10.0
+            self.maxADC = 4096.0
+        elif self.type == "mcc152":
+            self.id = HatIDs.MCC_152
+        else:
+            self.id == None
+
+        if self.id == None:
+            raise ValueError("ERROR: Invalid HAT type. Please specify either \"mcc118\" or \"mcc152\"!")
+
+        self.address = None
+        self.hat = None
+
+    def select_hat(self,n):
+        hats = hat_list(filter_by_id=self.id)
+        nHats = len(hats)
+
+
+        if nHats < 1:
+            raise HatError(0, "ERROR: No HAT devices found!")
+        elif nHats == 1:
+            self.address = hats[0].address
+        else:
+            if n <= nHats:
+                self.address = hats[n].address
+            else:
+                raise ValueError("ERROR: Invalid HAT selection!")
+
+        if self.address == None:
+            raise ValueError("ERROR: No HAT could be selected!")
+
+        if self.type == "mcc118":
+            self.hat = mcc118(self.address)
+        elif self.type == "mcc152":
+            self.hat = mcc152(self.address)
+        else:
+            self.hat = None
+
+class FanControl():
+    def __init__(self,hat,chn=7):
+        self.chn = chn
+        self.hat = hat
+
+        self.mode = 0 # 0 - DIO // 1 - GPIO
+        self.state = 0
+
+        self.set_fan()
+
+    def set_fan(self):
+        if self.chn == 7:
+            #DIO7
+            self.mode = 0
+            self.hat.dio_output_write_bit(self.chn, self.state)
+        else:
+            self.mode = 1
+            if self.chn == 22:
+                self.pin = 15
+            elif self.chn == 23:
+                self.pin = 16
+            elif self.chn == 24:
+                self.pin = 18
+            elif self.chn == 27:
+                self.pin = 13
+            else:
+                self.pin = 15
+
+            GPIO.setwarnings(False)
+            GPIO.setmode(GPIO.BOARD)
+            GPIO.setup(self.pin,GPIO.OUT)
+            self.GPIO_Out(self.pin,self.state)
+
+
+    def GPIO_Out(self,pin,state):
+        if state == 0:
+            GPIO.output(pin, GPIO.LOW)
+        else:
+            GPIO.output(pin, GPIO.HIGH)
+
+    def on(self):
+        self.state = 1
+        self.set_fan()
+
+
+    def off(self):
+        self.state = 0
+        self.set_fan()
@@ -0,0 +1,81 @@
+#Meter history
+#
+#Fixed size ring buffer for the meter channels (one NumPy row per channel plus the sample times)
+#and min/max decimation to a number of screen columns. The decimation works on time bins because
+#the meter sampling rate changes with the motor state (see MainWindow.UpdateADRate).
+
+import numpy as np
+
+
+class HistoryBuffer():
+    def __init__(self,capacity,nChannels=4):
+        self.capacity = capacity
+        self.nChannels = nChannels
+        self.t = np.zeros(capacity)
+        self.data = np.zeros((nChannels,capacity), dtype='float32')
+        self.index = 0      #next write position
+        self.count = 0
+
+    def append(self,t,*values):
+        i = self.index
+        self.t[i] = t
+        self.data[:,i] = values
+        self.index = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+    def ordered(self):
+        #times and data of all samples, oldest first
+        if self.count < self.capacity:
+            return self.t[:self.count], self.data[:,:self.count]
+        return np.concatenate((self.t[self.index:], self.t[:self.index])), np.concatenate((self.data[:,self.index:], self.data[:,:self.index]), axis=1)
+
+    def since(self,t0):
+        #samples with t >= t0, oldest first; only the part of the ring that is needed is copied
+        if self.count == 0:
+            return self.t[:0], self.data[:,:0]
+
+        start = (self.index - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            segments = [(start, start + self.count)]
+        else:
+            segments = [(start, self.capacity), (0, self.index)]
+
+        #the newest segment is searched first, older samples are only needed for long spans
+        first = segments[-1]
+        k = np.searchsorted(self.t[first[0]:first[1]], t0)
+        if (k > 0) or (len(segments) == 1):
+            a = first[0] + k
+            return self.t[a:first[1]], self.data[:,a:first[1]]
+
+        older = segments[0]
+        k = np.searchsorted(self.t[older[0]:older[1]], t0)
+        a = older[0] + k
+        return (np.concatenate((self.t[a:older[1]], self.t[first[0]:first[1]])),
+                np.concatenate((self.data[:,a:older[1]], self.data[:,first[0]:first[1]]), axis=1))
+
+
+def minMaxDecimate(t,data,t0,t1,nBins):
+    #data: (channels, samples), t: ascending sample times
+    #returns mins and maxs (channels, nBins) of the samples in each of the nBins time bins between
+    #t0 and t1, and a mask of the bins that contain samples
+    edges = np.searchsorted(t, np.linspace(t0,t1,nBins+1))
+    starts = edges[:-1]
+    valid = edges[1:] > starts
+
+    nCh = data.shape[0]
+    mins = np.zeros((nCh,nBins), dtype=data.dtype)
+    maxs = np.zeros((nCh,nBins), dtype=data.dtype)
+    if np.any(valid):
+        #Only the start of the non-empty bins is passed to reduceat; as the empty bins in between
+        #hold no samples, each reduction covers exactly one bin.
+        window = data[:, edges[0]:edges[-1]]
+        idx = starts[valid] - edges[0]
+        mins[:,valid] = np.minimum.reduceat(window, idx, axis=1)
+        maxs[:,valid] = np.maximum.reduceat(window, idx, axis=1)
+
+    return mins, maxs, valid
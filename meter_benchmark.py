@@ -0,0 +1,155 @@
+#!/home/afm/python/daq_venv/bin/python
+
+#Meter benchmark
+#
+#Compares the cost of one meter update of the former matplotlib bar canvas (restore_region,
+#four draw_artist calls, blit, flush_events) with the QPainter based BarMeterWidget. Both get
+#the same random walk of values, every update includes processing the resulting paint events.
+#
+#Usage:
+#       meter_benchmark.py [--updates N] [--step V] [--offscreen]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def percentile(times,p):
+    return 1e6*float(np.percentile(times,p))
+
+
+def report(name,times):
+    times = np.asarray(times)
+    print("%-20s mean %8.1f us   median %8.1f us   99%% %8.1f us   total %7.3f s" %
+          (name, 1e6*times.mean(), percentile(times,50), percentile(times,99), times.sum()))
+
+
+class MatplotlibMeter():
+    #the meter canvas as it was built in MainWindow.ControlTab
+    def __init__(self,bg_color):
+        import matplotlib
+        matplotlib.use('Qt5Agg')
+        import matplotlib.patches
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
+        self.canvas = FigureCanvas(Figure(figsize=(5,1.8)))
+        self.canvas.setMinimumHeight(180)
+        self.canvas.setMinimumWidth(500)
+        self.canvas.setMaximumWidth(500)
+
+        self.axes = self.canvas.figure.subplots()
+        self.canvas.figure.set_layout_engine('constrained')
+        self.canvas.figure.set_facecolor(bg_color)
+        self.axes.set_xlim((-10.1,10.1))
+        self.axes.set_ylim((-0.55,3.55))
+        self.axes.axis('off')
+        self.axes.add_patch(matplotlib.patches.Rectangle((-10.1,-1),20,4.5,color="#DDDDDD"))
+        self.axes.plot([0,0],[-0.5,0.5],color='#000000',ls=':')
+        self.axes.plot([0,0],[1.5,2.5],color='#000000',ls=':')
+        self.axes.plot([-11,11],[0.5,0.5],color='#333333')
+        self.axes.plot([-11,11],[1.49,1.49],color='#333333')
+        self.axes.plot([-11,11],[2.49,2.49],color='#333333')
+        self.axes.plot([-10.1,10.05,10.05,-10.1,-10.1],[-0.5,-0.5,3.5,3.5,-0.5],color='#333333',linewidth='2')
+
+        self.defColor1 = "#004488"
+        self.defColor2 = "#4488AA"
+        self.zpiColor1 = "#880000"
+        self.zpiColor2 = "#AA4444"
+        self.sumRect = self.axes.add_patch(matplotlib.patches.Rectangle((-10,2.65),0,0.7,color="#880099"))
+        self.defRect = self.axes.add_patch(matplotlib.patches.Rectangle((0,1.65),0,0.7,color=self.defColor1))
+        self.ampRect = self.axes.add_patch(matplotlib.patches.Rectangle((-10,0.65),0,0.7,color="#33AAAA"))
+        self.zpiRect = self.axes.add_patch(matplotlib.patches.Rectangle((0,-0.35),0,0.7,color=self.zpiColor1))
+        for patch in (self.sumRect, self.defRect, self.ampRect, self.zpiRect):
+            patch.set_animated(True)
+
+    def widget(self):
+        return self.canvas
+
+    def prepare(self):
+        self.canvas.draw()
+        self.FigBG = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+
+    def update(self,x,y,a,z):
+        self.sumRect.set_width(10*x)
+        self.defRect.set_width(y)
+        self.defRect.set_color(self.defColor1 if y < 0 else self.defColor2)
+        self.ampRect.set_width(10*a)
+        self.zpiRect.set_width(2*z)
+        self.zpiRect.set_color(self.zpiColor1 if z < 0 else self.zpiColor2)
+
+        self.canvas.restore_region(self.FigBG)
+        self.axes.draw_artist(self.sumRect)
+        self.axes.draw_artist(self.defRect)
+        self.axes.draw_artist(self.ampRect)
+        self.axes.draw_artist(self.zpiRect)
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
+
+
+class WidgetMeter():
+    def __init__(self,bg_color):
+        import meter_widget
+
+        self.meter = meter_widget.BarMeterWidget("#880099", ("#004488","#4488AA"), "#33AAAA", ("#880000","#AA4444"), bg_color)
+        self.meter.setMinimumHeight(180)
+        self.meter.setMinimumWidth(500)
+        self.meter.setMaximumWidth(500)
+
+    def widget(self):
+        return self.meter
+
+    def prepare(self):
+        pass
+
+    def update(self,x,y,a,z):
+        self.meter.setValues(x,y,a,z)
+
+
+def run(meter,app,values):
+    times = []
+    for x, y, a, z in values:
+        t0 = time.perf_counter()
+        meter.update(x,y,a,z)
+        app.processEvents()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Meter update benchmark")
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates per meter")
+    parser.add_argument("--step", type=float, default=0.05, help="random walk step in V")
+    parser.add_argument("--offscreen", action="store_true", help="use the offscreen Qt platform")
+    args = parser.parse_args()
+
+    if args.offscreen:
+        os.environ["QT_QPA_PLATFORM"] = "offscreen"
+
+    from PyQt5 import QtWidgets
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+    rng = np.random.default_rng(1)
+    values = np.cumsum(rng.normal(0.0,args.step,(args.updates,4)),axis=0)
+    values[:,0] = np.clip(values[:,0] + 1.0, 0, 2)      #sum
+    values[:,2] = np.clip(values[:,2] + 1.0, 0, 2)      #amplitude
+    values = np.clip(values,-10,10)
+
+    for name, meterClass in (("matplotlib canvas", MatplotlibMeter), ("BarMeterWidget", WidgetMeter)):
+        window = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(window)
+        bg_color = window.palette().color(window.backgroundRole()).name()
+        meter = meterClass(bg_color)
+        layout.addWidget(meter.widget())
+        window.show()
+        app.processEvents()
+        meter.prepare()
+
+        report(name, run(meter,app,values))
+        window.close()
+
+    sys.exit(0)
@@ -0,0 +1,155 @@
+#Meter recorder
+#
+#Streams the meter channels (sum, deflection, amplitude, z-piezo) to disk for later diagnosis of
+#an approach. The samples are stored as raw ADC codes (int16) with the time step to the previous
+#sample (uint16, in 0.1 ms) in fixed size chunks:
+#
+#       "METREC01", meta length (I), JSON meta       names, maxV, maxADC, chunkSamples, start time
+#       chunk:  "CHNK", n (I), t0 monotonic (d), t0 wall clock (d), n records of 4*int16 + uint16
+#
+#Memory is bounded: a fixed pool of chunk buffers is allocated at the start. append() (timer, GUI
+#thread) only writes into the current buffer and hands full ones to the writer thread, which
+#writes and returns them to the pool. If the writer falls behind and the pool is empty, samples
+#are dropped and counted instead of blocking the caller or allocating more memory. A chunk is also
+#handed over when it is older than maxChunkAgeS, so a crash loses at most that much.
+
+import json
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"METREC01"
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = "<4sIdd"
+TICK = 1e-4                 #time step unit in s
+RECORD = np.dtype([("codes", "<i2", (4,)), ("dt", "<u2")])
+
+
+class MeterRecorder():
+    def __init__(self,path,maxV,maxADC,names=("sum","def","amp","zpi"),chunkSamples=4096,nBuffers=8,maxChunkAgeS=60.0):
+        self.path = path
+        self.maxV = maxV
+        self.maxADC = maxADC
+        self.chunkSamples = chunkSamples
+        self.maxChunkAgeS = maxChunkAgeS
+
+        self.free = queue.Queue()
+        for i in range(0,nBuffers):
+            self.free.put(np.zeros(chunkSamples, dtype=RECORD))
+        self.full = queue.Queue()
+
+        self.buffer = None
+        self.n = 0
+        self.t0 = 0.0
+        self.wall0 = 0.0
+        self.lastT = None
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+
+        meta = json.dumps({"version": 1, "names": list(names), "maxV": maxV, "maxADC": maxADC,
+                           "chunkSamples": chunkSamples, "tick": TICK, "start": time.time()}).encode()
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC + struct.pack('<I', len(meta)) + meta)
+        self.f.flush()
+
+        self.thread = threading.Thread(target=self.writer, name="MeterRecorder", daemon=True)
+        self.thread.start()
+
+    def append(self,t,*volts):
+        #t: time.monotonic() of the sample, volts: one value per channel
+        if self.buffer is None:
+            try:
+                self.buffer = self.free.get_nowait()
+            except queue.Empty:
+                self.dropped += 1
+                return
+            self.n = 0
+            self.t0 = t
+            self.wall0 = time.time() - (time.monotonic() - t)
+            self.lastT = t
+
+        #a gap longer than the time step field starts a new chunk
+        ticks = int(round((t - self.lastT)/TICK))
+        if ticks > 0xFFFF:
+            self.handOver()
+            self.append(t,*volts)
+            return
+
+        record = self.buffer[self.n]
+        record["codes"] = [min(max(int(round((v + self.maxV)*self.maxADC/(2*self.maxV))), -32768), 32767) for v in volts]
+        record["dt"] = ticks
+        self.n += 1
+        #advance the quantized clock, not the true one, so the rounding errors don't add up
+        self.lastT += ticks*TICK
+
+        if (self.n >= self.chunkSamples) or (t - self.t0 >= self.maxChunkAgeS):
+            self.handOver()
+
+    def handOver(self):
+        if (self.buffer is not None) and (self.n > 0):
+            self.full.put((self.buffer, self.n, self.t0, self.wall0))
+        elif self.buffer is not None:
+            self.free.put(self.buffer)
+        self.buffer = None
+
+    def writer(self):
+        while True:
+            item = self.full.get()
+            if item is None:
+                break
+            buffer, n, t0, wall0 = item
+            try:
+                self.f.write(struct.pack(CHUNK_HEADER, CHUNK_MAGIC, n, t0, wall0))
+                self.f.write(buffer[:n].tobytes())
+                self.f.flush()
+                self.written += n
+            except (OSError, ValueError) as e:
+                if self.error == None:
+                    print("Could not write the meter recording '" + self.path + "': " + str(e))
+                self.error = e
+                self.dropped += n
+            self.free.put(buffer)
+
+    def close(self):
+        self.handOver()
+        self.full.put(None)
+        self.thread.join()
+        self.f.close()
+
+    def status(self):
+        return {"path": self.path, "written": self.written, "dropped": self.dropped, "freeBuffers": self.free.qsize()}
+
+
+def readRecording(path):
+    #returns the meta dict, the wall clock time of every sample (s) and the values in V
+    #(channels x samples)
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'" + path + "' is not a meter recording")
+        metaLen = struct.unpack('<I', f.read(4))[0]
+        meta = json.loads(f.read(metaLen).decode())
+
+        times = []
+        codes = []
+        headerSize = struct.calcsize(CHUNK_HEADER)
+        while True:
+            raw = f.read(headerSize)
+            if len(raw) < headerSize:
+                break
+            magic, n, t0, wall0 = struct.unpack(CHUNK_HEADER, raw)
+            records = np.frombuffer(f.read(n*RECORD.itemsize), dtype=RECORD)
+            if (magic != CHUNK_MAGIC) or (len(records) < n):
+                break       #truncated by a crash
+            dt = records["dt"].astype(float)*meta["tick"]
+            dt[0] = 0.0
+            times.append(wall0 + np.cumsum(dt))
+            codes.append(records["codes"])
+
+    if not times:
+        return meta, np.zeros(0), np.zeros((len(meta["names"]), 0))
+    codes = np.concatenate(codes).T.astype(float)
+    return meta, np.concatenate(times), 2*meta["maxV"]*codes/meta["maxADC"] - meta["maxV"]
@@ -0,0 +1,215 @@
+#Meter widgets: bar meter and history strip chart
+#
+#The four horizontal bars of the meter (sum, deflection, amplitude, z-piezo) painted directly with
+#QPainter. It uses the same data coordinates as the former matplotlib canvas (x: -10.1..10.1,
+#y: -0.55..3.55) so the bars look the same. The static part (background, center lines,
+#separators, frame) is rendered once into a pixmap; setValues() only invalidates the area between
+#the old and the new end of each bar that changed on the pixel grid.
+
+from PyQt5 import QtWidgets, QtGui
+from PyQt5.QtCore import Qt, QRect, QPointF
+
+
+class BarMeterWidget(QtWidgets.QWidget):
+    X_MIN = -10.1
+    X_MAX = 10.1
+    Y_MIN = -0.55
+    Y_MAX = 3.55
+    MARGIN = 4          #pixels around the plot area
+    BAR_HEIGHT = 0.7
+
+    def __init__(self,sumColor,defColors,ampColor,zpiColors,bgColor="#EFEFEF",parent=None):
+        super(BarMeterWidget, self).__init__(parent)
+
+        #origin, scale, bottom, (color for value < 0, color for value >= 0) - as in setHBarPlot
+        self.bars = [(-10.0, 10.0, 2.65, (QtGui.QColor(sumColor), QtGui.QColor(sumColor))),
+                     (0.0, 1.0, 1.65, (QtGui.QColor(defColors[0]), QtGui.QColor(defColors[1]))),
+                     (-10.0, 10.0, 0.65, (QtGui.QColor(ampColor), QtGui.QColor(ampColor))),
+                     (0.0, 2.0, -0.35, (QtGui.QColor(zpiColors[0]), QtGui.QColor(zpiColors[1])))]
+
+        self.bgColor = QtGui.QColor(bgColor)
+        self.values = [0.0, 0.0, 0.0, 0.0]
+        self.rects = [QRect() for bar in self.bars]
+        self.colors = [bar[3][1] for bar in self.bars]
+        self.background = None
+
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+
+    def setBackgroundColor(self,color):
+        self.bgColor = QtGui.QColor(color)
+        self.background = None
+        self.update()
+
+    def toPixel(self,x,y):
+        w = self.width() - 2*self.MARGIN
+        h = self.height() - 2*self.MARGIN
+        px = self.MARGIN + (x - self.X_MIN)/(self.X_MAX - self.X_MIN)*w
+        py = self.MARGIN + (self.Y_MAX - y)/(self.Y_MAX - self.Y_MIN)*h
+        return px, py
+
+    def barGeometry(self,i,value):
+        origin, scale, bottom, colors = self.bars[i]
+        end = min(max(origin + scale*value, self.X_MIN), self.X_MAX)
+
+        left, top = self.toPixel(min(origin,end), bottom + self.BAR_HEIGHT)
+        right, lower = self.toPixel(max(origin,end), bottom)
+        left = int(round(left))
+        right = int(round(right))
+        top = int(round(top))
+        lower = int(round(lower))
+
+        if value < 0:
+            color = colors[0]
+        else:
+            color = colors[1]
+        return QRect(left, top, right - left, lower - top), color
+
+    def setValues(self,sumV,defV,ampV,zpiV):
+        #returns True if anything has to be repainted
+        self.values = [sumV, defV, ampV, zpiV]
+
+        changed = False
+        for i in range(0,4):
+            rect, color = self.barGeometry(i,self.values[i])
+            if (rect != self.rects[i]) or (color != self.colors[i]):
+                if color != self.colors[i]:
+                    dirty = self.rects[i].united(rect)
+                else:
+                    #only the part between the old and the new end of the bar
+                    dirty = QRect(self.rects[i]).united(rect)
+                    if (self.rects[i].left() == rect.left()) and not self.rects[i].isEmpty():
+                        dirty.setLeft(min(self.rects[i].right(), rect.right()))
+                    elif (self.rects[i].right() == rect.right()) and not self.rects[i].isEmpty():
+                        dirty.setRight(max(self.rects[i].left(), rect.left()))
+                self.rects[i] = rect
+                self.colors[i] = color
+                self.update(dirty.adjusted(-1,-1,1,1))
+                changed = True
+
+        return changed
+
+    def renderBackground(self):
+        self.background = QtGui.QPixmap(self.size())
+        self.background.fill(self.bgColor)
+
+        p = QtGui.QPainter(self.background)
+
+        #plot area, clipped to the axes as in matplotlib
+        x0, y0 = self.toPixel(self.X_MIN, self.Y_MAX)
+        x1, y1 = self.toPixel(self.X_MAX, self.Y_MIN)
+        p.setClipRect(QRect(int(x0), int(y0), int(x1 - x0) + 1, int(y1 - y0) + 1))
+
+        left, top = self.toPixel(-10.1, 3.5)
+        right, bottom = self.toPixel(9.9, -1.0)
+        p.fillRect(QRect(int(round(left)), int(round(top)), int(round(right - left)), int(round(bottom - top))), QtGui.QColor("#DDDDDD"))
+
+        def line(xs, ys, color, width=1, style=Qt.SolidLine):
+            pen = QtGui.QPen(QtGui.QColor(color))
+            pen.setWidthF(width)
+            pen.setStyle(style)
+            p.setPen(pen)
+            points = [QPointF(*self.toPixel(x,y)) for x, y in zip(xs,ys)]
+            p.drawPolyline(QtGui.QPolygonF(points))
+
+        #center lines
+        line([0,0], [-0.5,0.5], "#000000", style=Qt.DotLine)
+        line([0,0], [1.5,2.5], "#000000", style=Qt.DotLine)
+        #separators
+        line([-11,11], [0.5,0.5], "#333333")
+        line([-11,11], [1.49,1.49], "#333333")
+        line([-11,11], [2.49,2.49], "#333333")
+        #box
+        line([-10.1,10.05,10.05,-10.1,-10.1], [-0.5,-0.5,3.5,3.5,-0.5], "#333333", width=2)
+
+        p.end()
+
+    def resizeEvent(self,event):
+        self.background = None
+        for i in range(0,4):
+            self.rects[i], self.colors[i] = self.barGeometry(i,self.values[i])
+        super(BarMeterWidget, self).resizeEvent(event)
+
+    def paintEvent(self,event):
+        if (self.background == None) or (self.background.size() != self.size()):
+            self.renderBackground()
+
+        area = event.rect()
+        p = QtGui.QPainter(self)
+        p.drawPixmap(area, self.background, area)
+        for rect, color in zip(self.rects, self.colors):
+            if rect.intersects(area):
+                p.fillRect(rect, color)
+        p.end()
+
+
+class StripChartWidget(QtWidgets.QWidget):
+    #History of the meter channels, one lane per channel. setData() takes the min/max decimated
+    #columns (see history.minMaxDecimate), each lane is drawn as one filled min/max envelope.
+    MARGIN = 4
+    LABEL_WIDTH = 80
+
+    def __init__(self,names,colors,ranges,parent=None):
+        super(StripChartWidget, self).__init__(parent)
+        self.names = names
+        self.colors = [QtGui.QColor(color) for color in colors]
+        self.ranges = ranges
+        self.mins = None
+        self.maxs = None
+        self.valid = None
+        self.spanText = ""
+
+        self.setMinimumHeight(300)
+
+    def columns(self):
+        return max(self.width() - self.LABEL_WIDTH - 2*self.MARGIN, 1)
+
+    def setData(self,mins,maxs,valid,spanText=""):
+        self.mins = mins
+        self.maxs = maxs
+        self.valid = valid
+        self.spanText = spanText
+        self.update()
+
+    def paintEvent(self,event):
+        p = QtGui.QPainter(self)
+        p.fillRect(self.rect(), self.palette().color(QtGui.QPalette.Window))
+
+        n = len(self.names)
+        x0 = self.LABEL_WIDTH + self.MARGIN
+        laneHeight = (self.height() - 2*self.MARGIN)/n
+
+        for i in range(0,n):
+            top = self.MARGIN + i*laneHeight
+            lane = QRect(x0, int(top), self.columns(), int(laneHeight) - 2)
+            p.fillRect(lane, QtGui.QColor("#DDDDDD"))
+
+            lo, hi = self.ranges[i]
+            p.setPen(QtGui.QColor("#000000"))
+            p.drawText(QRect(0, int(top), self.LABEL_WIDTH, int(laneHeight)), int(Qt.AlignLeft | Qt.AlignVCenter),
+                       self.names[i] + "\n" + str(lo) + " .. " + str(hi) + " V")
+
+            if (lo < 0) and (hi > 0):
+                zeroY = lane.bottom() - (0 - lo)/(hi - lo)*lane.height()
+                p.setPen(QtGui.QPen(QtGui.QColor("#000000"), 1, Qt.DotLine))
+                p.drawLine(QPointF(lane.left(), zeroY), QPointF(lane.right(), zeroY))
+
+            if (self.mins is None) or not self.valid.any():
+                continue
+
+            #columns with samples, values clipped to the lane
+            cols = self.valid.nonzero()[0]
+            scale = lane.height()/(hi - lo)
+            yMax = lane.bottom() - (self.maxs[i,cols].clip(lo,hi) - lo)*scale
+            yMin = lane.bottom() - (self.mins[i,cols].clip(lo,hi) - lo)*scale
+            xs = lane.left() + cols
+
+            points = [QPointF(x,y) for x, y in zip(xs.tolist(), yMax.tolist())]
+            points += [QPointF(x,y) for x, y in zip(reversed(xs.tolist()), reversed(yMin.tolist()))]
+            p.setPen(self.colors[i])
+            p.setBrush(self.colors[i])
+            p.drawPolygon(QtGui.QPolygonF(points))
+            p.setBrush(Qt.NoBrush)
+
+        p.setPen(QtGui.QColor("#333333"))
+        p.drawText(QRect(x0, self.height() - self.MARGIN - 20, self.columns() - 4, 20), int(Qt.AlignRight | Qt.AlignBottom), self.spanText)
+        p.end()
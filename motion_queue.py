@@ -0,0 +1,267 @@
+#Queued motor commands
+#
+#Runs a list of motor commands back-to-back, e.g. for a tip exchange or a re-approach:
+#
+#       retract 5000
+#       wait 1000
+#       autoapproach
+#       retract 200
+#
+#The queue lives in the GUI thread next to the motor timers and PWM objects, it reacts to the
+#motorStopped signal of the main window and starts the next command right away.
+#
+#Script commands (one per line, '#' starts a comment):
+#       retract N [freq]            move N position units away from the sample
+#       approach N [freq]           move N position units towards the sample
+#       speed freq                  default frequency for the following moves
+#       wait ms                     pause
+#       waitfor signal op value [timeout_ms]
+#                                   wait until e.g. "waitfor zpi > 0.5" (signal: sum, def, amp, zpi)
+#       autoapproach                continuous auto approach until the stop conditions are met
+#       stepapproach                step-and-check approach until the stop conditions are met
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class MotionCommand():
+    #waitForStop: the command is finished when the motor stops
+    waitForStop = False
+
+    def start(self,queue):
+        pass
+
+    def description(self):
+        return ""
+
+
+class MoveCommand(MotionCommand):
+    waitForStop = True
+
+    def __init__(self,steps,freq=None):
+        self.steps = steps
+        self.freq = freq
+
+    def start(self,queue):
+        if self.steps == 0:
+            queue.CommandDone()
+            return
+
+        freq = self.freq
+        if freq == None:
+            freq = queue.freq
+        queue.window.MoveRelative(self.steps,freq)
+        if not queue.window.motorRunning:
+            queue.abort()
+
+    def description(self):
+        if self.steps >= 0:
+            return "retract " + str(self.steps)
+        else:
+            return "approach " + str(-self.steps)
+
+
+class SpeedCommand(MotionCommand):
+    def __init__(self,freq):
+        self.freq = freq
+
+    def start(self,queue):
+        queue.freq = self.freq
+        queue.CommandDone()
+
+    def description(self):
+        return "speed " + str(self.freq)
+
+
+class WaitCommand(MotionCommand):
+    def __init__(self,timeMS):
+        self.timeMS = timeMS
+
+    def start(self,queue):
+        queue.waitTimer.start(self.timeMS)
+
+    def description(self):
+        return "wait " + str(self.timeMS) + " ms"
+
+
+class WaitConditionCommand(MotionCommand):
+    def __init__(self,signal,op,value,timeoutMS=0):
+        self.signal = signal
+        self.op = op
+        self.value = value
+        self.timeoutMS = timeoutMS
+
+    def check(self,window):
+        if self.signal == "sum":
+            x = window.sumV
+        elif self.signal == "def":
+            x = window.defF
+        elif self.signal == "amp":
+            x = window.ampF
+        else:
+            x = window.zpiF
+
+        if self.op == ">":
+            return x > self.value
+        else:
+            return x < self.value
+
+    def start(self,queue):
+        queue.StartConditionWait(self)
+
+    def description(self):
+        return "wait for " + self.signal + " " + self.op + " " + str(self.value)
+
+
+class AutoApproachCommand(MotionCommand):
+    waitForStop = True
+
+    def __init__(self,step=False):
+        self.step = step
+
+    def start(self,queue):
+        if self.step:
+            queue.window.StepApproachButtonFunction()
+        else:
+            queue.window.AutoApproachButtonFunction()
+        if not queue.window.motorRunning:
+            queue.abort()
+
+    def description(self):
+        if self.step:
+            return "step approach"
+        return "auto approach"
+
+
+def parseSequence(text):
+    commands = []
+    for lineNr, line in enumerate(text.splitlines()):
+        line = line.split('#')[0].strip()
+        if line == "":
+            continue
+
+        items = line.split()
+        cmd = items[0].lower()
+        args = items[1:]
+
+        try:
+            if cmd in ("retract","approach") and len(args) in (1,2):
+                steps = int(args[0])
+                if cmd == "approach":
+                    steps = -steps
+                freq = None
+                if len(args) == 2:
+                    freq = int(args[1])
+                commands.append(MoveCommand(steps,freq))
+            elif cmd == "speed" and len(args) == 1:
+                commands.append(SpeedCommand(int(args[0])))
+            elif cmd == "wait" and len(args) == 1:
+                commands.append(WaitCommand(int(args[0])))
+            elif cmd == "waitfor" and len(args) in (3,4) and args[0] in ("sum","def","amp","zpi") and args[1] in ("<",">"):
+                timeout = 0
+                if len(args) == 4:
+                    timeout = int(args[3])
+                commands.append(WaitConditionCommand(args[0],args[1],float(args[2]),timeout))
+            elif cmd == "autoapproach" and len(args) == 0:
+                commands.append(AutoApproachCommand())
+            elif cmd == "stepapproach" and len(args) == 0:
+                commands.append(AutoApproachCommand(step=True))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError("ERROR: Invalid sequence command in line " + str(lineNr+1) + ": \"" + line + "\"")
+
+    return commands
+
+
+class MotionQueue(QObject):
+    commandStarted = pyqtSignal(int, str)
+    commandFinished = pyqtSignal(int)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(bool)
+
+    def __init__(self,window,pollTimeMS=10):
+        super(MotionQueue, self).__init__()
+        self.window = window
+        self.commands = []
+        self.index = -1
+        self.running = False
+        self.freq = window.slowMoveFreq
+
+        self.waitTimer = QTimer()
+        self.waitTimer.setSingleShot(True)
+        self.waitTimer.timeout.connect(self.CommandDone)
+
+        self.conditionTimer = QTimer()
+        self.conditionTimer.timeout.connect(self.CheckCondition)
+        self.pollTimeMS = pollTimeMS
+        self.condition = None
+        self.conditionTime = 0
+
+        window.motorStopped.connect(self.MotorStopped)
+
+    def run(self,commands):
+        if self.running or self.window.motorRunning:
+            return False
+
+        self.commands = list(commands)
+        self.index = -1
+        self.running = True
+        self.freq = self.window.slowMoveFreq
+        self.progress.emit(0,len(self.commands))
+        self.NextCommand()
+        return True
+
+    def abort(self):
+        if not self.running:
+            return
+
+        self.running = False
+        self.waitTimer.stop()
+        self.conditionTimer.stop()
+        self.condition = None
+        self.finished.emit(False)
+
+    def NextCommand(self):
+        if not self.running:
+            return
+
+        self.index += 1
+        if self.index >= len(self.commands):
+            self.running = False
+            self.finished.emit(True)
+            return
+
+        cmd = self.commands[self.index]
+        self.commandStarted.emit(self.index,cmd.description())
+        cmd.start(self)
+
+    def CommandDone(self):
+        if not self.running:
+            return
+
+        self.commandFinished.emit(self.index)
+        self.progress.emit(self.index+1,len(self.commands))
+        #Let the stop handling of the main window finish before the next command starts
+        QTimer.singleShot(0,self.NextCommand)
+
+    def MotorStopped(self):
+        if self.running and (0 <= self.index < len(self.commands)) and self.commands[self.index].waitForStop:
+            self.CommandDone()
+
+    def StartConditionWait(self,cmd):
+        self.condition = cmd
+        self.conditionTime = 0
+        self.conditionTimer.start(self.pollTimeMS)
+
+    def CheckCondition(self):
+        if self.condition == None:
+            self.conditionTimer.stop()
+            return
+
+        self.conditionTime += self.pollTimeMS
+        if self.condition.check(self.window):
+            self.conditionTimer.stop()
+            self.condition = None
+            self.CommandDone()
+        elif (self.condition.timeoutMS > 0) and (self.conditionTime >= self.condition.timeoutMS):
+            self.abort()
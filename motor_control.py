@@ -16,157 +16,81 @@
 import sys
 import os
 import time
+
+#Startup timing, see --startup-report
+startupT0 = time.perf_counter()
+startupTimes = []
+
+def startupMark(name):
+    startupTimes.append((name, time.perf_counter()))
+
 import struct
-import matplotlib
-import array
 import gc
 import math
 import numpy as np
-matplotlib.use('Qt5Agg')
 
+startupMark("import numpy")
 
 from datetime import datetime
 
-from daqhats import mcc118, mcc152, OptionFlags, HatIDs, HatError, hat_list, DIOConfigItem
-
-from rpi_hardware_pwm import HardwarePWM
-
 from PyQt5 import QtWidgets, QtGui
-from PyQt5.QtCore import QSize, Qt, QObject, QThread, pyqtSignal, QTimer, QThreadPool, QRunnable
-
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-
-
-import RPi.GPIO as GPIO
-
-
-import buzzer
+from PyQt5.QtCore import QSize, Qt, QObject, QThread, pyqtSignal, QTimer, QEvent
+
+startupMark("import PyQt5")
+
+import approach
+import signal_filter
+import motor_profile
+import motion_queue
+import force_curve
+import force_analysis
+import dfc_file
+import contact_models
+import force_volume
+import waveforms
+import settings_store
+import thermal_monitor
+import meter_widget
+import history
+import meter_recorder
+
+startupMark("import local modules")
+
+#The heavy modules (matplotlib, daqhats, rpi_hardware_pwm, RPi.GPIO via buzzer/hardware) are only
+#imported when they are needed, see LoadMatplotlib (Force Curve tab) and MainWindow.OpenHardware.
+matplotlib = None
+FigureCanvas = None
+Figure = None
+
+def LoadMatplotlib():
+    global matplotlib, FigureCanvas, Figure
+    if matplotlib != None:
+        return
+
+    import matplotlib as mpl
+    mpl.use('Qt5Agg')
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+    from matplotlib.figure import Figure as mplFigure
+
+    matplotlib = mpl
+    FigureCanvas = FigureCanvasQTAgg
+    Figure = mplFigure
+    startupMark("import matplotlib")
 
 apprSound = 1
-
-class BuzzerWorker(QRunnable):
-
-    def run(self):
-        global apprSound
-        self.buz = buzzer.ApproachBuzzer(buzzer="passive")
-        self.buz.playStandardSound(apprSound)
-
-class hat_device():
-    def __init__(self,hType):
-        self.options = OptionFlags.DEFAULT
-        self.type = hType
-        if self.type == "mcc118":
-            self.id = HatIDs.MCC_118
-            self.maxV = 10.0
-            self.maxADC = 4096.0
-        elif self.type == "mcc152":
-            self.id = HatIDs.MCC_152
-        else:
-            self.id == None
-
-        if self.id == None:
-            raise ValueError("ERROR: Invalid HAT type. Please specify either \"mcc118\" or \"mcc152\"!")
-
-        self.address = None
-        self.hat = None
-
-    def select_hat(self,n):
-        hats = hat_list(filter_by_id=self.id)
-        nHats = len(hats)
-
-
-        if nHats < 1:
-            raise HatError(0, "ERROR: No HAT devices found!")
-        elif nHats == 1:
-            self.address = hats[0].address
-        else:
-            if n <= nHats:
-                self.address = hats[n].address
-            else:
-                raise ValueError("ERROR: Invalid HAT selection!")
-
-        if self.address == None:
-            raise ValueError("ERROR: No HAT could be selected!")
-
-        if self.type == "mcc118":
-            self.hat = mcc118(self.address)
-        elif self.type == "mcc152":
-            self.hat = mcc152(self.address)
-        else:
-            self.hat = None
-
-class FanControl():
-    def __init__(self,hat,chn=7):
-        self.chn = chn
-        self.hat = hat
-
-        self.mode = 0 # 0 - DIO // 1 - GPIO
-        self.state = 0
-
-        self.set_fan()
-
-    def set_fan(self):
-        if self.chn == 7:
-            #DIO7
-            self.mode = 0
-            self.hat.dio_output_write_bit(self.chn, self.state)
-        else:
-            self.mode = 1
-            if self.chn == 22:
-                self.pin = 15
-            elif self.chn == 23:
-                self.pin = 16
-            elif self.chn == 24:
-                self.pin = 18
-            elif self.chn == 27:
-                self.pin = 13
-            else:
-                self.pin = 15
-
-            GPIO.setwarnings(False)
-            GPIO.setmode(GPIO.BOARD)
-            GPIO.setup(self.pin,GPIO.OUT)
-            self.GPIO_Out(self.pin,self.state)
-
-
-    def GPIO_Out(self,pin,state):
-        if state == 0:
-            GPIO.output(pin, GPIO.LOW)
-        else:
-            GPIO.output(pin, GPIO.HIGH)
-
-    def on(self):
-        self.state = 1
-        self.set_fan()
-
-
-    def off(self):
-        self.state = 0
-        self.set_fan()
-
+simHardware = False     #set by --sim, uses sim_hardware instead of the DAQ HATs and PWM
 
 class MainWindow(QtWidgets.QMainWindow):
+    motorStopped = pyqtSignal()
+
     def __init__(self, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
         #gc.enable()
 
-        self.threadpool = QThreadPool()
-
-        #select and initialize the AD HAT
-        self.ADHat = hat_device("mcc118")
-        self.ADHat.select_hat(0)
+        self.OpenHardware()
 
-        self.sumPatch = None
-        self.defPatch = None
-        self.ampPatch = None
-        self.zpiPatch = None
-
-        #select and intitalze the DA HAT
-        self.DAHat = hat_device("mcc152")
-        self.DAHat.select_hat(0)
         self.DAHat.hat.dio_reset()
-        self.DAHat.hat.dio_config_write_bit(7,DIOConfigItem.DIRECTION,0)
+        self.DAHat.hat.dio_config_write_bit(7,self.dioDirection,0)
         self.DAHat.hat.dio_output_write_port(0)
 
         self.forceOffset = 2.5
@@ -175,6 +99,16 @@ class MainWindow(QtWidgets.QMainWindow):
         self.DAHat.hat.a_out_write(1,0.0)
 
         self.ADUpdateTimeMS = 2 #how many milliseconds between data acquisition
+        self.idleADUpdateTimeMS = 20        #meter running, motor idle
+        self.stoppedADUpdateTimeMS = 500    #meter stopped or not visible, motor idle
+        self.currADIntervalMS = self.ADUpdateTimeMS
+        self.meterShown = [None, None, None, None]  #values shown in the meter boxes
+        self.meterUpdates = {"applied": 0, "skipped": 0, "barsDrawn": 0, "barsSkipped": 0}
+        self.historyCapacity = 300000               #10 min at 2 ms
+        self.historySpanS = 30
+        self.history = history.HistoryBuffer(self.historyCapacity)
+        self.meterRecordFlag = False                #stream the meter channels to disk (meter_recorder.py)
+        self.meterRecorder = None
         self.graphUpdateTimeMS = 50 #how many millisecond between updating the bar graphs
         self.currGraphCount = 0
 
@@ -204,6 +138,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ampV = 0
         self.zpiV = 0
 
+        #filtered values used by the auto approach trigger
+        self.defF = 0
+        self.ampF = 0
+        self.zpiF = 0
+        self.triggerFilterType = signal_filter.FILTER_MEAN
+        self.triggerFilterWindow = 5
+        self.baselineWindow = 250
+
         self.sumChn = 0
         self.defChn = 1
         self.ampChn = 2
@@ -212,6 +154,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.initialAmp = 0
         self.initialDef = 0
+        self.initialZpi = 0
         self.defLimit = 1.0
         self.zpiLimit = 1.0
         self.ampRatio = 0.5
@@ -228,8 +171,24 @@ class MainWindow(QtWidgets.QMainWindow):
         self.motorRunning = False
         self.autoApproach = False
 
+        self.stepApproach = False
+        self.stepApproachSize = 500     #largest step, in motor position units
+        self.stepApproachMinSize = 10   #smallest step close to the threshold
+        self.stepSettleTimeMS = 50      #wait after each step before measuring
+        self.stepAverageN = 20          #number of readings averaged per measurement
+        self.currStepSize = 0
+        self.stepStartTime = 0
+
         self.startPos = 0
         self.motorDist = 0
+        self.motorDisplayTimeMS = 50    #position display refresh while a limit stop is armed
+        self.moveTravel = 0             #travel of a relative move (0 = no relative move)
+        self.motionProfile = None
+        self.segStartPos = 0
+        self.segStartTime = 0
+        self.limitStopTime = 0
+        self.limitStopPos = None        #position of an armed travel limit
+        self.limitSpinS = 0.002         #last part before a limit stop that is waited for on the GUI thread
         self.slowTravel = 0
         self.fastTravel = 0
 
@@ -239,10 +198,29 @@ class MainWindow(QtWidgets.QMainWindow):
         self.contForceFlag  = False
         self.piezoConst = 18.5
         self.gain = 5
-        self.InvOLS = 1
+        self.InvOLS = 1.0
+        self.invOLSBatchN = 20
+        self.springConst = 0.1          #N/m (= nN/nm)
+        self.tipRadius = 10.0           #nm
+        self.contactModel = "Hertz"
+        self.forceX = 0                 #grid position stamped into the .dfc header (force volume)
+        self.forceY = 0
+        self.forceMapNX = 16
+        self.forceHoldPoints = 0        #dwell at full extension (waveforms.py)
+        self.forceSweep = "linear"
+        self.holdT = 0
+        self.forceOversample = 1        #scan samples per point, reduced by forceReduction
+        self.forceReduction = "mean"
+        self.codeScale = 1
+        self.forceMapNY = 16
         self.phaseShift = 0
+        self.autoPhaseFlag = False
 
         self.fanControlFlag = 0
+        self.fanAutoFlag = 0            #fan switched by the CPU temperature (see thermal_monitor)
+        self.fanOnTemp = 65.0
+        self.fanOffTemp = 55.0
+        self.thermalUpdateTimeMS = 5000
 
         self.homeFolder = os.path.expanduser("~")
         self.forceFolder = self.homeFolder+"/force_curves"
@@ -250,26 +228,165 @@ class MainWindow(QtWidgets.QMainWindow):
         self.fileN = 0
         self.fanChn = 7
 
+        #attributes stored in the settings file (apprSound is a global and handled separately)
+        self.settingsKeys = ["ADUpdateTimeMS", "graphUpdateTimeMS", "fastMoveFreq", "slowMoveFreq",
+                             "autoApproachFreq", "acceleration", "dSpeed", "powerCycle",
+                             "approachChn", "retractChn", "directionChn", "sumChn", "defChn", "ampChn", "zpiChn", "disChn",
+                             "defLimit", "zpiLimit", "ampRatio", "outputMode", "maxTravelFast", "maxTravelSlow",
+                             "fastLimitState", "slowLimitState",
+                             "forceDataPoints", "extensionVoltage", "retractionVoltage", "piezoConst", "gain",
+                             "fanControlFlag", "fanChn", "fanAutoFlag", "fanOnTemp", "fanOffTemp",
+                             "stepApproachSize", "stepApproachMinSize", "stepSettleTimeMS", "stepAverageN",
+                             "triggerFilterType", "triggerFilterWindow", "baselineWindow", "historySpanS", "autoPhaseFlag",
+                             "InvOLS", "invOLSBatchN", "springConst", "tipRadius", "contactModel",
+                             "forceMapNX", "forceMapNY", "forceHoldPoints", "forceSweep",
+                             "forceOversample", "forceReduction", "meterRecordFlag"]
+        self.settingsStore = settings_store.SettingsStore("settings.json")
+        self.settingsSaveDelayMS = 1000
+        self.settingsSaveTimer = QTimer()
+        self.settingsSaveTimer.setSingleShot(True)
+        self.settingsSaveTimer.timeout.connect(self.FlushSettings)
+
         self.LoadSettings()
+        startupMark("load settings")
+
+        self.triggerFilter = signal_filter.ApproachSignalFilter(self.triggerFilterType, self.triggerFilterWindow, self.baselineWindow)
+
+        self.StartBuzzer()
 
         #After an OS update (April 2025), the value for "chip" has to be 0, otherwise it will not work.
         #The manual on the homepage for the rpi_hardware_pwm package originally stated that for RPi5, "chip" should be 2.
         self.chip = 0
-        self.pwm_ccw = HardwarePWM(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
-        self.pwm_cw = HardwarePWM(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
+        self.pwm_ccw = self.PWMClass(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
+        self.pwm_cw = self.PWMClass(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
 
         self.pwm_ccw.stop()
         self.pwm_cw.stop()
 
+        self.thermalMonitor = thermal_monitor.ThermalMonitor(logPath=self.homeFolder+"/motor_control_thermal.csv",
+                                                             fanOnTemp=self.fanOnTemp, fanOffTemp=self.fanOffTemp)
+        self.fanOnTemp, self.fanOffTemp = self.thermalMonitor.fanOnTemp, self.thermalMonitor.fanOffTemp
+        self.ThermalStatusLabel = None
         self.fan = None
-        if self.fanControlFlag != 0:
-            self.fan = FanControl(self.DAHat.hat, chn=self.fanChn)
-            self.fan.on()
+        self.ConfigureFan()
+        self.thermalTimer = QTimer()
+        self.thermalTimer.timeout.connect(self.ThermalUpdate)
+        self.thermalTimer.start(self.thermalUpdateTimeMS)
+
+        if self.meterRecordFlag:
+            self.StartMeterRecorder()
+
+        self.motionQueue = motion_queue.MotionQueue(self)
+        self.motionQueue.commandStarted.connect(lambda index, description: self.UpdateADRate())
+        self.motionQueue.finished.connect(lambda success: self.UpdateADRate())
+        startupMark("hardware setup")
 
         self.createCentralWidget()
         self.setCentralWidget(self.centralFrame)
         self.setWindowTitle("Motor Control")
         self.createMenuBar()
+        startupMark("window construction")
+
+    def ConfigureFan(self):
+        #(re)creates the fan output; with temperature control the thermal monitor switches it
+        if self.fan != None:
+            self.fan.off()
+            self.fan = None
+        self.thermalMonitor.setFan(None)
+
+        if self.fanControlFlag != 0:
+            self.fan = self.FanClass(self.DAHat.hat, chn=self.fanChn)
+            if self.fanAutoFlag != 0:
+                self.thermalMonitor.setFan(self.fan)
+                self.ThermalUpdate()
+            else:
+                self.fan.on()
+
+    def ThermalUpdate(self):
+        sample = self.thermalMonitor.sample()
+
+        if self.ThermalStatusLabel != None:
+            text = "CPU: "
+            if sample["temp"] != None:
+                text += "%.1f °C" % sample["temp"]
+            if sample["freqMHz"] != None:
+                text += ", %d MHz" % sample["freqMHz"]
+            if sample["throttled"]:
+                text += " (throttled)"
+            text += "\nAD timer: max %.1f ms, %d late" % (sample["maxMS"], sample["late"])
+            text += "\nMeter: %d/%d values, %d/%d bars drawn" % (self.meterUpdates["applied"],
+                                                                 self.meterUpdates["applied"] + self.meterUpdates["skipped"],
+                                                                 self.meterUpdates["barsDrawn"],
+                                                                 self.meterUpdates["barsDrawn"] + self.meterUpdates["barsSkipped"])
+            self.ThermalStatusLabel.setText(text)
+
+    def StartMeterRecorder(self):
+        folder = self.homeFolder + "/meter_logs"
+        os.makedirs(folder, exist_ok=True)
+        path = folder + "/meter_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".mrec"
+        try:
+            self.meterRecorder = meter_recorder.MeterRecorder(path, self.ADHat.maxV, self.ADHat.maxADC)
+        except OSError as e:
+            print("Could not start the meter recording '" + path + "': " + str(e))
+            self.meterRecorder = None
+
+    def StopMeterRecorder(self):
+        if self.meterRecorder != None:
+            self.meterRecorder.close()
+            status = self.meterRecorder.status()
+            if status["dropped"] > 0:
+                print("Meter recording: " + str(status["dropped"]) + " samples dropped")
+            self.meterRecorder = None
+
+    def MeterRecordFunc(self):
+        self.meterRecordFlag = self.MeterRecordCheckBox.isChecked()
+        if self.meterRecordFlag and (self.meterRecorder == None):
+            self.StartMeterRecorder()
+        elif not self.meterRecordFlag:
+            self.StopMeterRecorder()
+        self.SaveSettings()
+
+    def StartBuzzer(self):
+        #the buzzer service sets up GPIO once and plays the sounds on its own thread
+        self.buzzer = None
+        try:
+            import buzzer
+        except ImportError:
+            #no GPIO (e.g. simulated hardware)
+            return
+        self.buzzer = buzzer.BuzzerService(buzzer="passive")
+        startupMark("buzzer")
+
+    def PlayApproachSound(self):
+        if self.buzzer != None:
+            self.buzzer.play(apprSound)
+
+    def OpenHardware(self):
+        #select and initialize the AD HAT (mcc118) and the DA HAT (mcc152)
+        if simHardware:
+            import sim_hardware
+
+            self.ADHat = sim_hardware.SimHatDevice("mcc118")
+            self.DAHat = sim_hardware.SimHatDevice("mcc152")
+            self.PWMClass = sim_hardware.SimHardwarePWM
+            self.FanClass = sim_hardware.SimFanControl
+            self.rawOption = sim_hardware.NOSCALEDATA
+            self.dioDirection = sim_hardware.DIO_DIRECTION
+        else:
+            from daqhats import OptionFlags, DIOConfigItem
+            from rpi_hardware_pwm import HardwarePWM
+            from hardware import hat_device, FanControl
+
+            self.ADHat = hat_device("mcc118")
+            self.ADHat.select_hat(0)
+            self.DAHat = hat_device("mcc152")
+            self.DAHat.select_hat(0)
+            self.PWMClass = HardwarePWM
+            self.FanClass = FanControl
+            self.rawOption = OptionFlags.NOSCALEDATA
+            self.dioDirection = DIOConfigItem.DIRECTION
+
+        startupMark("import/open hardware")
 
 
     def createCentralWidget(self):
@@ -279,19 +396,36 @@ class MainWindow(QtWidgets.QMainWindow):
         self.settingTab = QtWidgets.QWidget()
         self.advancedTab = QtWidgets.QWidget()
         self.forceTab = QtWidgets.QWidget()
+        self.historyTab = QtWidgets.QWidget()
+        self.forceMapTab = QtWidgets.QWidget()
         self.tabs.addTab(self.controlTab, "Control")
         self.tabs.addTab(self.settingTab, "Settings")
         self.tabs.addTab(self.advancedTab, "Advanced")
         self.tabs.addTab(self.forceTab, "Force Curve")
+        self.tabs.addTab(self.historyTab, "History")
+        self.tabs.addTab(self.forceMapTab, "Force Map")
 
         self.layout = QtWidgets.QVBoxLayout(self.centralFrame)
 
         self.layout.addWidget(self.tabs)
 
         self.ControlTab()
+        startupMark("control tab")
         self.SettingsTab()
-        self.AdvancedTab()
-        self.ForceTab()
+        startupMark("settings tab")
+
+        #The Advanced, Force Curve, History and Force Map tabs are built when they are opened for the first time
+        self.lazyTabs = {self.advancedTab: self.AdvancedTab, self.forceTab: self.ForceTab, self.historyTab: self.HistoryTab,
+                         self.forceMapTab: self.ForceMapTab}
+        self.tabs.currentChanged.connect(self.BuildLazyTab)
+        self.tabs.currentChanged.connect(self.UpdateADRate)
+        self.tabs.currentChanged.connect(self.HistoryTabChanged)
+
+    def BuildLazyTab(self, index):
+        tab = self.tabs.widget(index)
+        if tab in self.lazyTabs:
+            buildTab = self.lazyTabs.pop(tab)
+            buildTab()
 
     def ControlTab(self):
         layout = QtWidgets.QGridLayout(self.controlTab)
@@ -326,7 +460,16 @@ class MainWindow(QtWidgets.QMainWindow):
         self.zPiezoValue.setButtonSymbols(QtWidgets.QSpinBox.NoButtons)
         self.zPiezoValue.setRange(-10.0,10.0)
 
-        self.canvas = FigureCanvas(Figure(figsize=(5,1.8)))
+        #
+        #Meter (sum,deflection,z-position)
+        self.sumColor = "#880099"
+        self.defColor1 = "#004488"
+        self.defColor2 = "#4488AA"
+        self.ampColor = "#33AAAA"
+        self.zpiColor1 = "#880000"
+        self.zpiColor2 = "#AA4444"
+        self.meterWidget = meter_widget.BarMeterWidget(self.sumColor, (self.defColor1,self.defColor2), self.ampColor,
+                                                       (self.zpiColor1,self.zpiColor2), self.bg_color)
 
         layout.addWidget(self.sumLabel,0,0)
         layout.addWidget(self.sumValue,0,1)
@@ -339,74 +482,20 @@ class MainWindow(QtWidgets.QMainWindow):
 
         layout.addWidget(self.MeterStopButton,0,6,4,1)
 
-        layout.addWidget(self.canvas,0,2,4,4)
+        layout.addWidget(self.meterWidget,0,2,4,4)
 
         self.MeterStopButton.setMinimumHeight(170)
 
-        self.canvas.setMinimumHeight(180)
-        self.canvas.setMinimumWidth(500)
-        self.canvas.setMaximumWidth(500)
+        self.meterWidget.setMinimumHeight(180)
+        self.meterWidget.setMinimumWidth(500)
+        self.meterWidget.setMaximumWidth(500)
 
         self.MeterBox.setLayout(meterLayout)
 
-        self.axes = self.canvas.figure.subplots()
-        self.canvas.figure.set_layout_engine('constrained')
-        self.canvas.figure.set_facecolor(self.bg_color)
-        self.axes.set_xlim((-10.1,10.1))
-        self.axes.set_ylim((-0.55,3.55))
-        self.axes.axis('off')
-        #This is the background of the plot
-        bottom = -1
-        left = -10.1
-        width = 20
-        height = 4.5
-        self.BGPatch = self.axes.add_patch(matplotlib.patches.Rectangle((left,bottom),width,height,color="#DDDDDD"))
-        self.BGPatch.set_animated(False)
-
-        #Center Line
-        self.axes.plot([0,0],[-0.5,0.5],color='#000000',ls=':',animated = False)
-        self.axes.plot([0,0],[1.5,2.5],color='#000000',ls=':',animated = False)
-        #Sparators
-        self.axes.plot([-11,11],[0.5,0.5],color='#333333', animated = False)
-        self.axes.plot([-11,11],[1.49,1.49],color='#333333', animated = False)
-        self.axes.plot([-11,11],[2.49,2.49],color='#333333', animated = False)
-        #Box
-        self.axes.plot([-10.1,10.05,10.05,-10.1,-10.1],[-0.5,-0.5,3.5,3.5,-0.5],color='#333333',linewidth='2',animated = False)
-
-        self.canvas.draw()
-
-        self.FigBG = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
-
-        #
-        #Meter (sum,deflection,z-position)
-        self.sumColor = "#880099"
-        self.defColor1 = "#004488"
-        self.defColor2 = "#4488AA"
-        self.ampColor = "#33AAAA"
-        self.zpiColor1 = "#880000"
-        self.zpiColor2 = "#AA4444"
-        self.sumRect = matplotlib.patches.Rectangle((-10,2.65),10*0,0.7,color=self.sumColor)
-        self.defRect = matplotlib.patches.Rectangle((0,1.65),0,0.7,color=self.defColor1)
-        self.ampRect = matplotlib.patches.Rectangle((-10,0.65),10*0,0.7,color=self.ampColor)
-        self.zpiRect = matplotlib.patches.Rectangle((0,-0.35),0,0.7,color=self.zpiColor1)
-
-        self.sumPatch = self.axes.add_patch(self.sumRect)
-        self.defPatch = self.axes.add_patch(self.defRect)
-        self.ampPatch = self.axes.add_patch(self.ampRect)
-        self.zpiPatch = self.axes.add_patch(self.zpiRect)
-
-        self.sumPatch.set_animated(True)
-        self.defPatch.set_animated(True)
-        self.ampPatch.set_animated(True)
-        self.zpiPatch.set_animated(True)
-
-        self.axes.draw_artist(self.ampPatch)
-        self.canvas.blit(self.canvas.figure.bbox)
-
         #Meter update timer
         self.ReadADTimer = QTimer()
         self.ReadADTimer.timeout.connect(self.updateADTimer)
-        self.ReadADTimer.start(self.ADUpdateTimeMS)
+        self.ReadADTimer.start(self.currADIntervalMS)
 
         #Motor Control
         #
@@ -442,6 +531,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
         self.AutoApproachButton = QtWidgets.QPushButton("Auto\n Approach", clicked=self.AutoApproachButtonFunction)
+        self.StepApproachButton = QtWidgets.QPushButton("Step\n Approach", clicked=self.StepApproachButtonFunction)
 
         self.MotorPosLabel = QtWidgets.QLabel("Position:")
         self.MotorPosValue = QtWidgets.QLineEdit()
@@ -479,10 +569,12 @@ class MainWindow(QtWidgets.QMainWindow):
         motorLayout.addWidget(self.SlowLimitToggle,2,4,1,1)
 
         motorLayout.addWidget(self.AutoApproachButton,1,5,2,1)
+        motorLayout.addWidget(self.StepApproachButton,1,6,2,1)
 
         buttonHeight = 45
 
         self.AutoApproachButton.setMinimumHeight(2*buttonHeight)
+        self.StepApproachButton.setMinimumHeight(2*buttonHeight)
         self.MotorStopButton.setMinimumHeight(2*buttonHeight)
         self.MotorFasterButton.setMinimumHeight(buttonHeight)
         self.MotorSlowerButton.setMinimumHeight(buttonHeight)
@@ -494,6 +586,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.motorCountTimer = QTimer()
         self.motorCountTimer.timeout.connect(self.MotorCount)
 
+        #One-shot stop at the travel limit, calculated from the motion profile
+        self.limitStopTimer = QTimer()
+        self.limitStopTimer.setSingleShot(True)
+        self.limitStopTimer.setTimerType(Qt.PreciseTimer)
+        self.limitStopTimer.timeout.connect(self.TravelLimitStop)
+
+        #Step approach: one timer for the motor step, one for the settle time before measuring
+        self.stepTimer = QTimer()
+        self.stepTimer.setSingleShot(True)
+        self.stepTimer.setTimerType(Qt.PreciseTimer)
+        self.stepTimer.timeout.connect(self.StepApproachStepDone)
+        self.stepSettleTimer = QTimer()
+        self.stepSettleTimer.setSingleShot(True)
+        self.stepSettleTimer.timeout.connect(self.StepApproachMeasure)
+
         self.SlowLimitToggle.setStyleSheet("QCheckBox::indicator"
                                            "{"
                                            "width: 40px;"
@@ -519,6 +626,9 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.slowLimitState = 0
 
+        if self.motionProfile != None:
+            self.ArmTravelLimit()
+
         self.SaveSettings()
 
     def FastLimitCheckFunction(self):
@@ -527,6 +637,9 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.fastLimitState = 0
 
+        if self.motionProfile != None:
+            self.ArmTravelLimit()
+
         self.SaveSettings()
 
 
@@ -732,15 +845,13 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.zpiLimit = -10
         elif objectName == "SoundUpButton":
             apprSound += 1
-            worker = BuzzerWorker()
-            self.threadpool.start(worker)
+            self.PlayApproachSound()
         elif objectName == "SoundDownButton":
             apprSound -= 1
             if apprSound < 0:
                 apprSound = 0
 
-            worker = BuzzerWorker()
-            self.threadpool.start(worker)
+            self.PlayApproachSound()
 
         self.AutoApproachSpeedBox.setValue(self.autoApproachFreq)
         self.SlowSpeedBox.setValue(self.slowMoveFreq)
@@ -778,6 +889,25 @@ class MainWindow(QtWidgets.QMainWindow):
         self.miscBox.setLayout(miscLayout)
         layout.addWidget(self.miscBox,4,1,1,1)
 
+        sequenceLayout = QtWidgets.QGridLayout()
+        self.sequenceBox = QtWidgets.QGroupBox("Motor Sequence")
+        self.sequenceBox.setLayout(sequenceLayout)
+        layout.addWidget(self.sequenceBox,0,2,5,1)
+
+        self.SequenceEdit = QtWidgets.QPlainTextEdit()
+        self.SequenceEdit.setPlainText("retract 5000\nwait 1000\nautoapproach\nretract 200")
+        self.SequenceRunButton = QtWidgets.QPushButton("Run", clicked=self.SequenceRunFunction)
+        self.SequenceStopButton = QtWidgets.QPushButton("Stop", clicked=self.MotorStopButtonFunction)
+        self.SequenceStatusLabel = QtWidgets.QLabel("")
+
+        self.motionQueue.commandStarted.connect(self.SequenceCommandStarted)
+        self.motionQueue.finished.connect(self.SequenceFinished)
+
+        sequenceLayout.addWidget(self.SequenceEdit,0,0,1,2)
+        sequenceLayout.addWidget(self.SequenceRunButton,1,0)
+        sequenceLayout.addWidget(self.SequenceStopButton,1,1)
+        sequenceLayout.addWidget(self.SequenceStatusLabel,2,0,1,2)
+
         #Advanced Settings
         #self.motorSelectLabel = QtWidgets.QLabel("Output")
         #self.motorSelectBox = QtWidgets.QComboBox()
@@ -867,6 +997,61 @@ class MainWindow(QtWidgets.QMainWindow):
         self.TravelSlowBox.setValue(self.maxTravelSlow)
         self.TravelSlowBox.valueChanged.connect(self.DoAdvancedSettings)
 
+        self.StepSizeLabel = QtWidgets.QLabel("Step approach size")
+        self.StepSizeBox = QtWidgets.QSpinBox()
+        self.StepSizeBox.setRange(1,1000000)
+        self.StepSizeBox.setObjectName("StepSize")
+        self.StepSizeBox.setValue(self.stepApproachSize)
+        self.StepSizeBox.valueChanged.connect(self.DoAdvancedSettings)
+
+        self.StepMinSizeLabel = QtWidgets.QLabel("Step approach min. size")
+        self.StepMinSizeBox = QtWidgets.QSpinBox()
+        self.StepMinSizeBox.setRange(1,1000000)
+        self.StepMinSizeBox.setObjectName("StepMinSize")
+        self.StepMinSizeBox.setValue(self.stepApproachMinSize)
+        self.StepMinSizeBox.valueChanged.connect(self.DoAdvancedSettings)
+
+        self.StepSettleLabel = QtWidgets.QLabel("Step settle time")
+        self.StepSettleBox = QtWidgets.QSpinBox()
+        self.StepSettleBox.setRange(0,10000)
+        self.StepSettleBox.setObjectName("StepSettle")
+        self.StepSettleBox.setValue(self.stepSettleTimeMS)
+        self.StepSettleBox.valueChanged.connect(self.DoAdvancedSettings)
+        self.StepSettleBox.setSuffix(" ms")
+
+        self.StepAverageLabel = QtWidgets.QLabel("Step averaging")
+        self.StepAverageBox = QtWidgets.QSpinBox()
+        self.StepAverageBox.setRange(1,1000)
+        self.StepAverageBox.setObjectName("StepAverage")
+        self.StepAverageBox.setValue(self.stepAverageN)
+        self.StepAverageBox.valueChanged.connect(self.DoAdvancedSettings)
+
+        self.TriggerFilterLabel = QtWidgets.QLabel("Trigger filter")
+        self.TriggerFilterBox = QtWidgets.QComboBox()
+        self.TriggerFilterBox.addItem("None")
+        self.TriggerFilterBox.addItem("Moving average")
+        self.TriggerFilterBox.addItem("Median")
+        self.TriggerFilterBox.addItem("Exponential")
+        self.TriggerFilterBox.setCurrentIndex(self.triggerFilterType)
+        self.TriggerFilterBox.setObjectName("TriggerFilter")
+        self.TriggerFilterBox.currentIndexChanged.connect(self.DoAdvancedSettings)
+
+        self.FilterWindowLabel = QtWidgets.QLabel("Filter window")
+        self.FilterWindowBox = QtWidgets.QSpinBox()
+        self.FilterWindowBox.setRange(1,1000)
+        self.FilterWindowBox.setObjectName("FilterWindow")
+        self.FilterWindowBox.setValue(self.triggerFilterWindow)
+        self.FilterWindowBox.valueChanged.connect(self.DoAdvancedSettings)
+        self.FilterWindowBox.setSuffix(" samples")
+
+        self.BaselineWindowLabel = QtWidgets.QLabel("Amplitude baseline")
+        self.BaselineWindowBox = QtWidgets.QSpinBox()
+        self.BaselineWindowBox.setRange(1,10000)
+        self.BaselineWindowBox.setObjectName("BaselineWindow")
+        self.BaselineWindowBox.setValue(self.baselineWindow)
+        self.BaselineWindowBox.valueChanged.connect(self.DoAdvancedSettings)
+        self.BaselineWindowBox.setSuffix(" samples")
+
         self.ADReadIntervalLabel = QtWidgets.QLabel("AD update interval")
         self.ADReadIntervalBox = QtWidgets.QSpinBox()
         self.ADReadIntervalBox.setRange(1,100)
@@ -911,6 +1096,30 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.FanControlChnBox.setCurrentIndex(0)
 
+        self.FanAutoCheckBox = QtWidgets.QCheckBox("Temperature Controlled")
+        self.FanAutoCheckBox.setCheckState(self.fanAutoFlag)
+        self.FanAutoCheckBox.setObjectName("FanAuto")
+        self.FanAutoCheckBox.stateChanged.connect(self.DoAdvancedSettings)
+        self.FanOnTempLabel = QtWidgets.QLabel("On")
+        self.FanOnTempBox = QtWidgets.QDoubleSpinBox()
+        self.FanOnTempBox.setRange(30,85)
+        self.FanOnTempBox.setDecimals(1)
+        self.FanOnTempBox.setValue(self.fanOnTemp)
+        self.FanOnTempBox.setSuffix(" °C")
+        self.FanOnTempBox.setObjectName("FanOnTemp")
+        self.FanOnTempBox.valueChanged.connect(self.DoAdvancedSettings)
+        self.FanOffTempLabel = QtWidgets.QLabel("Off")
+        self.FanOffTempBox = QtWidgets.QDoubleSpinBox()
+        self.FanOffTempBox.setRange(30,85)
+        self.FanOffTempBox.setDecimals(1)
+        self.FanOffTempBox.setValue(self.fanOffTemp)
+        self.FanOffTempBox.setSuffix(" °C")
+        self.FanOffTempBox.setObjectName("FanOffTemp")
+        self.FanOffTempBox.valueChanged.connect(self.DoAdvancedSettings)
+        self.FanOnTempBox.setMinimum(self.fanOffTemp + thermal_monitor.FAN_HYSTERESIS)
+        self.FanOffTempBox.setMaximum(self.fanOnTemp - thermal_monitor.FAN_HYSTERESIS)
+        self.ThermalStatusLabel = QtWidgets.QLabel("CPU: -")
+
 
 
         #channelLayout.addWidget(self.motorSelectLabel,1,1)
@@ -939,25 +1148,47 @@ class MainWindow(QtWidgets.QMainWindow):
         advMotorLayout.addWidget(self.TravelFastBox,2,2)
         advMotorLayout.addWidget(self.TravelSlowLabel,3,1)
         advMotorLayout.addWidget(self.TravelSlowBox,3,2)
+        advMotorLayout.addWidget(self.StepSizeLabel,4,1)
+        advMotorLayout.addWidget(self.StepSizeBox,4,2)
+        advMotorLayout.addWidget(self.StepMinSizeLabel,5,1)
+        advMotorLayout.addWidget(self.StepMinSizeBox,5,2)
+        advMotorLayout.addWidget(self.StepSettleLabel,6,1)
+        advMotorLayout.addWidget(self.StepSettleBox,6,2)
+        advMotorLayout.addWidget(self.StepAverageLabel,7,1)
+        advMotorLayout.addWidget(self.StepAverageBox,7,2)
 
         advMeterLayout.addWidget(self.ADReadIntervalLabel,1,1)
         advMeterLayout.addWidget(self.ADReadIntervalBox,1,2)
         advMeterLayout.addWidget(self.GraphUpdateIntervalLabel,2,1)
         advMeterLayout.addWidget(self.GraphUpdateIntervalBox,2,2)
+        advMeterLayout.addWidget(self.TriggerFilterLabel,3,1)
+        advMeterLayout.addWidget(self.TriggerFilterBox,3,2)
+        advMeterLayout.addWidget(self.FilterWindowLabel,4,1)
+        advMeterLayout.addWidget(self.FilterWindowBox,4,2)
+        advMeterLayout.addWidget(self.BaselineWindowLabel,5,1)
+        advMeterLayout.addWidget(self.BaselineWindowBox,5,2)
 
         miscLayout.addWidget(self.FanControlCheckBox,0,0,1,2)
         miscLayout.addWidget(self.FanControlChnLabel,0,2)
         miscLayout.addWidget(self.FanControlChnBox,0,3)
+        miscLayout.addWidget(self.FanAutoCheckBox,1,0,1,4)
+        miscLayout.addWidget(self.FanOnTempLabel,2,0)
+        miscLayout.addWidget(self.FanOnTempBox,2,1)
+        miscLayout.addWidget(self.FanOffTempLabel,2,2)
+        miscLayout.addWidget(self.FanOffTempBox,2,3)
+        miscLayout.addWidget(self.ThermalStatusLabel,3,0,1,4)
 
         self.ChangeMotorModeUI(self.outputMode)
 
     def DoAdvancedSettings(self):
         objectName = self.sender().objectName()
 
-        if objectName == "FanControl":
+        if objectName in ("FanControl","FanAuto"):
             value = self.sender().checkState()
         elif objectName == "FanControlChn":
             pass
+        elif objectName == "TriggerFilter":
+            value = self.sender().currentIndex()
         else:
             value = self.sender().value()
 
@@ -966,12 +1197,12 @@ class MainWindow(QtWidgets.QMainWindow):
             self.directionChn = value
         elif objectName == "ApproachChn":
             self.approachChn = value
-            self.pwm_ccw = HardwarePWM(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
-            self.pwm_cw = HardwarePWM(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
+            self.pwm_ccw = self.PWMClass(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
+            self.pwm_cw = self.PWMClass(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
         elif objectName == "RetractChn":
             self.retractChn = value
-            self.pwm_ccw = HardwarePWM(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
-            self.pwm_cw = HardwarePWM(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
+            self.pwm_ccw = self.PWMClass(pwm_channel=self.approachChn, hz=self.slowMoveFreq, chip=self.chip)
+            self.pwm_cw = self.PWMClass(pwm_channel=self.retractChn, hz=self.slowMoveFreq, chip=self.chip)
         elif objectName == "SumChn":
             self.sumChn = value
         elif objectName == "DefChn":
@@ -988,17 +1219,38 @@ class MainWindow(QtWidgets.QMainWindow):
             self.maxTravelFast = value
         elif objectName == "maxTravSlow":
             self.maxTravelSlow = value
+        elif objectName == "StepSize":
+            self.stepApproachSize = value
+        elif objectName == "StepMinSize":
+            self.stepApproachMinSize = value
+        elif objectName == "StepSettle":
+            self.stepSettleTimeMS = value
+        elif objectName == "StepAverage":
+            self.stepAverageN = value
+        elif objectName == "TriggerFilter":
+            self.triggerFilterType = value
+            self.triggerFilter = signal_filter.ApproachSignalFilter(self.triggerFilterType, self.triggerFilterWindow, self.baselineWindow)
+        elif objectName == "FilterWindow":
+            self.triggerFilterWindow = value
+            self.triggerFilter = signal_filter.ApproachSignalFilter(self.triggerFilterType, self.triggerFilterWindow, self.baselineWindow)
+        elif objectName == "BaselineWindow":
+            self.baselineWindow = value
+            self.triggerFilter = signal_filter.ApproachSignalFilter(self.triggerFilterType, self.triggerFilterWindow, self.baselineWindow)
         elif objectName == "ADInterval":
             self.ADUpdateTimeMS = value
+            self.UpdateADRate()
         elif objectName == "GraphInterval":
             self.graphUpdateTimeMS = value
         elif objectName == "FanControl":
             self.fanControlFlag = value
-            if self.fanControlFlag != 0:
-                self.fan = FanControl(self.DAHat.hat, chn=self.fanChn)
-                self.fan.on()
-            else:
-                self.fan.off()
+            self.ConfigureFan()
+        elif objectName == "FanAuto":
+            self.fanAutoFlag = value
+            self.ConfigureFan()
+        elif objectName in ("FanOnTemp", "FanOffTemp"):
+            self.fanOnTemp, self.fanOffTemp = self.thermalMonitor.setFanTemps(self.FanOnTempBox.value(),self.FanOffTempBox.value())
+            self.FanOnTempBox.setMinimum(self.fanOffTemp + thermal_monitor.FAN_HYSTERESIS)
+            self.FanOffTempBox.setMaximum(self.fanOnTemp - thermal_monitor.FAN_HYSTERESIS)
         elif objectName == "FanControlChn":
             text = self.sender().currentText()
             if "DIO7" in text:
@@ -1012,22 +1264,32 @@ class MainWindow(QtWidgets.QMainWindow):
             elif "GPIO27" in text:
                 self.fanChn = 27
 
+            self.ConfigureFan()
 
-            if self.fan != None:
-                self.fan.off()
 
-            self.fan = FanControl(self.DAHat.hat, chn=self.fanChn)
-            if self.fanControlFlag != 0:
-                self.fan.on()
-            else:
-                self.fan.off()
-            pass
 
+        self.SaveSettings()
 
 
-        self.SaveSettings()
 
+    def SequenceRunFunction(self):
+        try:
+            commands = motion_queue.parseSequence(self.SequenceEdit.toPlainText())
+        except ValueError as e:
+            self.SequenceStatusLabel.setText(str(e))
+            return
+
+        if not self.motionQueue.run(commands):
+            self.SequenceStatusLabel.setText("Motor is busy!")
+
+    def SequenceCommandStarted(self, index, description):
+        self.SequenceStatusLabel.setText(str(index+1) + "/" + str(len(self.motionQueue.commands)) + ": " + description)
 
+    def SequenceFinished(self, ok):
+        if ok:
+            self.SequenceStatusLabel.setText("Finished")
+        else:
+            self.SequenceStatusLabel.setText("Aborted")
 
     def OutputSelectFunction(self, index):
         self.outputMode = index
@@ -1061,11 +1323,71 @@ class MainWindow(QtWidgets.QMainWindow):
         self.settingsMenuEntry = QtWidgets.QAction("&Settings", self)
 
 
+    def HistoryTab(self):
+        layout = QtWidgets.QGridLayout(self.historyTab)
+
+        #same ranges as the meter bars
+        self.historyChart = meter_widget.StripChartWidget(["Sum","Deflection","Amplitude","z-Piezo"],
+                                                          [self.sumColor, self.defColor1, self.ampColor, self.zpiColor1],
+                                                          [(0,2), (-10,10), (0,2), (-5,5)])
+
+        self.HistorySpanLabel = QtWidgets.QLabel("Time Span")
+        self.HistorySpanBox = QtWidgets.QComboBox()
+        self.historySpans = [10, 30, 60, 300, 600]
+        for span in self.historySpans:
+            if span < 60:
+                self.HistorySpanBox.addItem(str(span) + " s")
+            else:
+                self.HistorySpanBox.addItem(str(span//60) + " min")
+        if self.historySpanS in self.historySpans:
+            self.HistorySpanBox.setCurrentIndex(self.historySpans.index(self.historySpanS))
+        self.HistorySpanBox.currentIndexChanged.connect(self.HistorySpanFunction)
+
+        self.HistoryClearButton = QtWidgets.QPushButton("Clear", clicked=self.history.clear)
+
+        self.MeterRecordCheckBox = QtWidgets.QCheckBox("Record to disk")
+        self.MeterRecordCheckBox.setChecked(self.meterRecordFlag)
+        self.MeterRecordCheckBox.stateChanged.connect(self.MeterRecordFunc)
+
+        layout.addWidget(self.historyChart,0,0,1,4)
+        layout.addWidget(self.HistorySpanLabel,1,0)
+        layout.addWidget(self.HistorySpanBox,1,1)
+        layout.addWidget(self.MeterRecordCheckBox,1,2)
+        layout.addWidget(self.HistoryClearButton,1,3)
+        layout.setColumnStretch(2,1)
+
+        self.historyTimer = QTimer()
+        self.historyTimer.timeout.connect(self.UpdateHistoryChart)
+
+    def HistorySpanFunction(self, index):
+        self.historySpanS = self.historySpans[index]
+        self.UpdateHistoryChart()
+        self.SaveSettings()
+
+    def HistoryTabChanged(self, index):
+        if self.tabs.widget(index) == self.historyTab:
+            self.historyTimer.start(self.graphUpdateTimeMS)
+            self.UpdateHistoryChart()
+        elif self.historyTab not in self.lazyTabs:
+            self.historyTimer.stop()
+
+    def UpdateHistoryChart(self):
+        #the samples of updateADTimer, min/max decimated to one column per pixel
+        t1 = time.monotonic()
+        t0 = t1 - self.historySpanS
+        t, data = self.history.since(t0)
+        mins, maxs, valid = history.minMaxDecimate(t, data, t0, t1, self.historyChart.columns())
+        self.historyChart.setData(mins, maxs, valid, "last " + self.HistorySpanBox.currentText())
+
     def ForceTab(self):
+        LoadMatplotlib()
         layout = QtWidgets.QGridLayout(self.forceTab)
 
 
         self.phi = 0
+        self.forceShownShift = 0
+        self.forceDecimator = force_curve.ForceCurveDecimator()
+        self.phaseCache = None
         self.InvUpX = np.array([0,200])
         self.InvUpY = np.array([1,1])
         self.InvDoX = np.array([0,200])
@@ -1095,6 +1417,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.PhaseUpButton = QtWidgets.QPushButton("↑", clicked=self.PhaseUpFunc)
         self.PhaseUpButton.setMinimumHeight(40)
 
+        self.AutoPhaseButton = QtWidgets.QPushButton("Auto phase", clicked=self.AutoPhaseFunc)
+        self.AutoPhaseButton.setMinimumHeight(40)
+
+        self.AutoPhaseCheckBox = QtWidgets.QCheckBox("every curve")
+        self.AutoPhaseCheckBox.setChecked(self.autoPhaseFlag)
+        self.AutoPhaseCheckBox.stateChanged.connect(self.AutoPhaseCheckFunc)
+
         self.forceCanvas = FigureCanvas(Figure(figsize=(2,4)))
         self.forceAxes = self.forceCanvas.figure.subplots()
         self.forceCanvas.figure.set_layout_engine('tight')
@@ -1135,6 +1464,32 @@ class MainWindow(QtWidgets.QMainWindow):
         self.piezoConstValue.setValue(self.piezoConst)
         self.piezoConstValue.valueChanged.connect(self.DoForceSettings)
 
+        self.forceHoldLabel = QtWidgets.QLabel("Hold points:")
+        self.forceHoldValue = QtWidgets.QSpinBox()
+        self.forceHoldValue.setMaximum(100000)
+        self.forceHoldValue.setValue(self.forceHoldPoints)
+        self.forceHoldValue.valueChanged.connect(self.DoForceSettings)
+
+        self.forceSweepLabel = QtWidgets.QLabel("Sweep:")
+        self.forceSweepValue = QtWidgets.QComboBox()
+        self.forceSweepValue.addItems(waveforms.SWEEPS)
+        if self.forceSweep in waveforms.SWEEPS:
+            self.forceSweepValue.setCurrentIndex(waveforms.SWEEPS.index(self.forceSweep))
+        self.forceSweepValue.currentIndexChanged.connect(self.DoForceSettings)
+
+        self.forceOversampleLabel = QtWidgets.QLabel("Oversample:")
+        self.forceOversampleValue = QtWidgets.QSpinBox()
+        self.forceOversampleValue.setMinimum(1)
+        self.forceOversampleValue.setMaximum(1000)
+        self.forceOversampleValue.setValue(self.forceOversample)
+        self.forceOversampleValue.valueChanged.connect(self.DoForceSettings)
+
+        self.forceReductionValue = QtWidgets.QComboBox()
+        self.forceReductionValue.addItems(force_curve.REDUCTIONS)
+        if self.forceReduction in force_curve.REDUCTIONS:
+            self.forceReductionValue.setCurrentIndex(force_curve.REDUCTIONS.index(self.forceReduction))
+        self.forceReductionValue.currentIndexChanged.connect(self.DoForceSettings)
+
         self.gainLabel = QtWidgets.QLabel("Gain:")
         self.gainValue = QtWidgets.QComboBox()
         self.gainValue.insertItem(0,"1")
@@ -1193,6 +1548,59 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ManInvCalcBut = QtWidgets.QPushButton("Calculate InvOLS", clicked=self.CalcManInvOLS)
 
+        #batch calibration: N new curves or a set of saved curves
+        self.BatchInvOLSLabel = QtWidgets.QLabel("Batch curves:")
+        self.BatchInvOLSNBox = QtWidgets.QSpinBox()
+        self.BatchInvOLSNBox.setMinimum(3)
+        self.BatchInvOLSNBox.setMaximum(500)
+        self.BatchInvOLSNBox.setValue(self.invOLSBatchN)
+        self.BatchInvOLSNBox.valueChanged.connect(self.BatchInvOLSNFunc)
+
+        self.BatchInvOLSButton = QtWidgets.QPushButton("Batch InvOLS", clicked=self.BatchInvOLSAcquire)
+        self.BatchInvOLSButton.setMinimumHeight(40)
+
+        self.BatchInvOLSLoadButton = QtWidgets.QPushButton("From files...", clicked=self.BatchInvOLSLoad)
+        self.BatchInvOLSLoadButton.setMinimumHeight(40)
+
+        self.BatchInvOLSResult = QtWidgets.QLabel("")
+
+        #one curve per timer tick, so the GUI stays responsive and the batch can be stopped
+        self.BatchInvOLSTimer = QTimer()
+        self.BatchInvOLSTimer.timeout.connect(self.BatchInvOLSStep)
+        self.batchCurves = []
+
+        #contact mechanics fit of the current curve (contact_models.py)
+        self.springConstLabel = QtWidgets.QLabel("Spring const.:")
+        self.springConstValue = QtWidgets.QDoubleSpinBox()
+        self.springConstValue.setSuffix(" N/m")
+        self.springConstValue.setDecimals(3)
+        self.springConstValue.setRange(0.001,100)   #0 would divide by zero in the fit overlay
+        self.springConstValue.setSingleStep(0.01)
+        self.springConstValue.setValue(self.springConst)
+        self.springConst = self.springConstValue.value()
+        self.springConstValue.valueChanged.connect(self.ContactSettingsFunc)
+
+        self.tipRadiusLabel = QtWidgets.QLabel("Tip radius:")
+        self.tipRadiusValue = QtWidgets.QDoubleSpinBox()
+        self.tipRadiusValue.setSuffix(" nm")
+        self.tipRadiusValue.setMinimum(0.1)
+        self.tipRadiusValue.setMaximum(10000)
+        self.tipRadiusValue.setValue(self.tipRadius)
+        self.tipRadiusValue.valueChanged.connect(self.ContactSettingsFunc)
+
+        self.ContactModelBox = QtWidgets.QComboBox()
+        self.ContactModelBox.addItems(contact_models.MODELS)
+        if self.contactModel in contact_models.MODELS:
+            self.ContactModelBox.setCurrentIndex(contact_models.MODELS.index(self.contactModel))
+        self.ContactModelBox.currentIndexChanged.connect(self.ContactSettingsFunc)
+
+        self.ContactFitButton = QtWidgets.QPushButton("Fit model", clicked=self.ContactFitFunc)
+        self.ContactFitButton.setMinimumHeight(40)
+
+        self.ContactFitResult = QtWidgets.QLabel("")
+        self.ZeroStatus = QtWidgets.QLabel("")
+        self.contactFitLine = None
+
         self.EnManInvCont(False)
 
         layout.addWidget(self.forceCanvas,0,0,7,3)
@@ -1216,6 +1624,9 @@ class MainWindow(QtWidgets.QMainWindow):
         layout.addWidget(self.PhaseLabel,5,3)
         layout.addWidget(self.PhaseValue,5,4)
 
+        layout.addWidget(self.AutoPhaseButton,4,5)
+        layout.addWidget(self.AutoPhaseCheckBox,4,6)
+
         layout.addWidget(self.PhaseDownButton,5,5)
         layout.addWidget(self.PhaseUpButton,5,6)
 
@@ -1226,6 +1637,31 @@ class MainWindow(QtWidgets.QMainWindow):
         layout.addWidget(self.DoForceButton,7,5,1,2)
         layout.addWidget(self.DoContForceButton,7,3,1,2)
 
+        layout.addWidget(self.BatchInvOLSLabel,8,3)
+        layout.addWidget(self.BatchInvOLSNBox,8,4)
+        layout.addWidget(self.BatchInvOLSButton,8,5)
+        layout.addWidget(self.BatchInvOLSLoadButton,8,6)
+        layout.addWidget(self.BatchInvOLSResult,9,3,1,4)
+
+        layout.addWidget(self.springConstLabel,10,3)
+        layout.addWidget(self.springConstValue,10,4)
+        layout.addWidget(self.tipRadiusLabel,10,5)
+        layout.addWidget(self.tipRadiusValue,10,6)
+
+        layout.addWidget(self.ContactModelBox,11,3)
+        layout.addWidget(self.ContactFitButton,11,4)
+        layout.addWidget(self.ContactFitResult,11,5,1,2)
+
+        layout.addWidget(self.forceHoldLabel,12,3)
+        layout.addWidget(self.forceHoldValue,12,4)
+        layout.addWidget(self.forceSweepLabel,12,5)
+        layout.addWidget(self.forceSweepValue,12,6)
+
+        layout.addWidget(self.forceOversampleLabel,13,3)
+        layout.addWidget(self.forceOversampleValue,13,4)
+        layout.addWidget(self.forceReductionValue,13,5)
+        layout.addWidget(self.ZeroStatus,14,3,1,4)
+
         layout.addWidget(self.InvOLSBox,0,5,4,2)
         #InvOLS Box START
         iBoxLayout.addWidget(self.ManInvOLSBox,0,0,1,3)
@@ -1294,14 +1730,27 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
+    def ForceCurveChanged(self):
+        #the curve data (ForceDistMApp2 etc.) was replaced by an unshifted curve
+        self.forceShownShift = 0
+        self.forceDecimator.invalidate()
+        self.phaseCache = None
+
     def DrawForceCurve(self):
+        #long curves are plotted as min/max envelope with two points per pixel column
+        nBins = max(int(self.forceAxes.bbox.width), 100)
+        distApp, deflApp, distRet, deflRet = self.forceDecimator.get(self.forceShownShift, nBins,
+                                                                     self.ForceDistMApp2, self.ForceDeflDataApp2,
+                                                                     self.ForceDistMRet2, self.ForceDeflDataRet2)
+
         self.forceAxes.cla()
-        self.forceLine, = self.forceAxes.plot(self.ForceDistMApp2,self.ForceDeflDataApp2,self.colorA)
-        self.forceLine, = self.forceAxes.plot(self.ForceDistMRet2,self.ForceDeflDataRet2,self.colorR)
+        self.forceLine, = self.forceAxes.plot(distApp,deflApp,self.colorA)
+        self.forceLine, = self.forceAxes.plot(distRet,deflRet,self.colorR)
         if (self.ManInvOLSBox.isChecked()):
             self.forceLine, = self.forceAxes.plot(self.InvUpX,self.InvUpY,self.colorBlack,linestyle='dashed')
             self.forceLine, = self.forceAxes.plot(self.InvDoX,self.InvDoY,self.colorBlack,linestyle='dotted')
-        self.forceCanvas.draw()
+        #rendered once the event queue is empty, fast phase/InvOLS clicks result in one redraw
+        self.forceCanvas.draw_idle()
 
 
     def PhaseDownFunc(self):
@@ -1315,56 +1764,43 @@ class MainWindow(QtWidgets.QMainWindow):
         self.PhaseValue.setValue(value)
 
 
-    def DoPhaseShift(self):
-        self.phaseShift = self.PhaseValue.value()
-
-        phi = int(self.phaseShift)
-
-
-
-        N1 = len(self.ForceDistMApp)
-        N2 = len(self.ForceDistMRet)
+    def AutoPhaseFunc(self):
+        #phase shift from the symmetry of the repulsive contact in the approach/retract sweep
+        #(force_analysis.estimatePhaseShift)
+        if not hasattr(self, "ForceDistMApp"):
+            return
 
-        fullDist = np.concatenate((self.ForceDistMApp,self.ForceDistMRet))
-        fullDefl = np.concatenate((self.ForceDeflDataApp,self.ForceDeflDataRet))
+        if self.phaseCache == None:
+            self.phaseCache = force_analysis.PhaseShiftCache(self.ForceDistMApp, self.ForceDeflDataApp,
+                                                             self.ForceDistMRet, self.ForceDeflDataRet)
 
-        if (self.phaseShift >= 0):
-            shiftDist = fullDist[2*phi:N1+N2]
-            shiftDefl = fullDefl[0:N1+N2-2*phi]
+        phi = self.phaseCache.estimatedShift(self.PhaseValue.maximum())
+        phi = min(max(phi, self.PhaseValue.minimum()), self.PhaseValue.maximum())
 
-            newN = int(len(shiftDist)/2)
-
-            self.ForceDistMApp2 = fullDist[0:newN-phi]
-            self.ForceDeflDataApp2 = fullDefl[phi:newN]
-            self.ForceDistMRet2 = fullDist[newN-phi:2*newN-2*phi]
-            self.ForceDeflDataRet2 = fullDefl[newN:2*newN-phi]
+        #valueChanged is not emitted for the same value, but a new curve is still shown unshifted
+        if phi == self.PhaseValue.value():
+            self.DoPhaseShift()
         else:
-            shiftDist = fullDist[0:N1+N2+2*phi]
-            shiftDefl = fullDefl[-2*phi:N1+N2]
-
-            newN = int(len(shiftDist)/2)
+            self.PhaseValue.setValue(phi)
 
-            self.ForceDistMApp2 = fullDist[-phi:newN]
-            self.ForceDeflDataApp2 = fullDefl[0:newN+phi]
-            self.ForceDistMRet2 = fullDist[newN:2*newN+phi]
-            self.ForceDeflDataRet2 = fullDefl[newN+phi:2*newN+2*phi]
+    def AutoPhaseCheckFunc(self):
+        self.autoPhaseFlag = self.AutoPhaseCheckBox.isChecked()
+        self.SaveSettings()
 
-        self.phi = phi
+    def DoPhaseShift(self):
+        self.phaseShift = self.PhaseValue.value()
 
+        phi = int(self.phaseShift)
 
-        #if (self.phaseShift >= 0):
-        #    self.ForceDistMApp2 = self.ForceDistMApp[phi:N1]
-        #    self.ForceDeflDataApp2 = np.concatenate((self.ForceDeflDataApp[phi:N1-phi],self.ForceDeflDataRet[0:phi]))
-        #
-        #    self.ForceDistMRet2 = self.ForceDistMRet[phi:N2]
-        #    self.ForceDeflDataRet2 = np.concatenate((self.ForceDeflDataApp[N1-phi:N1],self.ForceDeflDataRet[phi:N2-self.phaseShift]))
-        #else:
-        #    self.ForceDistMApp2 = self.ForceDistMApp[0:N1+self.phaseShift]
-        #    self.ForceDeflDataApp2 = self.ForceDeflDataApp[-self.phaseShift:N1]
+        #the combined approach/retract buffer is built once per curve, every offset is a view into it
+        if self.phaseCache == None:
+            self.phaseCache = force_analysis.PhaseShiftCache(self.ForceDistMApp, self.ForceDeflDataApp,
+                                                             self.ForceDistMRet, self.ForceDeflDataRet)
 
-        #    self.ForceDistMRet2 = self.ForceDistMRet[0:N2+self.phaseShift]
-        #    self.ForceDeflDataRet2 = self.ForceDeflDataRet[-self.phaseShift:N2]
+        self.ForceDistMApp2, self.ForceDeflDataApp2, self.ForceDistMRet2, self.ForceDeflDataRet2 = self.phaseCache.views(phi)
 
+        self.phi = phi
+        self.forceShownShift = phi
 
         self.DrawForceCurve()
 
@@ -1405,22 +1841,22 @@ class MainWindow(QtWidgets.QMainWindow):
     def DoZeroEstimate(self):
         N = len(self.ForceDistMRet)
 
-        fit_start = self.FindPlateauEnd(self.ForceDeflDataRet)
-
-        x1 = np.array(self.ForceDistMRet[int(0.9*N):N-1])
-        y1 = np.array(self.ForceDeflDataRet[int(0.9*N):N-1])
-        x2 = np.array(self.ForceDistMRet[fit_start:int(fit_start + 0.1*N)])
-        y2 = np.array(self.ForceDeflDataRet[fit_start:int(fit_start + 0.1*N)])
+        #contact line and baseline of the retract trace (two segment change-point fit)
+        x0, _, self.zeroConfidence = force_analysis.contactPoints(self.ForceDistMRet, self.ForceDeflDataRet)
 
-        C1,_ = self.DoPolyFit(x1,y1,1)
-        C2,_ = self.DoPolyFit(x2,y2,1)
-
-        self.x0 = (C2[1] - C1[1])/(C1[0] - C2[0])
         try:
-            self.N0 = int(N*(self.x0 - self.ForceDistMRet[0])/(self.ForceDistMRet[N-1] - self.ForceDistMRet[0]))
+            self.N0 = int(N*(x0 - self.ForceDistMRet[0])/(self.ForceDistMRet[N-1] - self.ForceDistMRet[0]))
         except:
             self.N0 = 0
 
+        #without a clear contact the x0 of the fit is meaningless, the curve is not shifted
+        if self.zeroConfidence < 0.5:
+            self.x0 = 0.0
+            self.ZeroStatus.setText("No clear contact (confidence {c:.2f}), distance not zeroed".format(c = self.zeroConfidence))
+        else:
+            self.x0 = x0
+            self.ZeroStatus.setText("Contact at {x0:.1f} nm (confidence {c:.2f})".format(x0 = x0, c = self.zeroConfidence))
+
         self.ForceDistMRet -= self.x0
         self.ForceDistMApp -= self.x0
 
@@ -1429,24 +1865,148 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ForceDistMRet2 = self.ForceDistMRet
         self.ForceDeflDataRet2 = self.ForceDeflDataRet
+        self.ForceCurveChanged()
 
         self.DrawForceCurve()
 
 
     def AutoInvOLSFunc(self):
-        fit_start = self.FindPlateauEnd(self.ForceDeflDataRet,th=-0.03)
+        def fit():
+            fit_start = self.FindPlateauEnd(self.ForceDeflDataRet,th=-0.03)
 
-        N_fit = int(0.95*self.N0 + self.phi)
-        x = np.array(self.ForceDistMRet2[fit_start:N_fit])
-        y = np.array(self.ForceDeflDataRet2[fit_start:N_fit])
+            N_fit = int(0.95*self.N0 + self.phi)
+            x = np.array(self.ForceDistMRet2[fit_start:N_fit])
+            y = np.array(self.ForceDeflDataRet2[fit_start:N_fit])
 
-        C,y_fit = self.DoPolyFit(x,y,1)
-        self.InvOLS = -1/C[0,0]
+            C,y_fit = self.DoPolyFit(x,y,1)
+            return x, y_fit, -1/C[0,0]
+
+        #the fit only depends on the curve and the phase offset
+        if (self.phaseCache != None) and (self.forceShownShift == self.phi):
+            x, y_fit, self.InvOLS = self.phaseCache.memo(self.phi, "autoInvOLS", fit)
+        else:
+            x, y_fit, self.InvOLS = fit()
         self.forceLine, = self.forceAxes.plot(x,y_fit,'k')
         self.forceCanvas.draw()
         self.InvOLSValue.setText("{InvOLS:.1f} nm/V".format(InvOLS = self.InvOLS))
 
 
+    def BatchInvOLSNFunc(self):
+        self.invOLSBatchN = self.BatchInvOLSNBox.value()
+        self.SaveSettings()
+
+    def BatchInvOLSAcquire(self):
+        #every curve is acquired, saved and shown as with "Do Force Curve"; a second click stops
+        #the batch and evaluates the curves acquired so far
+        if self.BatchInvOLSTimer.isActive():
+            self.StopBatchInvOLS()
+            return
+
+        self.batchCurves = []
+        self.ReadADTimer.stop()
+        self.DoForceButton.setEnabled(0)
+        self.DoContForceButton.setEnabled(0)
+        self.BatchInvOLSLoadButton.setEnabled(0)
+        self.BatchInvOLSNBox.setEnabled(0)
+        self.BatchInvOLSButton.setText("Stop!")
+        self.BatchInvOLSTimer.start()
+
+    def BatchInvOLSStep(self):
+        if not self.DoForceCurve():
+            self.StopBatchInvOLS()
+            return
+        self.batchCurves.append((self.ForceDistMApp.copy(), self.ForceDeflDataApp.copy(),
+                                 self.ForceDistMRet.copy(), self.ForceDeflDataRet.copy()))
+        self.BatchInvOLSResult.setText("curve {n} of {total}".format(n = len(self.batchCurves), total = self.invOLSBatchN))
+
+        if len(self.batchCurves) >= self.invOLSBatchN:
+            self.StopBatchInvOLS()
+
+    def StopBatchInvOLS(self, evaluate=True):
+        self.BatchInvOLSTimer.stop()
+        self.ReadADTimer.start(self.currADIntervalMS)
+        self.thermalMonitor.jitter.restart()
+
+        self.DoForceButton.setEnabled(1)
+        self.DoContForceButton.setEnabled(1)
+        self.BatchInvOLSLoadButton.setEnabled(1)
+        self.BatchInvOLSNBox.setEnabled(1)
+        self.BatchInvOLSButton.setText("Batch InvOLS")
+
+        curves = self.batchCurves
+        self.batchCurves = []
+        if evaluate and curves:
+            self.BatchInvOLS(*[np.stack(c) for c in zip(*curves)])
+
+    def BatchInvOLSLoad(self):
+        paths, _ = QtWidgets.QFileDialog.getOpenFileNames(self, "Force curves for the InvOLS", self.forceFolder, "Force curves (*.dfc)")
+        if not paths:
+            return
+
+        distApp, deflApp, distRet, deflRet, headers, skipped = dfc_file.readDfcBatch(paths)
+        if skipped:
+            print(str(len(skipped)) + " of " + str(len(paths)) + " files skipped (unreadable or of a different length)")
+        if len(headers) == 0:
+            return
+
+        self.BatchInvOLS(distApp, deflApp, distRet, deflRet)
+
+    def BatchInvOLS(self,distApp,deflApp,distRet,deflRet):
+        #all curves at the current phase shift, fitted in one pass (force_analysis.batchInvOLS)
+        _, _, distRet, deflRet = force_analysis.PhaseShiftCache(distApp, deflApp, distRet, deflRet).views(self.phi)
+        report = force_analysis.batchInvOLS(distRet, deflRet)
+
+        if report["invOLS"] == None:
+            self.BatchInvOLSResult.setText("No usable curves (no clear contact)")
+            return
+
+        self.InvOLS = report["invOLS"]
+        self.InvOLSValue.setText("{InvOLS:.1f} nm/V".format(InvOLS = self.InvOLS))
+        self.BatchInvOLSResult.setText("{used} of {n} curves: median {InvOLS:.1f} nm/V, mean {mean:.1f} +- {std:.1f} nm/V, outliers: {outliers}".format(
+            used = int(report["used"].sum()), n = report["n"], InvOLS = report["invOLS"], mean = report["mean"], std = report["std"],
+            outliers = ", ".join(str(i + 1) for i in report["outliers"]) if report["outliers"] else "none"))
+        self.SaveSettings()
+
+    def ContactSettingsFunc(self):
+        self.springConst = self.springConstValue.value()
+        self.tipRadius = self.tipRadiusValue.value()
+        self.contactModel = self.ContactModelBox.currentText()
+        self.SaveSettings()
+
+    def ContactFitFunc(self):
+        #Hertz on the approach, DMT and JKR (adhesion) on the retract curve, at the current phase
+        #shift and InvOLS
+        if not hasattr(self, "ForceDistMApp2"):
+            return
+
+        model = self.contactModel
+        if model == "Hertz":
+            distM, deflV = self.ForceDistMApp2, self.ForceDeflDataApp2
+        else:
+            distM, deflV = self.ForceDistMRet2, self.ForceDeflDataRet2
+
+        baseline = contact_models.freeBaseline(distM, deflV)[0]
+        delta, force = contact_models.indentation(distM, deflV, self.InvOLS, self.springConst, baseline)
+        mask = contact_models.fitMask(model, delta, force)[0]
+        res = contact_models.fitContactModel(model, delta, force, self.tipRadius, mask=mask)
+        p = res["params"][0]
+
+        text = "E* = {E:.3g} GPa".format(E = p[0])
+        if model == "DMT":
+            text += ", Fadh = {F:.3g} nN".format(F = p[2])
+        elif model == "JKR":
+            text += ", w = {w:.3g} J/m²".format(w = p[2])
+        if not res["converged"][0]:
+            text += " (not converged)"
+        self.ContactFitResult.setText(text)
+
+        #fitted force back to deflection for the plot, replacing the previous fit
+        if (self.contactFitLine != None) and (self.contactFitLine in self.forceAxes.lines):
+            self.contactFitLine.remove()
+        f, _ = contact_models.FUNCTIONS[model](res["params"], delta[mask][None,:], self.tipRadius)
+        self.contactFitLine, = self.forceAxes.plot(distM[mask], f[0]/self.springConst/self.InvOLS + baseline, 'k')
+        self.forceCanvas.draw_idle()
+
     def CalcManInvOLS(self):
 
         y1 = self.InvUpY[0]
@@ -1486,6 +2046,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.extensionVoltage = self.forceMaxDistValue.value()
         self.retractionVoltage = self.forceMinDistValue.value()
         self.piezoConst = self.piezoConstValue.value()
+        self.forceHoldPoints = self.forceHoldValue.value()
+        self.forceSweep = self.forceSweepValue.currentText()
+        self.forceOversample = self.forceOversampleValue.value()
+        self.forceReduction = self.forceReductionValue.currentText()
 
         if (self.gainValue.currentIndex() == 0):
             self.gain = 1
@@ -1501,112 +2065,44 @@ class MainWindow(QtWidgets.QMainWindow):
     def DoForceCurveButtonFunc(self):
         self.ReadADTimer.stop()
         self.DoForceCurve()
-        self.ReadADTimer.start(self.ADUpdateTimeMS)
+        self.ReadADTimer.start(self.currADIntervalMS)
+        self.thermalMonitor.jitter.restart()
         #self.LoadForceCurve()
-        self.DoZeroEstimate()
-
-    def DoForceCurve(self):
-
-        N = int(self.forceDataPoints/2)
-        V = self.retractionVoltage - self.extensionVoltage
-        self.ForceDeflDataApp = array.array('f',[])
-        self.ForceDistDataApp = array.array('f',[])
-        self.ForceDeflDataRet = array.array('f',[])
-        self.ForceDistDataRet = array.array('f',[])
-
-        self.time_step = 0
-        ForceDefl_save1 = array.array('i', [])
-        ForceDist_save1 = array.array('i', [])
-        ForceDefl_save2 = array.array('i', [])
-        ForceDist_save2 = array.array('i', [])
-        ForceDefl_save3 = array.array('i', [])
-        ForceDist_save3 = array.array('i', [])
-        ForceDefl_save4 = array.array('i', [])
-        ForceDist_save4 = array.array('i', [])
-
-
-        dV = V/N
-        retractPnts = 100
-
-        start_time = time.time()
-        for i in range(0,retractPnts):
-            #voltage = self.forceOffset + i*self.retractionVoltage/retractPnts
-            voltage = self.forceOffset + self.retractionVoltage*(1-math.cos(i*math.pi/retractPnts))/2
-            self.DAHat.hat.a_out_write(0,voltage)
-
-            dummyDefl = self.ADHat.hat.a_in_read(self.defChn,options=OptionFlags.NOSCALEDATA)
-            dummyDist = self.ADHat.hat.a_in_read(self.disChn,options=OptionFlags.NOSCALEDATA)
-            #self.ForceDefl_save = np.append(self.ForceDefl_save, dummyDefl)
-            #self.ForceDist_save = np.append(self.ForceDist_save, dummyDist)
-            ForceDefl_save1.append(np.int16(dummyDefl))
-            ForceDist_save1.append(np.int16(dummyDist))
-
-
-        time2 = time.time()
-
-        F0 = self.forceOffset + self.retractionVoltage
-
-        for i in range(0,N):
-            self.DAHat.hat.a_out_write(0,F0 - i*dV)
-            dummyDefl = self.ADHat.hat.a_in_read(self.defChn,options=OptionFlags.NOSCALEDATA)
-            dummyDist = self.ADHat.hat.a_in_read(self.disChn,options=OptionFlags.NOSCALEDATA)
+        #DoForceCurve already did the zero estimate (and the auto phase shift on top of it)
 
-            self.ForceDeflDataApp.append(2*self.ADHat.maxV*(dummyDefl/self.ADHat.maxADC)-self.ADHat.maxV)
-            self.ForceDistDataApp.append(2*self.ADHat.maxV*(dummyDist/self.ADHat.maxADC)-self.ADHat.maxV)
-
-            #self.ForceDefl_save = np.append(self.ForceDefl_save, dummyDefl)
-            #self.ForceDist_save = np.append(self.ForceDist_save, dummyDist)
-            ForceDefl_save2.append(np.int16(dummyDefl))
-            ForceDist_save2.append(np.int16(dummyDist))
-
-
-        time3 = time.time()
-
-        for i in range(0,N):
-            self.DAHat.hat.a_out_write(0,F0 - (N-i)*dV)
-            #self.ADHat.options
-            dummyDefl = self.ADHat.hat.a_in_read(self.defChn,options=OptionFlags.NOSCALEDATA)
-            dummyDist = self.ADHat.hat.a_in_read(self.disChn,options=OptionFlags.NOSCALEDATA)
-
-            self.ForceDeflDataRet.append(2*self.ADHat.maxV*(dummyDefl/self.ADHat.maxADC)-self.ADHat.maxV)
-            self.ForceDistDataRet.append(2*self.ADHat.maxV*(dummyDist/self.ADHat.maxADC)-self.ADHat.maxV)
-
-            #self.ForceDefl_save = np.append(self.ForceDefl_save, dummyDefl)
-            #self.ForceDist_save = np.append(self.ForceDist_save, dummyDist)
-            ForceDefl_save3.append(np.int16(dummyDefl))
-            ForceDist_save3.append(np.int16(dummyDist))
-
-
-        time4 = time.time()
-
-        for i in range(0,retractPnts):
-            voltage = self.forceOffset + self.retractionVoltage*(1+math.cos(i*math.pi/retractPnts))/2
-            self.DAHat.hat.a_out_write(0,voltage)
-
-            dummyDefl = self.ADHat.hat.a_in_read(self.defChn,options=OptionFlags.NOSCALEDATA)
-            dummyDist = self.ADHat.hat.a_in_read(self.disChn,options=OptionFlags.NOSCALEDATA)
-            #self.ForceDefl_save = np.append(self.ForceDefl_save, dummyDefl)
-            #self.ForceDist_save = np.append(self.ForceDist_save, dummyDist)
-            ForceDefl_save4.append(np.int16(dummyDefl))
-            ForceDist_save4.append(np.int16(dummyDist))
+    def DoForceCurve(self, save=True):
+        #returns False if the acquisition failed (e.g. an incomplete oversampling scan)
+        try:
+            data = force_curve.acquireForceCurve(self.ADHat.hat, self.DAHat.hat, self.defChn, self.disChn,
+                                                 self.forceOffset, self.retractionVoltage, self.extensionVoltage,
+                                                 self.forceDataPoints, self.rawOption,
+                                                 holdPnts=self.forceHoldPoints, sweep=self.forceSweep,
+                                                 oversample=self.forceOversample, reduction=self.forceReduction)
+        except RuntimeError as e:
+            print("Could not acquire the force curve: " + str(e))
+            return False
 
+        self.ForceDefl_save = data.defl
+        self.ForceDist_save = data.dist
 
-        self.ForceDefl_save = np.concatenate([ForceDefl_save1, ForceDefl_save2, ForceDefl_save3, ForceDefl_save4],dtype='int16')
-        self.ForceDist_save = np.concatenate([ForceDist_save1, ForceDist_save2, ForceDist_save3, ForceDist_save4],dtype='int16')
+        self.all_force_pnts = len(data.defl)
+        self.time_step = data.timeStep
 
-        stop_time = time.time()
-        time_diff = stop_time-start_time
-        self.all_force_pnts = 2*N + 2*retractPnts
-        self.time_step = time_diff/(self.all_force_pnts)
+        self.apprT = data.apprT
+        self.retrT = data.retrT
+        self.holdT = data.holdT
+        self.codeScale = data.codeScale
 
-        self.apprT = time3 - time2
-        self.retrT = time4 - time3
+        deflV = force_curve.rawToVolts(data.defl, self.ADHat.maxV, self.ADHat.maxADC*data.codeScale)
+        distV = force_curve.rawToVolts(data.dist, self.ADHat.maxV, self.ADHat.maxADC*data.codeScale)
 
-        dummy = [(x-self.forceOffset)*self.piezoConst*self.gain for x in self.ForceDistDataApp]
-        self.ForceDistMApp = array.array('f',dummy)
+        self.ForceDeflDataApp = deflV[data.approachSlice()]
+        self.ForceDistDataApp = distV[data.approachSlice()]
+        self.ForceDeflDataRet = deflV[data.retractSlice()]
+        self.ForceDistDataRet = distV[data.retractSlice()]
 
-        dummy2 = [(x-self.forceOffset)*self.piezoConst*self.gain for x in self.ForceDistDataRet]
-        self.ForceDistMRet = array.array('f',dummy2)
+        self.ForceDistMApp = (self.ForceDistDataApp - self.forceOffset)*self.piezoConst*self.gain
+        self.ForceDistMRet = (self.ForceDistDataRet - self.forceOffset)*self.piezoConst*self.gain
 
         #self.forceDistMRet = self.ForceDeflDataApp*self.piezoConst*self.gain
         self.DoZeroEstimate()
@@ -1617,6 +2113,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ForceDistMRet2 = self.ForceDistMRet
         self.ForceDeflDataRet2 = self.ForceDeflDataRet
+        self.ForceCurveChanged()
 
 
         #self.forceAxes.cla()
@@ -1626,14 +2123,20 @@ class MainWindow(QtWidgets.QMainWindow):
         #self.DrawForceCurve()
         self.UpdateInvBorders()
 
-        self.SaveForceCurve()
+        if self.autoPhaseFlag:
+            self.AutoPhaseFunc()
+
+        if save:
+            self.SaveForceCurve()
         #self.LoadForceCurve()
+        return True
 
-    def SaveForceCurve(self):
+    def ForceCurveHeader(self):
+        #.dfc header of the last acquired curve, see dfc_file.py
         num_chn = 2
         sample_cnt = self.all_force_pnts
-        time_interval = int(self.time_step*1e9) #in nanoseconds
-        maxADC = int(self.ADHat.maxADC)
+        time_interval = int(self.time_step*1e9) #in nanoseconds, per (reduced) point
+        maxADC = int(self.ADHat.maxADC*self.codeScale)
         rangeA = int(2*self.ADHat.maxV)
         rangeB = int(2*self.ADHat.maxV)
         rangeC = 0
@@ -1645,10 +2148,16 @@ class MainWindow(QtWidgets.QMainWindow):
         InvOLS = self.InvOLS
         apprT = self.apprT
         retrT = self.retrT
-        holdT = 0
-        ForceX = 0
-        ForceY = 0
+        holdT = self.holdT
+        ForceX = self.forceX
+        ForceY = self.forceY
 
+        return {"num_chn": num_chn, "sample_cnt": sample_cnt, "time_interval": time_interval, "maxADC": maxADC,
+                "rangeA": rangeA, "rangeB": rangeB, "rangeC": rangeC, "rangeD": rangeD,
+                "PiezoZ": PiezoZ, "DriverG": DriverG, "QCtrlG": QCtrlG, "sqrAmpl": sqrAmpl, "InvOLS": InvOLS,
+                "apprT": apprT, "retrT": retrT, "holdT": holdT, "ForceX": ForceX, "ForceY": ForceY}
+
+    def SaveForceCurve(self):
         fileN = 0
 
 
@@ -1667,28 +2176,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.savePath = saveFolder + "/" + saveName
 
 
-        with open(self.savePath, 'wb') as f:
-            f.write(struct.pack('<I', num_chn))
-            f.write(struct.pack('<I', sample_cnt))
-            f.write(struct.pack('<i', time_interval))
-            f.write(struct.pack('<h', maxADC))
-            f.write(struct.pack('<H', rangeA))
-            f.write(struct.pack('<H', rangeB))
-            f.write(struct.pack('<H', rangeC))
-            f.write(struct.pack('<H', rangeD))
-            f.write(struct.pack('<f', PiezoZ))
-            f.write(struct.pack('<f', DriverG))
-            f.write(struct.pack('<f', QCtrlG))
-            f.write(struct.pack('<d', sqrAmpl))
-            f.write(struct.pack('<d', InvOLS))
-            f.write(struct.pack('<d', apprT))
-            f.write(struct.pack('<d', retrT))
-            f.write(struct.pack('<d', holdT))
-            f.write(struct.pack('<i', ForceX))
-            f.write(struct.pack('<i', ForceY))
-
-            self.ForceDefl_save.tofile(f)
-            self.ForceDist_save.tofile(f)
+        dfc_file.writeDfc(self.savePath, self.ForceCurveHeader(), self.ForceDefl_save, self.ForceDist_save)
 
         #print("Finished Saving!")
         #print(len(self.ForceDefl_save))
@@ -1749,6 +2237,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ForceDistMRet2 = self.ForceDistMRet
         self.ForceDeflDataRet2 = self.ForceDeflDataRet
+        self.ForceCurveChanged()
 
         self.DrawForceCurve()
 
@@ -1786,6 +2275,170 @@ class MainWindow(QtWidgets.QMainWindow):
         self.DoContForceButton.clicked.connect(self.StopContForceCurve)
         self.ContForceTimer.start()
 
+    def ForceMapTab(self):
+        #the curves are acquired and shown by the force curve tab
+        if self.forceTab in self.lazyTabs:
+            self.lazyTabs.pop(self.forceTab)()
+        LoadMatplotlib()
+        layout = QtWidgets.QGridLayout(self.forceMapTab)
+
+        self.forceMapStore = None
+        self.forceMapMaps = None
+        self.forceMapIndex = 0
+
+        self.ForceMapTimer = QTimer()
+        self.ForceMapTimer.timeout.connect(self.ForceMapStep)
+
+        self.ForceMapNXLabel = QtWidgets.QLabel("Pixels x:")
+        self.ForceMapNXBox = QtWidgets.QSpinBox()
+        self.ForceMapNXBox.setMinimum(1)
+        self.ForceMapNXBox.setMaximum(512)
+        self.ForceMapNXBox.setValue(self.forceMapNX)
+        self.ForceMapNXBox.valueChanged.connect(self.ForceMapSettingsFunc)
+
+        self.ForceMapNYLabel = QtWidgets.QLabel("Pixels y:")
+        self.ForceMapNYBox = QtWidgets.QSpinBox()
+        self.ForceMapNYBox.setMinimum(1)
+        self.ForceMapNYBox.setMaximum(512)
+        self.ForceMapNYBox.setValue(self.forceMapNY)
+        self.ForceMapNYBox.valueChanged.connect(self.ForceMapSettingsFunc)
+
+        self.ForceMapButton = QtWidgets.QPushButton("Start Force Map", clicked=self.ForceMapStartStop)
+        self.ForceMapButton.setMinimumHeight(40)
+
+        self.ForceMapSelectBox = QtWidgets.QComboBox()
+        self.ForceMapSelectBox.addItems(force_volume.ForceVolumeMaps.NAMES)
+        self.ForceMapSelectBox.currentIndexChanged.connect(self.DrawForceMap)
+
+        self.ForceMapStatus = QtWidgets.QLabel("")
+
+        self.forceMapCanvas = FigureCanvas(Figure(figsize=(4,4)))
+        self.forceMapAxes = self.forceMapCanvas.figure.subplots()
+        self.forceMapCanvas.figure.set_layout_engine('tight')
+        self.forceMapAxes.set_xlabel("x / pixel")
+        self.forceMapAxes.set_ylabel("y / pixel")
+        self.forceMapImage = None
+        self.forceMapColorbar = None
+
+        layout.addWidget(self.forceMapCanvas,0,0,6,1)
+        layout.addWidget(self.ForceMapNXLabel,0,1)
+        layout.addWidget(self.ForceMapNXBox,0,2)
+        layout.addWidget(self.ForceMapNYLabel,1,1)
+        layout.addWidget(self.ForceMapNYBox,1,2)
+        layout.addWidget(self.ForceMapSelectBox,2,1,1,2)
+        layout.addWidget(self.ForceMapButton,3,1,1,2)
+        layout.addWidget(self.ForceMapStatus,4,1,1,2)
+        layout.setColumnStretch(0,1)
+
+    def ForceMapSettingsFunc(self):
+        self.forceMapNX = self.ForceMapNXBox.value()
+        self.forceMapNY = self.ForceMapNYBox.value()
+        self.SaveSettings()
+
+    def ForceMapStartStop(self):
+        if self.ForceMapTimer.isActive():
+            self.StopForceMap()
+            return
+        if self.BatchInvOLSTimer.isActive():
+            return
+
+        #The curves go into one grid file, the pixel is stamped into each curve header. The lateral
+        #position is set by the scan controller, this program only counts the pixels.
+        todayFormat = datetime.now().strftime("%Y%m%d")
+        saveFolder = self.forceFolder + "/" + todayFormat
+        os.makedirs(saveFolder, exist_ok=True)
+        fileN = 0
+        while os.path.exists(saveFolder + "/forceVolume_" + todayFormat + "_" + str(fileN) + ".fvg"):
+            fileN += 1
+        self.forceMapPath = saveFolder + "/forceVolume_" + todayFormat + "_" + str(fileN) + ".fvg"
+
+        samples = len(waveforms.forceCurveWaveform(self.forceOffset, self.retractionVoltage, self.extensionVoltage, self.forceDataPoints,
+                                                   force_curve.RETRACT_POINTS, self.forceHoldPoints, self.forceSweep))
+        self.forceMapStore = force_volume.ForceVolumeStore.create(self.forceMapPath, self.forceMapNX, self.forceMapNY, samples,
+                                                                  forceDataPoints=self.forceDataPoints, springConst=self.springConst)
+        self.forceMapMaps = force_volume.ForceVolumeMaps(self.forceMapNX, self.forceMapNY)
+        self.forceMapIndex = 0
+        self.forceMapImage = None
+
+        self.ForceMapNXBox.setEnabled(0)
+        self.ForceMapNYBox.setEnabled(0)
+        self.DoForceButton.setEnabled(0)
+        self.DoContForceButton.setEnabled(0)
+        self.BatchInvOLSButton.setEnabled(0)
+        self.ForceMapButton.setText("Stop!")
+        self.ForceMapTimer.start()
+
+    def ForceMapStep(self):
+        nx = self.forceMapStore.nx
+        self.forceX = self.forceMapIndex % nx
+        self.forceY = self.forceMapIndex // nx
+
+        if not self.DoForceCurve(save=False):
+            self.StopForceMap()
+            return
+        try:
+            self.forceMapStore.append(self.forceX, self.forceY, self.ForceCurveHeader(), self.ForceDefl_save, self.ForceDist_save)
+        except (OSError, ValueError) as e:
+            print("Could not write the force map '" + self.forceMapPath + "': " + str(e))
+            self.StopForceMap()
+            return
+
+        #x0 is the contact point, the retract curve is already zeroed
+        self.forceMapMaps.update(self.forceX, self.forceY, self.x0, self.ForceDistMRet, self.ForceDeflDataRet,
+                                 self.InvOLS, self.springConst)
+        self.forceMapIndex += 1
+        self.ForceMapStatus.setText("pixel {n} of {total}".format(n = self.forceMapIndex, total = self.forceMapStore.nx*self.forceMapStore.ny))
+        self.DrawForceMap()
+
+        if self.forceMapIndex >= self.forceMapStore.nx*self.forceMapStore.ny:
+            self.StopForceMap()
+
+    def StopForceMap(self):
+        self.ForceMapTimer.stop()
+        self.forceX = 0
+        self.forceY = 0
+
+        if self.forceMapStore != None:
+            self.forceMapStore.close()
+            self.forceMapStore = None
+            self.forceMapMaps.save(os.path.splitext(self.forceMapPath)[0] + "_maps.npz")
+
+        self.ForceMapNXBox.setEnabled(1)
+        self.ForceMapNYBox.setEnabled(1)
+        self.DoForceButton.setEnabled(1)
+        self.DoContForceButton.setEnabled(1)
+        self.BatchInvOLSButton.setEnabled(1)
+        self.ForceMapButton.setText("Start Force Map")
+
+    def DrawForceMap(self):
+        if self.forceMapMaps == None:
+            return
+
+        name = self.ForceMapSelectBox.currentText()
+        data = self.forceMapMaps.maps[name]
+
+        #the image is created once per map, later curves only replace the data; the colorbar is
+        #created only once, every new one would take space from the image
+        if self.forceMapImage == None:
+            self.forceMapAxes.cla()
+            self.forceMapAxes.set_xlabel("x / pixel")
+            self.forceMapAxes.set_ylabel("y / pixel")
+            self.forceMapImage = self.forceMapAxes.imshow(data, origin='lower', interpolation='nearest')
+            if self.forceMapColorbar == None:
+                self.forceMapColorbar = self.forceMapCanvas.figure.colorbar(self.forceMapImage, ax=self.forceMapAxes)
+        else:
+            self.forceMapImage.set_data(data)
+        self.forceMapColorbar.set_label(name + " / " + force_volume.ForceVolumeMaps.UNITS[name])
+
+        if np.isfinite(data).any():
+            lo = np.nanmin(data)
+            hi = np.nanmax(data)
+            if hi <= lo:
+                hi = lo + 1e-12
+            self.forceMapImage.set_clim(lo, hi)
+        self.forceMapColorbar.update_normal(self.forceMapImage)
+        self.forceMapCanvas.draw_idle()
+
     def StopContForceCurve(self):
         #self.contForceFlag = False
         self.DoForceButton.setEnabled(1)
@@ -1797,16 +2450,29 @@ class MainWindow(QtWidgets.QMainWindow):
         self.MotorStop()
         self.ReadADTimer.stop()
 
+        #a running force map is closed with its maps
+        if (self.forceMapTab not in self.lazyTabs) and self.ForceMapTimer.isActive():
+            self.StopForceMap()
+        if (self.forceTab not in self.lazyTabs) and self.BatchInvOLSTimer.isActive():
+            self.StopBatchInvOLS(evaluate=False)
+            self.ReadADTimer.stop()
+
         if self.fan != None:
             self.fan.off()
 
+        self.FlushSettings()
+        self.StopMeterRecorder()
+
+        if self.buzzer != None:
+            self.buzzer.close()
+
         super(MainWindow, self).closeEvent(event)
 
     def MeterStopButtonFunction(self):
         #if the system wide color scheme was changed, pressing this button will set the bars 
         #background color to match the system's style
         self.bg_color = self.centralFrame.palette().color(QtGui.QPalette.Window).name()
-        self.canvas.figure.set_facecolor(self.bg_color)
+        self.meterWidget.setBackgroundColor(self.bg_color)
 
         if self.meterRunning:
             #self.ReadADTimer.stop()
@@ -1817,14 +2483,60 @@ class MainWindow(QtWidgets.QMainWindow):
             self.meterRunning = True
             self.MeterStopButton.setText("Stop\n Meter")
 
+        self.UpdateADRate()
+
+    def UpdateADRate(self):
+        #Full rate while the motor or a motor sequence is running (approach conditions, waitfor),
+        #a slower rate for the meter display and almost nothing when nobody looks at the meter
+        if self.motorRunning or self.motionQueue.running:
+            interval = self.ADUpdateTimeMS
+        elif self.meterRunning and (not self.isMinimized()) and (self.tabs.currentWidget() in (self.controlTab, self.historyTab)):
+            interval = max(self.idleADUpdateTimeMS, self.ADUpdateTimeMS)
+        else:
+            interval = max(self.stoppedADUpdateTimeMS, self.ADUpdateTimeMS)
+
+        if interval != self.currADIntervalMS:
+            self.currADIntervalMS = interval
+            self.currGraphCount = 0
+            if self.ReadADTimer.isActive():
+                self.ReadADTimer.setInterval(interval)
+                self.thermalMonitor.jitter.restart()
+
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.UpdateADRate()
+        super(MainWindow, self).changeEvent(event)
+
 
 
+    def ReadAveragedSignals(self,n):
+        amp = 0
+        defl = 0
+        zpi = 0
+        for i in range(0,n):
+            amp += self.ADHat.hat.a_in_read(self.ampChn,self.ADHat.options)
+            defl += self.ADHat.hat.a_in_read(self.defChn,self.ADHat.options)
+            zpi += self.ADHat.hat.a_in_read(self.zpiChn,self.ADHat.options)
+
+        return amp/n, defl/n, zpi/n
+
     def updateADTimer(self):
+        self.thermalMonitor.jitter.tick(1e-3*self.currADIntervalMS)
+
         self.sumV = self.ADHat.hat.a_in_read(self.sumChn,self.ADHat.options)
         self.defV = self.ADHat.hat.a_in_read(self.defChn,self.ADHat.options)
         self.ampV = self.ADHat.hat.a_in_read(self.ampChn,self.ADHat.options)
         self.zpiV = self.ADHat.hat.a_in_read(self.zpiChn,self.ADHat.options)
 
+        t = time.monotonic()
+        self.history.append(t, self.sumV, self.defV, self.ampV, self.zpiV)
+        if self.meterRecorder != None:
+            self.meterRecorder.append(t, self.sumV, self.defV, self.ampV, self.zpiV)
+
+        #The baseline is frozen during an auto approach, it is the reference for the amplitude condition
+        approaching = (self.motorRunning == True) and (self.autoApproach == True)
+        self.ampF, self.defF, self.zpiF = self.triggerFilter.update(self.ampV, self.defV, self.zpiV, trackBaseline=not approaching, t=t)
+
         #Check the stopping conditions during Auto Approach
         if (self.motorRunning == True) and (self.autoApproach == True):
             self.AutoApproachCheck()
@@ -1833,82 +2545,121 @@ class MainWindow(QtWidgets.QMainWindow):
 
             self.currGraphCount += 1
             #Don't update the graph and numbers every time, it is too costly
-            if self.currGraphCount*self.ADUpdateTimeMS >= self.graphUpdateTimeMS:
-                self.sumValue.setValue(self.sumV)
-                self.deflectionValue.setValue(self.defV)
-                self.amplitudeValue.setValue(self.ampV)
-                self.zPiezoValue.setValue(self.zpiV)
-                self.setHBarPlot(self.sumV,self.defV,self.zpiV,self.ampV)
+            if self.currGraphCount*self.currADIntervalMS >= self.graphUpdateTimeMS:
+                self.UpdateMeterDisplay(self.sumV,self.defV,self.ampV,self.zpiV)
                 self.currGraphCount = 0
 
                 gc.collect(generation=2)
 
 
-    def setHBarPlot(self,x,y,z,a):
-
-        self.sumRect.set_width(10*x)
+    def UpdateMeterDisplay(self,sumV,defV,ampV,zpiV):
+        #Only changes that are visible are drawn: the boxes are updated when the value changes in the
+        #displayed decimals, the bars when their end moves by a pixel or they change color.
+        boxes = (self.sumValue, self.deflectionValue, self.amplitudeValue, self.zPiezoValue)
+        values = (sumV, defV, ampV, zpiV)
+        for i in range(0,4):
+            shown = round(values[i], boxes[i].decimals())
+            if shown != self.meterShown[i]:
+                boxes[i].setValue(shown)
+                self.meterShown[i] = shown
+                self.meterUpdates["applied"] += 1
+            else:
+                self.meterUpdates["skipped"] += 1
 
-        self.defRect.set_width(y)
-        if (y < 0):
-            self.defRect.set_color(self.defColor1)
+        #the meter widget repaints a bar only if it changes on the pixel grid
+        if self.setHBarPlot(sumV,defV,zpiV,ampV):
+            self.meterUpdates["barsDrawn"] += 1
         else:
-            self.defRect.set_color(self.defColor2)
-
-        self.ampRect.set_width(10*a)
+            self.meterUpdates["barsSkipped"] += 1
 
+    def setHBarPlot(self,x,y,z,a):
+        return self.meterWidget.setValues(x,y,a,z)
 
-        self.zpiRect.set_width(2*z)
-        if (z < 0):
-            self.zpiRect.set_color(self.zpiColor1)
-        else:
-            self.zpiRect.set_color(self.zpiColor2)
+    def MotorCount(self):
+        self.motorPos = self.CurrentMotorPos()
+        self.MotorPosValue.setText(str(self.motorPos))
 
-        self.canvas.restore_region(self.FigBG)
-        self.axes.draw_artist(self.sumPatch)
-        self.axes.draw_artist(self.defPatch)
-        self.axes.draw_artist(self.ampPatch)
-        self.axes.draw_artist(self.zpiPatch)
+        #Fallback, the travel limit is normally handled by limitStopTimer
+        limit = self.ActiveTravelLimit()
+        if limit != None:
+            self.motorDist = abs(self.motorPos - self.startPos)
+            if self.motorDist >= limit:
+                #stopped at this tick, MotorStop keeps the counted position
+                self.MotorStop()
 
-        self.canvas.blit(self.canvas.figure.bbox)
+    def CurrentMotorPos(self):
+        if self.motionProfile == None:
+            return self.motorPos
 
-        #self.canvas.draw()
-        self.canvas.flush_events()
-        #gc.collect()
+        #One position unit corresponds to 10 pulses
+        pulses = self.motionProfile.pulsesAt(time.monotonic() - self.segStartTime)
+        return self.segStartPos + self.motorDirection*int(pulses/1e1)
 
-    def MotorCount(self):
-        if self.pulseFreq < 10000:
-            dStep = int(1e-3*self.motorUpdateTimeMS*self.pulseFreq/1e1)
-            self.motorPos += self.motorDirection*dStep
-            self.MotorPosValue.setText(str(self.motorPos))
+    def ActiveTravelLimit(self):
+        limit = None
+        if (self.slowLimitState != 0) and (self.slowTravel == 1):
+            limit = self.maxTravelSlow
+        if (self.fastLimitState != 0) and (self.fastTravel == 1):
+            limit = self.maxTravelFast
+        if self.moveTravel > 0:
+            if limit == None:
+                limit = self.moveTravel
+            else:
+                limit = min(limit,self.moveTravel)
+        return limit
 
-            if (self.slowLimitState != 0) and (self.slowTravel == 1):
-                self.motorDist = abs(self.motorPos - self.startPos)
-                if self.motorDist >= self.maxTravelSlow:
-                    self.MotorStop()
+    def BeginMotionSegment(self,freq,accel=0):
+        #Called whenever the pulse frequency changes; the position is counted from here on
+        self.segStartPos = self.CurrentMotorPos()
+        self.segStartTime = time.monotonic()
+        self.motionProfile = motor_profile.MotionProfile(freq, accel, 1e-3*self.AccelTimeMS)
 
-            if (self.fastLimitState != 0) and (self.fastTravel == 1):
-                self.motorDist = abs(self.motorPos - self.startPos)
-                if self.motorDist >= self.maxTravelFast:
-                    self.MotorStop()
+        if self.ArmTravelLimit():
+            self.motorCountTimer.start(self.motorDisplayTimeMS)
         else:
-            self.MotorCountAccel()
-
-    def MotorCountAccel(self):
-        dStep = int(1e-3*self.motorUpdateTimeMS*self.accelFreq/1e1)
-        self.motorPos += self.motorDirection*dStep
-        #self.MotorPosValue.setValue(self.motorPos)
-        self.MotorPosValue.setText(str(self.motorPos))
+            self.motorCountTimer.start(self.motorUpdateTimeMS)
 
-        if (self.slowLimitState != 0) and (self.slowTravel == 1):
-            self.motorDist = abs(self.motorPos - self.startPos)
-            if self.motorDist >= self.maxTravelSlow:
-                self.MotorStop()
+    def ArmTravelLimit(self):
+        #Returns False if the limit has to be polled instead
+        self.limitStopTimer.stop()
+        self.limitStopPos = None
+
+        limit = self.ActiveTravelLimit()
+        if limit == None:
+            return True
+
+        #A limit switched on after the move has passed it is not armed; MotorCount stops the
+        #motor at its next tick and keeps the counted position
+        remaining = limit - abs(self.segStartPos - self.startPos)
+        if remaining <= 0:
+            return True
+
+        self.limitStopPos = self.startPos + self.motorDirection*limit
+        t = self.motionProfile.timeToPulses(1e1*remaining)
+        if t == math.inf:
+            return False
+
+        self.limitStopTime = self.segStartTime + t
+
+        #Wake up a little early, the last limitSpinS are waited for in TravelLimitStop
+        self.limitStopTimer.start(max(0,int(1e3*(t - self.limitSpinS))))
+        return True
+
+    def TravelLimitStop(self):
+        #Busy wait for the exact stop time, but never longer than limitSpinS. A timer that fires
+        #late stops at once and the counted position shows the overshoot.
+        deadline = min(self.limitStopTime, time.monotonic() + self.limitSpinS)
+        while time.monotonic() < deadline:
+            pass
+        onTime = time.monotonic() <= self.limitStopTime + self.limitSpinS
+        limitPos = self.limitStopPos
 
-        if (self.fastLimitState != 0) and (self.fastTravel == 1):
-            self.motorDist = abs(self.motorPos - self.startPos)
-            if self.motorDist >= self.maxTravelFast:
-                self.MotorStop()
+        self.MotorStop()
 
+        #stopped at the limit: the counted position only differs by the rounding of the pulse count
+        if onTime and (limitPos != None) and (self.motorDirection*(self.motorPos - limitPos) > 0):
+            self.motorPos = limitPos
+            self.MotorPosValue.setText(str(self.motorPos))
 
     def MotorStart(self):
 
@@ -1917,36 +2668,58 @@ class MainWindow(QtWidgets.QMainWindow):
             self.accelFreq = 0
             finalFreq = self.pulseFreq
             self.AccelTimer.start(self.AccelTimeMS)
+            self.BeginMotionSegment(self.pulseFreq, self.acceleration)
             #self.pulseFreq = finalFreq
         else:
             #self.motorCountTimer.timeout.connect(self.MotorCount)
-            if self.motorDirection == 1:
-                #Retract
-                if self.outputMode == 0:
-                    self.pwm_cw.change_frequency(self.pulseFreq)
-                    self.pwm_cw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,1)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-
-            elif self.motorDirection == -1:
-                #Approach
-                if self.outputMode == 0:
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,0)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
+            self.SetPulseOutput(self.pulseFreq)
+            self.BeginMotionSegment(self.pulseFreq)
 
             #self.MotorCurrSpeedValue.setValue(self.pulseFreq)
             self.MotorCurrSpeedValue.setText(str(self.pulseFreq))
 
         self.motorRunning = True
-        self.motorCountTimer.start(self.motorUpdateTimeMS)
+        self.UpdateADRate()
+
+    def SetPulseOutput(self,freq):
+        #Start the pulses for the current motor direction
+        if self.motorDirection == 1:
+            #Retract
+            if self.outputMode == 0:
+                self.pwm_cw.change_frequency(freq)
+                self.pwm_cw.start(self.powerCycle)
+            else:
+                print(self.directionChn)
+                self.DAHat.hat.dio_output_write_bit(self.directionChn,1)
+                self.pwm_ccw.change_frequency(freq)
+                self.pwm_ccw.start(self.powerCycle)
+
+        elif self.motorDirection == -1:
+            #Approach
+            if self.outputMode == 0:
+                self.pwm_ccw.change_frequency(freq)
+                self.pwm_ccw.start(self.powerCycle)
+            else:
+                print(self.directionChn)
+                self.DAHat.hat.dio_output_write_bit(self.directionChn,0)
+                self.pwm_ccw.change_frequency(freq)
+                self.pwm_ccw.start(self.powerCycle)
+
+    def MoveRelative(self,steps,freq):
+        #Relative move in position units, positive = retract
+        if (self.motorRunning == True) or (steps == 0) or (freq < 1):
+            return
+
+        self.pulseFreq = freq
+        if steps > 0:
+            self.motorDirection = 1
+        else:
+            self.motorDirection = -1
+        self.startPos = self.motorPos
+        self.moveTravel = abs(steps)
+        self.slowTravel = 0
+        self.fastTravel = 0
+        self.MotorStart()
 
     def SlowRetractButtonFunction(self):
         self.pulseFreq = self.slowMoveFreq
@@ -1987,68 +2760,126 @@ class MainWindow(QtWidgets.QMainWindow):
         self.pulseFreq = self.autoApproachFreq
         self.motorDirection = -1
         self.autoApproach = True
-        self.initialAmp = self.ampV
+        #The baseline only counts the samples of the last baselineWindow acquisition intervals. After an
+        #idle phase (slow meter rate) there are too few of them, then the amplitude is averaged now.
+        self.initialAmp = self.triggerFilter.baseline(default=None, maxAgeS=1e-3*self.baselineWindow*self.ADUpdateTimeMS,
+                                                      minSamples=self.stepAverageN)
+        if self.initialAmp == None:
+            self.initialAmp = self.ReadAveragedSignals(self.stepAverageN)[0]
         self.MotorStart()
 
     def AutoApproachCheck(self):
-        if (self.ampV < self.initialAmp*self.ampRatio) or (self.zpiV < self.zpiLimit) or (self.defV > self.defLimit):
+        if approach.approachConditionMet(self.ampF, self.zpiF, self.defF, self.initialAmp, self.ampRatio, self.zpiLimit, self.defLimit):
+            self.PlayApproachSound()
+            self.MotorStop()
+
+    def StepApproachButtonFunction(self):
+        if self.motorRunning == True:
+            return
+
+        self.pulseFreq = self.autoApproachFreq
+        if self.pulseFreq < 1:
+            return
+
+        self.motorDirection = -1
+        self.startPos = self.motorPos
+        self.initialAmp, self.initialDef, self.initialZpi = self.ReadAveragedSignals(self.stepAverageN)
+        self.stepApproach = True
+        self.motorRunning = True
+        self.UpdateADRate()
+        self.StepApproachMove(self.stepApproachSize)
+
+    def StepApproachMove(self,steps):
+        #One position unit corresponds to 10 pulses (see MotorCount)
+        stepTimeMS = max(1,int(round(1e4*steps/self.pulseFreq)))
+        self.currStepSize = int(1e-4*stepTimeMS*self.pulseFreq)
+
+        self.stepStartTime = time.monotonic()
+        self.SetPulseOutput(self.pulseFreq)
+        self.MotorCurrSpeedValue.setText(str(self.pulseFreq))
+        self.stepTimer.start(stepTimeMS)
+
+    def StepApproachStepDone(self):
+        self.pwm_cw.stop()
+        self.pwm_ccw.stop()
+        self.MotorCurrSpeedValue.setText("0")
+
+        self.motorPos += self.motorDirection*self.currStepSize
+        self.MotorPosValue.setText(str(self.motorPos))
+        self.currStepSize = 0
+
+        if self.stepApproach:
+            self.stepSettleTimer.start(self.stepSettleTimeMS)
+
+    def StepApproachMeasure(self):
+        if not self.stepApproach:
+            return
+
+        amp, defl, zpi = self.ReadAveragedSignals(self.stepAverageN)
+
+        if approach.approachConditionMet(amp, zpi, defl, self.initialAmp, self.ampRatio, self.zpiLimit, self.defLimit):
+            self.PlayApproachSound()
             self.MotorStop()
-            worker = BuzzerWorker()
-            self.threadpool.start(worker)
+            return
+
+        margin = approach.approachMargin(amp, zpi, defl, self.initialAmp, self.initialZpi, self.initialDef,
+                                         self.ampRatio, self.zpiLimit, self.defLimit)
+        steps = approach.stepApproachSize(margin, self.stepApproachSize, self.stepApproachMinSize)
+        self.StepApproachMove(steps)
 
 
     def MotorStopButtonFunction(self):
+        self.motionQueue.abort()
         self.MotorStop()
 
     def MotorStop(self):
+        if self.stepTimer.isActive():
+            #Stopped in the middle of a step approach move, count the part that was done
+            done = int(1e-1*(time.monotonic() - self.stepStartTime)*self.pulseFreq)
+            self.motorPos += self.motorDirection*min(done,self.currStepSize)
+            self.MotorPosValue.setText(str(self.motorPos))
+            self.currStepSize = 0
+        self.stepTimer.stop()
+        self.stepSettleTimer.stop()
+        self.stepApproach = False
         self.AccelTimer.stop()
         self.pwm_cw.stop()
         self.pwm_ccw.stop()
         self.motorCountTimer.stop()
+        self.limitStopTimer.stop()
+        if self.motionProfile != None:
+            self.motorPos = self.CurrentMotorPos()
+            self.motionProfile = None
+            self.MotorPosValue.setText(str(self.motorPos))
         self.motorRunning = False
         self.autoApproach = False
         self.pulseFreq = 0
         self.slowTravel = 0
         self.fastTravel = 0
+        self.moveTravel = 0
         #self.MotorCurrSpeedValue.setValue(self.pulseFreq)
         self.MotorCurrSpeedValue.setText(str(self.pulseFreq))
+        self.UpdateADRate()
+
+        self.motorStopped.emit()
 
     def FasterButtonFunction(self):
         if self.motorRunning == True:
             #self.pwm_cw.stop()
             #self.pwm_cw.stop()
             self.motorCountTimer.stop()
+            self.AccelTimer.stop()
             self.pulseFreq += self.dSpeed
 
             #self.MotorStart()
             #self.motorCountTimer.timeout.connect(self.MotorCount)
-            if self.motorDirection == 1:
-                #Retract
-                if self.outputMode == 0:
-                    self.pwm_cw.change_frequency(self.pulseFreq)
-                    self.pwm_cw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,1)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-
-            elif self.motorDirection == -1:
-                #Approach
-                if self.outputMode == 0:
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,0)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
+            self.SetPulseOutput(self.pulseFreq)
+            self.BeginMotionSegment(self.pulseFreq)
 
             #self.MotorCurrSpeedValue.setValue(self.pulseFreq)
             self.MotorCurrSpeedValue.setText(str(self.pulseFreq))
 
             self.motorRunning = True
-            self.motorCountTimer.start(self.motorUpdateTimeMS)
 
 
 
@@ -2057,44 +2888,25 @@ class MainWindow(QtWidgets.QMainWindow):
             #self.pwm_ccw.stop()
             #self.pwm_cw.stop()
             self.motorCountTimer.stop()
+            self.AccelTimer.stop()
             self.pulseFreq -= self.dSpeed
             #The minimum frequency is 0.1, just in case, let's keep it 1 at the lowest 
             if self.pulseFreq < 1:
                 self.pulseFreq = 1
             #self.MotorStart()
             #self.motorCountTimer.timeout.connect(self.MotorCount)
-            if self.motorDirection == 1:
-                #Retract
-                if self.outputMode == 0:
-                    self.pwm_cw.change_frequency(self.pulseFreq)
-                    self.pwm_cw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,1)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-
-            elif self.motorDirection == -1:
-                #Approach
-                if self.outputMode == 0:
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
-                else:
-                    print(self.directionChn)
-                    self.DAHat.hat.dio_output_write_bit(self.directionChn,0)
-                    self.pwm_ccw.change_frequency(self.pulseFreq)
-                    self.pwm_ccw.start(self.powerCycle)
+            self.SetPulseOutput(self.pulseFreq)
+            self.BeginMotionSegment(self.pulseFreq)
 
             #self.MotorCurrSpeedValue.setValue(self.pulseFreq)
             self.MotorCurrSpeedValue.setText(str(self.pulseFreq))
 
             self.motorRunning = True
-            self.motorCountTimer.start(self.motorUpdateTimeMS)
 
 
 
     def AcceleratedMovement(self):
-        self.accelFreq += self.acceleration
+        self.accelFreq = min(self.accelFreq + self.acceleration, self.pulseFreq)
         if self.motorDirection == 1:
             #Retract
             if self.outputMode == 0:
@@ -2116,131 +2928,50 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
-    def float_to_bytes(self,value):
-        return struct.pack('d', value)
-
-    def bytes_to_float(self,value):
-        [result] = struct.unpack('d', value)
-        return  result
-
     def SaveSettings(self):
+        #Changes are collected in the settings store and written by the debounce timer
         global apprSound
 
-        settings_file = open("settings.dat","wb")
-
-        settings_file.write(self.ADUpdateTimeMS.to_bytes(8,byteorder='big'))
-        settings_file.write(self.graphUpdateTimeMS.to_bytes(8,byteorder='big'))
-        settings_file.write(self.currGraphCount.to_bytes(8,byteorder='big'))
-        settings_file.write(self.fastMoveFreq.to_bytes(8,byteorder='big'))
-        settings_file.write(self.slowMoveFreq.to_bytes(8,byteorder='big'))
-        settings_file.write(self.autoApproachFreq.to_bytes(8,byteorder='big'))
-        settings_file.write(self.acceleration.to_bytes(8,byteorder='big'))
-        settings_file.write(self.dSpeed.to_bytes(8,byteorder='big'))
-        settings_file.write(self.powerCycle.to_bytes(8,byteorder='big'))
-        settings_file.write(self.accelFreq.to_bytes(8,byteorder='big'))
-        settings_file.write(self.approachChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.retractChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.sumChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.defChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.ampChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.zpiChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.float_to_bytes(self.defLimit))
-        settings_file.write(self.float_to_bytes(self.zpiLimit))
-        settings_file.write(self.float_to_bytes(self.ampRatio))
-        settings_file.write(self.motorUpdateTimeMS.to_bytes(8,byteorder='big'))
-        settings_file.write(self.outputMode.to_bytes(8,byteorder='big'))
-
-        settings_file.write(self.ADUpdateTimeMS.to_bytes(8,byteorder='big'))
-        settings_file.write(self.graphUpdateTimeMS.to_bytes(8,byteorder='big'))
-        settings_file.write(self.maxTravelFast.to_bytes(8,byteorder='big'))
-        settings_file.write(self.maxTravelSlow.to_bytes(8,byteorder='big'))
-        settings_file.write(self.directionChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.approachChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.retractChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.sumChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.defChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.ampChn.to_bytes(8,byteorder='big'))
-        settings_file.write(self.zpiChn.to_bytes(8,byteorder='big'))
-
-        settings_file.write(self.fastLimitState.to_bytes(8,byteorder='big'))
-        settings_file.write(self.slowLimitState.to_bytes(8,byteorder='big'))
-
-        settings_file.write(self.forceDataPoints.to_bytes(8,byteorder='big'))
-        settings_file.write(self.float_to_bytes(self.extensionVoltage))
-        settings_file.write(self.float_to_bytes(self.retractionVoltage))
-        settings_file.write(self.float_to_bytes(self.piezoConst))
-        settings_file.write(self.gain.to_bytes(8,byteorder='big'))
-        settings_file.write(self.disChn.to_bytes(8,byteorder='big'))
-
-        settings_file.write(apprSound.to_bytes(8,byteorder='big'))
-
-        settings_file.write(self.fanControlFlag.to_bytes(8,byteorder='big'))
-
-        settings_file.write(self.fanChn.to_bytes(8,byteorder='big'))
-
-        settings_file.close()
-
-        #self.LoadSettings()
+        values = {key: getattr(self,key) for key in self.settingsKeys}
+        values["apprSound"] = apprSound
+
+        if self.settingsStore.update(values):
+            self.settingsSaveTimer.start(self.settingsSaveDelayMS)
+
+    def FlushSettings(self):
+        self.settingsSaveTimer.stop()
+        try:
+            self.settingsStore.flush()
+        except OSError as e:
+            print("Could not write the settings file '" + self.settingsStore.path + "': " + str(e))
 
     def LoadSettings(self):
         global apprSound
-        try:
-            settings_file = open("settings.dat", "rb")
-
-            self.ADUpdateTimeMS = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.graphUpdateTimeMS = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.currGraphCount = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.fastMoveFreq = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.slowMoveFreq = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.autoApproachFreq = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.acceleration = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.dSpeed = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.powerCycle = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.accelFreq = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.approachChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.retractChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.sumChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.defChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.ampChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.zpiChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.defLimit = self.bytes_to_float(settings_file.read(8))
-            self.zpiLimit = self.bytes_to_float(settings_file.read(8))
-            self.ampRatio = self.bytes_to_float(settings_file.read(8))
-            dummy = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.outputMode = int.from_bytes(settings_file.read(8),byteorder='big')
-
-            self.ADUpdateTimeMS = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.graphUpdateTimeMS = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.maxTravelFast = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.maxTravelSlow = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.directionChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.approachChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.retrachChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.sumChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.defChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.ampChn = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.zpiChn = int.from_bytes(settings_file.read(8),byteorder='big')
-
-            self.fastLimitState = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.slowLimitState = int.from_bytes(settings_file.read(8),byteorder='big')
-
-
-            self.forceDataPoints = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.extensionVoltage = self.bytes_to_float(settings_file.read(8))
-            self.retractionVoltage = self.bytes_to_float(settings_file.read(8))
-            self.piezoConst = self.bytes_to_float(settings_file.read(8))
-            self.gain = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.disChn = int.from_bytes(settings_file.read(8),byteorder='big')
-
-            apprSound = int.from_bytes(settings_file.read(8),byteorder='big')
-
-            self.fanControlFlag = int.from_bytes(settings_file.read(8),byteorder='big')
-            self.fanChn = int.from_bytes(settings_file.read(8),byteorder='big')
-
-            settings_file.close()
-        except:
-            print("Settings file 'settings.dat' not found; creating one for next time.")
-            self.SaveSettings()
+
+        if self.settingsStore.load():
+            values = self.settingsStore.values
+        else:
+            values = settings_store.readLegacySettings("settings.dat")
+            if values == None:
+                print("Settings file '" + self.settingsStore.path + "' not found; creating one for next time.")
+                values = {}
+            else:
+                print("Converting 'settings.dat' to '" + self.settingsStore.path + "'.")
+
+        for key in self.settingsKeys + ["apprSound"]:
+            if key not in values:
+                continue
+            #keep the type of the default (int or float); a broken entry keeps the default
+            try:
+                if key == "apprSound":
+                    apprSound = int(values[key])
+                else:
+                    setattr(self,key,type(getattr(self,key))(values[key]))
+            except (TypeError, ValueError, OverflowError):
+                print("Settings: invalid value " + repr(values[key]) + " for '" + key + "' ignored, using the default.")
+
+        self.SaveSettings()
+        self.FlushSettings()
 
 
 
@@ -2248,9 +2979,28 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
+    #--sim: simulated hardware (sim_hardware.py)
+    #--startup-report: build the window off-screen, print the time of the startup phases and exit
+    #(on the real hardware unless --sim is given, opening the HATs is part of the cold start)
+    startupReport = "--startup-report" in sys.argv
+    simHardware = "--sim" in sys.argv
+    if startupReport:
+        os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    argv = [arg for arg in sys.argv if arg not in ("--sim","--startup-report")]
+
+    app = QtWidgets.QApplication(argv)
+    startupMark("QApplication")
 
     widget = MainWindow()
     widget.show()
+    startupMark("show")
+
+    if startupReport:
+        tLast = startupT0
+        for name, t in startupTimes:
+            print("%-24s %8.1f ms  (total %8.1f ms)" % (name, 1e3*(t - tLast), 1e3*(t - startupT0)))
+            tLast = t
+        widget.close()
+        sys.exit(0)
 
     sys.exit(app.exec())
@@ -0,0 +1,67 @@
+#Motion profile of the stepper motor
+#
+#The hardware PWM sends the pulses on its own, so the number of pulses since the start of a move
+#follows directly from the frequency (and the acceleration ramp for fast moves). This is used to
+#calculate the motor position from the elapsed time and to know in advance when a travel limit
+#will be reached.
+#
+#Acceleration ramp (see MainWindow.AcceleratedMovement): nothing is sent until the first tick of
+#the acceleration timer, after the k-th tick the frequency is min(k*accel, freq).
+
+import math
+
+
+class MotionProfile():
+    def __init__(self,freq,accel=0,accelTime=0.01):
+        self.freq = freq
+        self.accel = accel
+        self.accelTime = accelTime
+
+        if (accel > 0) and (freq > 0):
+            self.rampTicks = int(math.ceil(freq/accel))
+        else:
+            self.rampTicks = 0
+
+    def pulsesAt(self,t):
+        if (t <= 0) or (self.freq <= 0):
+            return 0.0
+
+        if self.rampTicks == 0:
+            if self.accel > 0:
+                return 0.0
+            return self.freq*t
+
+        T = self.accelTime
+        n = int(t/T)
+        if n == 0:
+            return 0.0
+        elif n < self.rampTicks:
+            return self.accel*T*(n-1)*n/2 + n*self.accel*(t - n*T)
+        else:
+            K = self.rampTicks
+            return self.accel*T*(K-1)*K/2 + self.freq*(t - K*T)
+
+    def timeToPulses(self,pulses):
+        #returns math.inf if the number of pulses is never reached
+        if pulses <= 0:
+            return 0.0
+        if self.freq <= 0:
+            return math.inf
+
+        if self.rampTicks == 0:
+            if self.accel > 0:
+                return math.inf
+            return pulses/self.freq
+
+        T = self.accelTime
+        K = self.rampTicks
+        rampPulses = self.accel*T*(K-1)*K/2
+
+        if pulses >= rampPulses:
+            return K*T + (pulses - rampPulses)/self.freq
+
+        n = 1
+        while self.accel*T*n*(n+1)/2 <= pulses:
+            n += 1
+
+        return n*T + (pulses - self.accel*T*(n-1)*n/2)/(n*self.accel)
@@ -0,0 +1,113 @@
+#Settings store
+#
+#Keeps the settings in memory and writes them as one keyed, versioned JSON file:
+#
+#       {"version": 1, "settings": {"slowMoveFreq": 3000, ...}}
+#
+#Writes go to a temporary file next to the settings file which is then renamed over it, so a
+#crash or power loss during a write leaves either the old or the new file, never a half written
+#one. Debouncing is left to the caller (the GUI restarts a single-shot QTimer on every change and
+#calls flush() when it fires and at shutdown).
+#
+#Older versions stored the settings positionally in the binary file settings.dat;
+#readLegacySettings() converts such a file once.
+
+import json
+import os
+import struct
+
+SETTINGS_VERSION = 1
+
+
+class SettingsStore():
+    def __init__(self,path):
+        self.path = path
+        self.values = {}
+        self.dirty = False
+        self.writeCount = 0
+
+    def load(self):
+        #returns False if there is no (readable) settings file
+        try:
+            with open(self.path,"r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data,dict) or not isinstance(data.get("settings"),dict):
+            return False
+        if data.get("version",0) > SETTINGS_VERSION:
+            print("Settings file '" + self.path + "' was written by a newer version; unknown entries are ignored.")
+
+        self.values = data["settings"]
+        self.dirty = False
+        return True
+
+    def get(self,key,default=None):
+        return self.values.get(key,default)
+
+    def update(self,values):
+        #returns True if anything changed
+        for key in values:
+            if self.values.get(key) != values[key]:
+                self.values[key] = values[key]
+                self.dirty = True
+        return self.dirty
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath,"w") as f:
+            json.dump({"version": SETTINGS_VERSION, "settings": self.values},f,indent=1,sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath,self.path)
+
+        self.dirty = False
+        self.writeCount += 1
+
+
+#Field order of the legacy settings.dat. Every entry is 8 bytes, big-endian integers or native
+#doubles; None marks entries that were written but never read back.
+LEGACY_FIELDS = [
+    ("ADUpdateTimeMS","i"), ("graphUpdateTimeMS","i"), ("currGraphCount","i"), ("fastMoveFreq","i"),
+    ("slowMoveFreq","i"), ("autoApproachFreq","i"), ("acceleration","i"), ("dSpeed","i"),
+    ("powerCycle","i"), ("accelFreq","i"), ("approachChn","i"), ("retractChn","i"),
+    ("sumChn","i"), ("defChn","i"), ("ampChn","i"), ("zpiChn","i"),
+    ("defLimit","d"), ("zpiLimit","d"), ("ampRatio","d"), (None,"i"), ("outputMode","i"),
+    ("ADUpdateTimeMS","i"), ("graphUpdateTimeMS","i"), ("maxTravelFast","i"), ("maxTravelSlow","i"),
+    ("directionChn","i"), ("approachChn","i"), (None,"i"), ("sumChn","i"),
+    ("defChn","i"), ("ampChn","i"), ("zpiChn","i"),
+    ("fastLimitState","i"), ("slowLimitState","i"),
+    ("forceDataPoints","i"), ("extensionVoltage","d"), ("retractionVoltage","d"), ("piezoConst","d"),
+    ("gain","i"), ("disChn","i"),
+    ("apprSound","i"), ("fanControlFlag","i"), ("fanChn","i"),
+    ("stepApproachSize","i"), ("stepApproachMinSize","i"), ("stepSettleTimeMS","i"), ("stepAverageN","i"),
+    ("triggerFilterType","i"), ("triggerFilterWindow","i"), ("baselineWindow","i"),
+]
+
+
+def readLegacySettings(path):
+    #returns the settings of a legacy settings.dat as a dict, None if there is no such file
+    try:
+        with open(path,"rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    values = {}
+    for i, (key, fmt) in enumerate(LEGACY_FIELDS):
+        item = data[8*i:8*i+8]
+        if len(item) < 8:
+            #older files simply end earlier
+            break
+        if key == None:
+            continue
+        if fmt == "d":
+            [values[key]] = struct.unpack('d', item)
+        else:
+            values[key] = int.from_bytes(item,byteorder='big')
+
+    return values
@@ -0,0 +1,191 @@
+#Streaming filters for the auto approach trigger
+#
+#All filters work sample by sample on a fixed size NumPy ring buffer that is allocated once, so
+#the cost per sample only depends on the window. The moving average and the exponential filter
+#don't allocate per sample; the median filter does (np.median sorts a copy of the window), as
+#does baseline(), which is only called when an approach starts.
+#
+#Filter types (same order as the combo box in the Advanced tab):
+#   0 - none, 1 - moving average, 2 - median, 3 - exponential
+
+import time
+
+import numpy as np
+
+FILTER_NONE = 0
+FILTER_MEAN = 1
+FILTER_MEDIAN = 2
+FILTER_EXP = 3
+
+
+class RingBuffer():
+    def __init__(self,size):
+        self.size = max(1,int(size))
+        self.data = np.zeros(self.size)
+        self.index = 0
+        self.count = 0
+
+    def append(self,value):
+        self.data[self.index] = value
+        self.index += 1
+        if self.index >= self.size:
+            self.index = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def oldest(self):
+        #the value that is overwritten by the next append (only meaningful when full)
+        return self.data[self.index]
+
+    def full(self):
+        return self.count >= self.size
+
+    def values(self):
+        #filled part of the buffer, not in time order
+        if self.count < self.size:
+            return self.data[0:self.count]
+        return self.data
+
+    def ordered(self):
+        #filled part of the buffer, oldest first
+        if self.count < self.size:
+            return self.data[0:self.count].copy()
+        return np.concatenate((self.data[self.index:],self.data[0:self.index]))
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+
+class PassFilter():
+    def __init__(self,window=1):
+        self.value = 0.0
+
+    def update(self,value):
+        self.value = value
+        return value
+
+    def reset(self):
+        self.value = 0.0
+
+
+class MovingAverageFilter():
+    def __init__(self,window):
+        self.buffer = RingBuffer(window)
+        self.sum = 0.0
+        self.value = 0.0
+
+    def update(self,value):
+        if self.buffer.full():
+            self.sum -= float(self.buffer.oldest())
+        self.buffer.append(value)
+        self.sum += value
+
+        #resum once per buffer turn so that rounding errors don't pile up
+        if self.buffer.index == 0:
+            self.sum = float(self.buffer.data.sum())
+
+        self.value = self.sum/self.buffer.count
+        return self.value
+
+    def reset(self):
+        self.buffer.clear()
+        self.sum = 0.0
+        self.value = 0.0
+
+
+class MedianFilter():
+    def __init__(self,window):
+        self.buffer = RingBuffer(window)
+        self.value = 0.0
+
+    def update(self,value):
+        self.buffer.append(value)
+        self.value = float(np.median(self.buffer.values()))
+        return self.value
+
+    def reset(self):
+        self.buffer.clear()
+        self.value = 0.0
+
+
+class ExponentialFilter():
+    def __init__(self,window):
+        #same center of mass as a moving average over "window" samples
+        self.alpha = 2.0/(max(1,int(window))+1)
+        self.started = False
+        self.value = 0.0
+
+    def update(self,value):
+        if self.started:
+            self.value += self.alpha*(value - self.value)
+        else:
+            self.value = value
+            self.started = True
+        return self.value
+
+    def reset(self):
+        self.started = False
+        self.value = 0.0
+
+
+def makeFilter(filterType,window):
+    if filterType == FILTER_MEAN:
+        return MovingAverageFilter(window)
+    elif filterType == FILTER_MEDIAN:
+        return MedianFilter(window)
+    elif filterType == FILTER_EXP:
+        return ExponentialFilter(window)
+    else:
+        return PassFilter(window)
+
+
+class ApproachSignalFilter():
+    #Filters amplitude, deflection and z-piezo for the trigger logic and keeps a rolling
+    #baseline (median) of the amplitude that serves as reference when an approach starts.
+    #The baseline samples are stored with their time, so the meter rate may change: baseline()
+    #can be limited to the samples of the last maxAgeS seconds.
+    def __init__(self,filterType=FILTER_MEAN,window=5,baselineWindow=250):
+        self.filterType = filterType
+        self.window = window
+        self.baselineWindow = baselineWindow
+
+        self.ampFilter = makeFilter(filterType,window)
+        self.defFilter = makeFilter(filterType,window)
+        self.zpiFilter = makeFilter(filterType,window)
+        self.baselineValues = RingBuffer(baselineWindow)
+        self.baselineTimes = RingBuffer(baselineWindow)
+        self.lastBaselineT = 0.0
+
+    def update(self,amp,defl,zpi,trackBaseline=True,t=None):
+        #t: time of the sample in s (time.monotonic() if not given)
+        ampF = self.ampFilter.update(amp)
+        defF = self.defFilter.update(defl)
+        zpiF = self.zpiFilter.update(zpi)
+
+        if trackBaseline:
+            if t == None:
+                t = time.monotonic()
+            self.baselineValues.append(amp)
+            self.baselineTimes.append(t)
+            self.lastBaselineT = t
+
+        return ampF, defF, zpiF
+
+    def baseline(self,default=0.0,maxAgeS=None,minSamples=1):
+        #median of the tracked amplitude; only the samples at most maxAgeS older than the newest
+        #one count, default if fewer than minSamples are left
+        values = self.baselineValues.values()
+        if maxAgeS != None:
+            values = values[self.baselineTimes.values() >= self.lastBaselineT - maxAgeS]
+        if len(values) < max(minSamples,1):
+            return default
+        return float(np.median(values))
+
+    def reset(self):
+        self.ampFilter.reset()
+        self.defFilter.reset()
+        self.zpiFilter.reset()
+        self.baselineValues.clear()
+        self.baselineTimes.clear()
+        self.lastBaselineT = 0.0
@@ -0,0 +1,218 @@
+#Simulated hardware
+#
+#Stand-ins for the MCC 118 / MCC 152 DAQ HATs and the Raspberry Pi hardware PWM, so that the
+#control software can run without the instrument (e.g. "control_server.py --sim").
+#
+#The stage model is simple on purpose:
+#   - the motor position is integrated from the PWM frequencies (10 pulses per position unit,
+#     approach channel moves towards the surface, retract channel away from it)
+#   - within contactRange of the surface the amplitude drops linearly to zero and the z-piezo
+#     signal goes from +5 V to -5 V
+#   - the force curve distance channel reads back the z-piezo drive (analog output 0), the
+#     deflection rises linearly once the piezo extends past the contact point
+#   - gaussian noise is added to every reading (also to every sample of a scan)
+
+import random
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+NOSCALEDATA = 0x0001    #same value as daqhats.OptionFlags.NOSCALEDATA
+
+#result of a_in_scan_read_numpy (the fields used here)
+ScanResult = namedtuple("ScanResult", ["running", "hardware_overrun", "buffer_overrun", "triggered", "timeout", "data"])
+DIO_DIRECTION = 0       #same value as daqhats.DIOConfigItem.DIRECTION
+
+
+class SimStage():
+    def __init__(self,surfacePos=-20000,contactRange=2000,noise=0.005):
+        self.lock = threading.Lock()
+
+        self.surfacePos = surfacePos
+        self.contactRange = contactRange
+        self.noise = noise
+
+        self.motorPos = 0.0
+        self.lastTime = time.monotonic()
+        self.pwmFreq = {}
+        self.pwmDirection = {2:-1, 3:1}     #approach / retract channel as in MainWindow
+
+        self.channels = {0:"sum", 1:"def", 2:"amp", 3:"zpi", 4:"dis"}
+        self.aOut = [2.5, 0.0]
+
+        self.sum = 5.0
+        self.freeAmp = 2.0
+        self.forceOffset = 2.5
+        self.piezoConst = 18.5
+        self.gain = 5
+        self.invOLS = 50.0      #nm/V
+        self.contactNm = 0.0
+
+    def update(self):
+        #integrate the motor position up to now
+        now = time.monotonic()
+        dt = now - self.lastTime
+        self.lastTime = now
+        for chn in self.pwmFreq:
+            self.motorPos += self.pwmDirection.get(chn,0)*self.pwmFreq[chn]*dt/1e1
+
+    def setPWM(self,chn,freq):
+        with self.lock:
+            self.update()
+            self.pwmFreq[chn] = freq
+
+    def position(self):
+        with self.lock:
+            self.update()
+            return self.motorPos
+
+    def signal(self,chn):
+        name = self.channels.get(chn,"")
+        gap = self.position() - self.surfacePos
+        near = min(max(gap/self.contactRange,0.0),1.0)
+
+        if name == "sum":
+            v = self.sum
+        elif name == "amp":
+            v = self.freeAmp*near
+        elif name == "zpi":
+            v = -5.0 + 10.0*near
+        elif name == "def":
+            distNm = (self.aOut[0] - self.forceOffset)*self.piezoConst*self.gain
+            v = max(0.0,self.contactNm - distNm)/self.invOLS
+            if gap < 0:
+                v += -gap*1e-3
+        elif name == "dis":
+            v = self.aOut[0]
+        else:
+            v = 0.0
+
+        return v + random.gauss(0.0,self.noise)
+
+
+defaultStage = SimStage()
+
+
+class SimMCC118():
+    def __init__(self,stage=None):
+        if stage == None:
+            stage = defaultStage
+        self.stage = stage
+        self.maxV = 10.0
+        self.maxADC = 4096.0
+
+    def a_in_read(self,channel,options=0):
+        v = self.stage.signal(channel)
+        if options & NOSCALEDATA:
+            code = int(round((v + self.maxV)*self.maxADC/(2*self.maxV)))
+            return min(max(code,0),int(self.maxADC)-1)
+        return min(max(v,-self.maxV),self.maxV)
+
+    def a_in_scan_start(self,channel_mask,samples_per_channel,sample_rate_per_channel,options=0):
+        #finite scan: the samples are taken at once, a_in_scan_read_numpy waits for the scan time
+        channels = [chn for chn in range(0,8) if channel_mask & (1 << chn)]
+        samples = [[self.a_in_read(chn,options) for chn in channels] for i in range(0,samples_per_channel)]
+        self.scanData = np.array(samples, dtype=float).ravel()
+        self.scanEnd = time.monotonic() + samples_per_channel/sample_rate_per_channel
+
+    def a_in_scan_read_numpy(self,samples_per_channel,timeout):
+        wait = self.scanEnd - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        return ScanResult(False, False, False, True, False, self.scanData)
+
+    def a_in_scan_stop(self):
+        pass
+
+    def a_in_scan_cleanup(self):
+        self.scanData = None
+
+
+class SimMCC152():
+    def __init__(self,stage=None):
+        if stage == None:
+            stage = defaultStage
+        self.stage = stage
+        self.dio = 0
+
+    def a_out_write(self,channel,value,options=0):
+        self.stage.aOut[channel] = min(max(value,0.0),5.0)
+
+    def dio_reset(self):
+        self.dio = 0
+
+    def dio_config_write_bit(self,bit,item,value):
+        pass
+
+    def dio_output_write_port(self,value):
+        self.dio = value
+
+    def dio_output_write_bit(self,bit,value):
+        if value:
+            self.dio |= (1 << bit)
+        else:
+            self.dio &= ~(1 << bit)
+
+
+class SimHatDevice():
+    #same attributes as hardware.hat_device
+    def __init__(self,hType,stage=None):
+        self.type = hType
+        self.options = 0
+        self.address = 0
+        if hType == "mcc118":
+            self.hat = SimMCC118(stage)
+            self.maxV = 10.0
+            self.maxADC = 4096.0
+        elif hType == "mcc152":
+            self.hat = SimMCC152(stage)
+        else:
+            raise ValueError("ERROR: Invalid HAT type. Please specify either \"mcc118\" or \"mcc152\"!")
+
+    def select_hat(self,n):
+        pass
+
+
+class SimHardwarePWM():
+    #same interface as rpi_hardware_pwm.HardwarePWM
+    def __init__(self,pwm_channel,hz,chip=0,stage=None):
+        if stage == None:
+            stage = defaultStage
+        self.stage = stage
+        self.pwm_channel = pwm_channel
+        self.hz = hz
+        self.duty = 0
+        self.running = False
+
+    def start(self,initial_duty_cycle):
+        self.duty = initial_duty_cycle
+        self.running = True
+        self.stage.setPWM(self.pwm_channel,self.hz)
+
+    def stop(self):
+        self.running = False
+        self.stage.setPWM(self.pwm_channel,0)
+
+    def change_duty_cycle(self,duty_cycle):
+        self.duty = duty_cycle
+
+    def change_frequency(self,hz):
+        self.hz = hz
+        if self.running:
+            self.stage.setPWM(self.pwm_channel,hz)
+
+
+class SimFanControl():
+    #same interface as hardware.FanControl
+    def __init__(self,hat,chn=7):
+        self.chn = chn
+        self.hat = hat
+        self.state = 0
+
+    def on(self):
+        self.state = 1
+
+    def off(self):
+        self.state = 0
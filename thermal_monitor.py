@@ -0,0 +1,174 @@
+#CPU temperature / throttling monitor
+#
+#Reads the CPU temperature (/sys/class/thermal) and the cpufreq state of cpu0, keeps statistics of
+#the acquisition timer intervals and can switch the case fan with hysteresis. All sysfs paths are
+#relative to sysfsRoot, so the monitor can be run against a fake directory tree, e.g.
+#
+#       <root>/class/thermal/thermal_zone0/temp                         (milli degC)
+#       <root>/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq         (kHz)
+#       <root>/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq         (kHz)
+#       <root>/devices/system/cpu/cpu0/cpufreq/scaling_governor
+#
+#A lower frequency only means throttling with the "performance" governor; with "ondemand" the
+#kernel also lowers it when idle, so "throttled" is None in that case.
+
+import glob
+import math
+import os
+import time
+
+
+FAN_HYSTERESIS = 1.0    #minimal difference between fan on and off temperature in degC
+
+def readSysfs(path,default=None):
+    try:
+        with open(path,"r") as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+class JitterStats():
+    #statistics of the intervals between timer ticks, reset by snapshot()
+    def __init__(self,lateFactor=1.5):
+        self.lateFactor = lateFactor
+        self.lastTick = None
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sumSq = 0.0
+        self.max = 0.0
+        self.late = 0
+
+    def restart(self):
+        #the timer was stopped or its interval changed, the next tick starts a new interval
+        self.lastTick = None
+
+    def tick(self,nominal,now=None):
+        #nominal: expected interval in s
+        if now == None:
+            now = time.perf_counter()
+        if self.lastTick != None:
+            self.add(now - self.lastTick,nominal)
+        self.lastTick = now
+
+    def add(self,dt,nominal):
+        self.n += 1
+        self.sum += dt
+        self.sumSq += dt*dt
+        if dt > self.max:
+            self.max = dt
+        if dt > self.lateFactor*nominal:
+            self.late += 1
+
+    def snapshot(self):
+        if self.n > 0:
+            mean = self.sum/self.n
+            std = math.sqrt(max(self.sumSq/self.n - mean*mean,0.0))
+        else:
+            mean = 0.0
+            std = 0.0
+        stats = {"ticks": self.n, "meanMS": 1e3*mean, "stdMS": 1e3*std, "maxMS": 1e3*self.max, "late": self.late}
+        self.reset()
+        return stats
+
+
+class ThermalMonitor():
+    def __init__(self,sysfsRoot="/sys",logPath=None,fanOnTemp=65.0,fanOffTemp=55.0,maxLogBytes=1000000):
+        #the log is moved to <logPath>.1 when it grows beyond maxLogBytes, so at most two files are kept
+        self.sysfsRoot = sysfsRoot
+        self.logPath = logPath
+        self.maxLogBytes = maxLogBytes
+        self.setFanTemps(fanOnTemp,fanOffTemp)
+
+        self.fan = None
+        self.jitter = JitterStats()
+        self.last = None
+
+        self.cpufreqDir = os.path.join(sysfsRoot,"devices","system","cpu","cpu0","cpufreq")
+
+    def setFan(self,fan):
+        #fan: FanControl object which is switched by sample(), None for no temperature control
+        self.fan = fan
+
+    def setFanTemps(self,onTemp,offTemp):
+        #swapped values are exchanged and the off temperature is kept FAN_HYSTERESIS below the on temperature,
+        #otherwise fanWanted() would have no hysteresis
+        if offTemp > onTemp:
+            onTemp, offTemp = offTemp, onTemp
+        self.fanOnTemp = onTemp
+        self.fanOffTemp = min(offTemp, onTemp - FAN_HYSTERESIS)
+        return self.fanOnTemp, self.fanOffTemp
+
+    def readTemperature(self):
+        #highest temperature of all thermal zones in degC, None if not available
+        temps = []
+        for path in glob.glob(os.path.join(self.sysfsRoot,"class","thermal","thermal_zone*","temp")):
+            value = readSysfs(path)
+            try:
+                temps.append(int(value)/1e3)
+            except (TypeError, ValueError):
+                pass
+        return max(temps, default=None)
+
+    def readCpuFreq(self):
+        #current and maximum frequency in MHz and the governor
+        def readMHz(name):
+            try:
+                return int(readSysfs(os.path.join(self.cpufreqDir,name)))/1e3
+            except (TypeError, ValueError):
+                return None
+
+        return readMHz("scaling_cur_freq"), readMHz("cpuinfo_max_freq"), readSysfs(os.path.join(self.cpufreqDir,"scaling_governor"),"")
+
+    def fanWanted(self,temp,state):
+        #hysteresis: on above fanOnTemp, off below fanOffTemp, otherwise unchanged
+        if temp == None:
+            return state
+        if temp >= self.fanOnTemp:
+            return 1
+        if temp <= self.fanOffTemp:
+            return 0
+        return state
+
+    def sample(self):
+        temp = self.readTemperature()
+        freq, maxFreq, governor = self.readCpuFreq()
+
+        throttled = None
+        if (governor == "performance") and (freq != None) and (maxFreq != None):
+            throttled = freq < maxFreq
+
+        if self.fan != None:
+            state = self.fanWanted(temp,self.fan.state)
+            if state != self.fan.state:
+                if state:
+                    self.fan.on()
+                else:
+                    self.fan.off()
+
+        sample = {"t": time.time(), "temp": temp, "freqMHz": freq, "maxFreqMHz": maxFreq, "governor": governor,
+                  "throttled": throttled, "fan": None if self.fan == None else self.fan.state}
+        sample.update(self.jitter.snapshot())
+
+        self.last = sample
+        if self.logPath != None:
+            self.log(sample)
+        return sample
+
+    def log(self,sample):
+        keys = ["t", "temp", "freqMHz", "maxFreqMHz", "throttled", "fan", "ticks", "meanMS", "stdMS", "maxMS", "late"]
+        try:
+            newFile = not os.path.exists(self.logPath)
+            if (not newFile) and (self.maxLogBytes != None) and (os.path.getsize(self.logPath) >= self.maxLogBytes):
+                os.replace(self.logPath,self.logPath + ".1")
+                newFile = True
+            with open(self.logPath,"a") as f:
+                if newFile:
+                    f.write(",".join(keys) + "\n")
+                f.write(",".join("" if sample[key] == None else str(sample[key]) for key in keys) + "\n")
+        except OSError as e:
+            print("Could not write the thermal log '" + self.logPath + "': " + str(e))
+            self.logPath = None
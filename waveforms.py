@@ -0,0 +1,75 @@
+#Drive waveforms
+#
+#The z-piezo drive of a force curve as one precomputed voltage table, built from segments:
+#
+#       cosineRamp      smooth start/stop (zero slope at both ends)
+#       linearSweep     constant speed
+#       dwell           constant voltage (hold)
+#
+#forceCurveWaveform() builds the standard sequence (ramp out, approach, hold, retract, ramp back)
+#and is cached per settings combination, so the acquisition loop only walks through a list of
+#floats. A new protocol is a new sequence of segments, the loop in force_curve.acquireForceCurve
+#stays the same.
+
+import functools
+import numpy as np
+
+SWEEPS = ["linear", "sine"]
+
+
+def cosineRamp(v0,v1,n):
+    #n points from v0 towards v1 (v1 itself is the first point of the next segment)
+    i = np.arange(n)
+    return v0 + (v1 - v0)*(1 - np.cos(i*np.pi/n))/2
+
+
+def linearSweep(v0,v1,n):
+    i = np.arange(n)
+    return v0 + (v1 - v0)*i/n
+
+
+def dwell(v,n):
+    return np.full(n, float(v))
+
+
+class DriveWaveform():
+    def __init__(self,segments):
+        #segments: list of (name, voltages)
+        self.names = [name for name, volts in segments]
+        self.volts = np.concatenate([volts for name, volts in segments])
+        self.volts.flags.writeable = False      #shared through the cache
+
+        self.slices = {}
+        start = 0
+        for name, volts in segments:
+            self.slices[name] = slice(start, start + len(volts))
+            start += len(volts)
+
+        #plain Python floats, a_out_write gets them without a NumPy scalar conversion per point
+        self.lists = [(name, self.volts[self.slices[name]].tolist()) for name in self.names]
+
+    def __len__(self):
+        return len(self.volts)
+
+    def segment(self,name):
+        return self.slices[name]
+
+
+@functools.lru_cache(maxsize=16)
+def forceCurveWaveform(forceOffset,retractionVoltage,extensionVoltage,forceDataPoints,retractPnts,holdPnts=0,sweep="linear"):
+    #same voltages as the former inline loops of acquireForceCurve for sweep="linear", holdPnts=0;
+    #"sine" runs approach and retract as the two halves of one cosine period
+    N = int(forceDataPoints/2)
+    top = forceOffset + retractionVoltage
+    bottom = forceOffset + extensionVoltage
+
+    if sweep == "sine":
+        sweepFunc = cosineRamp
+    else:
+        sweepFunc = linearSweep
+
+    return DriveWaveform([("rampOut", cosineRamp(forceOffset, top, retractPnts)),
+                          ("approach", sweepFunc(top, bottom, N)),
+                          ("hold", dwell(bottom, holdPnts)),
+                          ("retract", sweepFunc(bottom, top, N)),
+                          ("rampBack", cosineRamp(top, forceOffset, retractPnts))])